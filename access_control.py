@@ -0,0 +1,191 @@
+"""
+Access Control - In-memory ban list and pre-dispatch filter
+Banned or flooding users are rejected before any handler touches the database
+"""
+
+import logging
+import time
+from collections import deque
+from threading import Thread
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes, TypeHandler
+from pymongo.errors import PyMongoError
+import config
+import metrics
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Telegram IDs of banned users (kept in sync with users.is_banned)
+_banned_ids = set()
+
+# Updates rejected by the pre-dispatch filter
+rejected = {'banned': 0, 'flood': 0}
+
+# Recent update timestamps per user for flood detection
+_recent_updates = {}
+
+# Prune idle flood windows once this many users are tracked
+FLOOD_TRACKED_USERS_MAX = 10000
+
+# Fallback reload interval when change streams are unavailable
+BAN_RELOAD_INTERVAL = 60
+
+BANNED_TEXT = (
+    "🚫 **Account Banned**\n\n"
+    "Your account has been banned from using this bot.\n\n"
+    "If you believe this is an error, please contact support: @Akash_support_bot"
+)
+
+# ============================================
+# BAN LIST
+# ============================================
+
+def load_banned_users():
+    """Load all banned user IDs from MongoDB (called once at startup)"""
+    database = get_db()
+    banned = {
+        doc['telegram_id']
+        for doc in database.users.find({"is_banned": True}, {"telegram_id": 1, "_id": 0})
+    }
+    _banned_ids.clear()
+    _banned_ids.update(banned)
+    logger.info(f"🚫 Ban list loaded: {len(_banned_ids)} users")
+    return len(_banned_ids)
+
+def is_banned(user_id) -> bool:
+    """Check ban list without touching the database"""
+    return user_id in _banned_ids
+
+def ban(user_id):
+    """Add user to in-memory ban list"""
+    _banned_ids.add(user_id)
+
+def unban(user_id):
+    """Remove user from in-memory ban list"""
+    _banned_ids.discard(user_id)
+
+@metrics.register_collector
+def _access_metrics():
+    return [
+        ('banned_users', 'gauge', 'Users in the in-memory ban list', [({}, len(_banned_ids))]),
+        ('access_rejected_total', 'counter', 'Updates rejected before dispatch',
+         [({'reason': reason}, count) for reason, count in rejected.items()])
+    ]
+
+def _watch_bans():
+    """Follow users.is_banned changes via change stream (falls back to polling)"""
+    pipeline = [
+        {"$match": {
+            "operationType": {"$in": ["update", "replace"]},
+            "$or": [
+                {"updateDescription.updatedFields.is_banned": {"$exists": True}},
+                {"operationType": "replace"}
+            ]
+        }}
+    ]
+    
+    while True:
+        try:
+            database = get_db()
+            with database.users.watch(pipeline, full_document='updateLookup') as stream:
+                logger.info("✅ Ban list change stream started")
+                for change in stream:
+                    doc = change.get('fullDocument')
+                    if not doc or 'telegram_id' not in doc:
+                        continue
+                    if doc.get('is_banned', False):
+                        ban(doc['telegram_id'])
+                    else:
+                        unban(doc['telegram_id'])
+        except PyMongoError as e:
+            # Standalone servers don't support change streams - reload periodically
+            logger.warning(f"⚠️ Ban change stream unavailable ({e}), reloading every {BAN_RELOAD_INTERVAL}s")
+            time.sleep(BAN_RELOAD_INTERVAL)
+            try:
+                load_banned_users()
+            except Exception as reload_error:
+                logger.error(f"❌ Ban list reload failed: {reload_error}")
+        except Exception as e:
+            logger.error(f"❌ Ban watcher error: {e}")
+            time.sleep(BAN_RELOAD_INTERVAL)
+
+def start_ban_watcher():
+    """Start ban list watcher in background thread"""
+    t = Thread(target=_watch_bans, name="ban-watcher")
+    t.daemon = True
+    t.start()
+
+# ============================================
+# FLOOD CONTROL
+# ============================================
+
+def is_flooding(user_id, now=None) -> bool:
+    """Sliding-window rate check (FLOOD_MAX_UPDATES per FLOOD_WINDOW_SECONDS)"""
+    now = now if now is not None else time.monotonic()
+    window = _recent_updates.get(user_id)
+    if window is None:
+        window = _recent_updates[user_id] = deque()
+    
+    cutoff = now - config.FLOOD_WINDOW_SECONDS
+    while window and window[0] < cutoff:
+        window.popleft()
+    
+    window.append(now)
+    
+    if len(_recent_updates) > FLOOD_TRACKED_USERS_MAX:
+        _prune_flood_windows(cutoff)
+    
+    return len(window) > config.FLOOD_MAX_UPDATES
+
+def is_flood_exempt(user_id) -> bool:
+    """Admins and leaders upload and moderate in bursts, so they're never flood-limited"""
+    # Checked per update so leaders added at runtime are exempt right away
+    from leaders import LEADERS
+    return user_id in config.ADMIN_IDS or user_id in LEADERS
+
+def _prune_flood_windows(cutoff):
+    """Drop users with no updates inside the current window"""
+    for user_id in [uid for uid, w in _recent_updates.items() if not w or w[-1] < cutoff]:
+        del _recent_updates[user_id]
+
+# ============================================
+# PRE-DISPATCH FILTER (GROUP -1)
+# ============================================
+
+async def access_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Reject banned and flooding users before any other handler runs"""
+    user = update.effective_user
+    if user is None or user.id == config.OWNER_ID:
+        return
+    
+    if is_banned(user.id):
+        rejected['banned'] += 1
+        try:
+            if update.callback_query:
+                await update.callback_query.answer("🚫 Account banned", show_alert=True)
+            elif update.message and update.effective_chat.type == 'private':
+                await update.message.reply_text(BANNED_TEXT, parse_mode='Markdown')
+        except Exception as e:
+            logger.debug(f"Ban notice: {e}")
+        raise ApplicationHandlerStop
+    
+    if not is_flood_exempt(user.id) and is_flooding(user.id):
+        rejected['flood'] += 1
+        logger.warning(f"🌊 Flood from user {user.id}, dropping update")
+        try:
+            if update.callback_query:
+                await update.callback_query.answer("⏳ Too many requests, slow down")
+        except Exception as e:
+            logger.debug(f"Flood notice: {e}")
+        raise ApplicationHandlerStop
+
+def setup_access_handlers(application):
+    """Load ban list and register the pre-dispatch filter"""
+    try:
+        load_banned_users()
+    except Exception as e:
+        logger.error(f"❌ Could not load ban list: {e}")
+    
+    start_ban_watcher()
+    application.add_handler(TypeHandler(Update, access_filter), group=-1)
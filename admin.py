@@ -3,10 +3,7 @@ Complete Admin Panel with Bulk Upload Support
 Replace your entire admin.py with this file
 """
 from referral import admin_referral_stats
-import os
 import logging
-import zipfile
-import io
 import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -17,13 +14,17 @@ from telegram.ext import (
     ContextTypes,
     CallbackQueryHandler
 )
-from telethon import TelegramClient
-from telethon.sessions import StringSession
-from telethon.errors import SessionPasswordNeededError
 import config
-import time
+import access_control
+import identity_map
+import slow_queries
+from spambot_probe import check_account_with_spambot
+from ingestion import extract_session_info, ingest_upload
+from session_loader import read_session, to_string_session
+from archiver import distinct_across_tiers
+import uuid
 from datetime import datetime, timedelta
-from database import get_db, TelegramSession, User, Transaction, Purchase
+from database import get_db, TelegramSession, SessionFingerprint, User, Transaction, Purchase
 from whatsapp_handler import (
     admin_confirm_refund,
     get_all_whatsapp_settings,
@@ -31,81 +32,6 @@ from whatsapp_handler import (
 )
 
 logger = logging.getLogger(__name__)
-TEMP_DIR = "/tmp"
-os.makedirs(TEMP_DIR, exist_ok=True)
-
-async def extract_session_info(client) -> str:
-    """
-    Extract detailed info from session
-    Returns formatted string with account details
-    """
-    try:
-        from telethon.tl.functions.users import GetFullUserRequest
-        
-        info_parts = []
-        
-        # Get user info
-        me = await client.get_me()
-        
-        # 1. Premium status
-        if hasattr(me, 'premium') and me.premium:
-            info_parts.append("Premium")
-        
-        # 2. Verified status
-        if hasattr(me, 'verified') and me.verified:
-            info_parts.append("Verified")
-        
-        # 3. Username
-        if me.username:
-            info_parts.append(f"@{me.username}")
-        
-        # 4. Account age (approximate via user ID)
-        user_id = me.id
-        if user_id < 1000000:
-            info_parts.append("Very old account")
-        elif user_id < 100000000:
-            info_parts.append("Old account (5+ years)")
-        elif user_id < 500000000:
-            info_parts.append("3+ years old")
-        elif user_id < 1000000000:
-            info_parts.append("2+ years old")
-        elif user_id < 2000000000:
-            info_parts.append("1+ year old")
-        else:
-            info_parts.append("New account")
-        
-        # Combine all info (limit to 4 items)
-        if info_parts:
-            return " • ".join(info_parts[:4])
-        else:
-            return None
-            
-    except Exception as e:
-        logger.error(f"Error extracting session info: {e}")
-        return None
-
-def get_temp_path(filename):
-    """Get safe path in /tmp directory"""
-    safe_filename = os.path.basename(filename)
-    return os.path.join(TEMP_DIR, safe_filename)
-
-def cleanup_temp_files(file_path, session_name):
-    """Clean up ALL temporary session files"""
-    cleanup_paths = [
-        file_path,
-        f"{session_name}.session",
-        session_name,
-        f"{session_name}.session-journal",
-        f"{file_path}.session-journal"
-    ]
-    
-    for path in cleanup_paths:
-        try:
-            if os.path.exists(path):
-                os.remove(path)
-                logger.debug(f"🧹 Cleaned: {path}")
-        except Exception as e:
-            logger.debug(f"Could not remove {path}: {e}")
 
 # Conversation states
 (UPLOAD_SESSION, UPLOAD_BULK, GET_COUNTRY, GET_PRICE, GET_2FA, 
@@ -173,71 +99,6 @@ async def admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=reply_markup
     )
 
-async def check_account_with_spambot(client: TelegramClient, phone: str) -> dict:
-    """Check account status using @SpamBot"""
-    try:
-        logger.info(f"🔍 Checking account status for {phone}...")
-        
-        # Start conversation with SpamBot
-        spambot = await client.get_entity('SpamBot')
-        
-        # Send /start command
-        await client.send_message(spambot, '/start')
-        
-        # Wait for response
-        import asyncio
-        await asyncio.sleep(5)
-        
-        # Get messages from SpamBot
-        messages = await client.get_messages(spambot, limit=5)
-        
-        # Check messages for status indicators
-        for msg in messages:
-            if not msg.text:
-                continue
-            
-            text = msg.text.lower()
-            
-            # Check for frozen/blocked
-            if "account was blocked for violations" in text or "your account has been blocked" in text:
-                return {
-                    'status': 'Frozen',
-                    'message': '🔴 Account is BLOCKED',
-                    'success': True
-                }
-            
-            # Check for spam restrictions
-            if ("while the account is limited" in text or 
-                "some actions can trigger a harsh response" in text or 
-                "unfortunately, some phone numbers may trigger a harsh response" in text):
-                return {
-                    'status': 'Spam',
-                    'message': '🟡 Account has SPAM limitations',
-                    'success': True
-                }
-            
-            # Check for clean account
-            if "no limits are currently applied" in text or "free as a bird" in text:
-                return {
-                    'status': 'Free',
-                    'message': '🟢 Account is CLEAN',
-                    'success': True
-                }
-        
-        return {
-            'status': 'Unknown',
-            'message': '❓ Status unclear',
-            'success': False
-        }
-        
-    except Exception as e:
-        logger.error(f"SpamBot check error: {e}")
-        return {
-            'status': 'Error',
-            'message': f'❌ Error: {str(e)}',
-            'success': False
-        }
-
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show bot statistics - FIXED FOR MONGODB"""
     query = update.callback_query
@@ -636,6 +497,7 @@ async def admin_execute_delete_session(update: Update, context: ContextTypes.DEF
         result = database.sessions.delete_one({'_id': ObjectId(session_id)})
         
         if result.deleted_count > 0:
+            SessionFingerprint.release_phone(phone)
             # ✅ FIXED: Return to delete list instead of just showing success
             keyboard = [[InlineKeyboardButton("« Back to Delete List", callback_data='admin_delete_sessions')]]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -809,7 +671,7 @@ async def admin_broadcast_start(update: Update, context: ContextTypes.DEFAULT_TY
         
         # Count users with purchases
         database = get_db()
-        users_with_purchases = database.purchases.distinct('user_id')
+        users_with_purchases = distinct_across_tiers('purchases', 'user_id')
         purchase_count = len(users_with_purchases)
         
         # Count users with balance
@@ -892,7 +754,7 @@ async def receive_broadcast_target(update: Update, context: ContextTypes.DEFAULT
         count = database.users.count_documents({})
         target_name = "All Users"
     elif target == 'buyers':
-        users_with_purchases = database.purchases.distinct('user_id')
+        users_with_purchases = distinct_across_tiers('purchases', 'user_id')
         count = len(users_with_purchases)
         target_name = "Users with Purchases"
     elif target == 'balance':
@@ -1012,7 +874,7 @@ async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if target == 'all':
             users = list(database.users.find({}, {'telegram_id': 1}))
         elif target == 'buyers':
-            user_ids = database.purchases.distinct('user_id')
+            user_ids = distinct_across_tiers('purchases', 'user_id')
             users = list(database.users.find({'telegram_id': {'$in': user_ids}}, {'telegram_id': 1}))
         elif target == 'balance':
             users = list(database.users.find({'balance': {'$gt': 0}}, {'telegram_id': 1}))
@@ -1211,26 +1073,37 @@ async def receive_session_file(update: Update, context: ContextTypes.DEFAULT_TYP
         return UPLOAD_SESSION
     
     try:
-        # Download session file
+        # Download session file (kept in memory)
         file = await context.bot.get_file(document.file_id)
-        file_path = get_temp_path(document.file_name)
-        await file.download_to_drive(file_path)
-        
-        session_name = document.file_name.replace('.session', '')
+        session_bytes = bytes(await file.download_as_bytearray())
         
         await update.message.reply_text("⏳ Validating session and extracting info...")
         
-        # Use absolute path
-        import os
-        abs_file_path = os.path.abspath(file_path)
-        abs_session_name = abs_file_path.replace('.session', '')
+        session_file = read_session(session_bytes)
+        if session_file is None:
+            await update.message.reply_text("❌ Invalid session - not a Telethon .session file")
+            return ConversationHandler.END
+        
+        # Reject exact duplicates before connecting
+        upload_id = context.user_data.setdefault('upload_id', uuid.uuid4().hex)
+        auth_key_hash = SessionFingerprint.hash_auth_key(session_file.auth_key)
+        duplicate = SessionFingerprint.find_duplicate(
+            auth_key_hash, SessionFingerprint.phone_from_filename(document.file_name),
+            uploader_id=user_id, upload_id=upload_id
+        )
+        if duplicate:
+            await update.message.reply_text(
+                f"♻️ Duplicate session - this account is {SessionFingerprint.describe(duplicate)}."
+            )
+            return ConversationHandler.END
         
         client = None
         try:
+            from telethon import TelegramClient
             from telethon.tl.functions.users import GetFullUserRequest
             
             client = TelegramClient(
-                abs_session_name,
+                to_string_session(session_file),
                 config.TELEGRAM_API_ID,
                 config.TELEGRAM_API_HASH,
                 system_version="4.16.30-vxCUSTOM",
@@ -1247,7 +1120,6 @@ async def receive_session_file(update: Update, context: ContextTypes.DEFAULT_TYP
             )
             
             if not is_authorized:
-                cleanup_temp_files(abs_file_path, abs_session_name)
                 await update.message.reply_text(
                     "❌ Invalid session - Not authorized\n\n"
                     "Possible reasons:\n"
@@ -1263,11 +1135,21 @@ async def receive_session_file(update: Update, context: ContextTypes.DEFAULT_TYP
             me = await asyncio.wait_for(client.get_me(), timeout=10.0)
             phone = me.phone if me.phone else "Unknown"
             
+            # Same account under another auth key (re-login)
+            duplicate = SessionFingerprint.claim(auth_key_hash, me.phone, me.id, uploader_id=user_id, upload_id=upload_id)
+            if duplicate:
+                if client.is_connected():
+                    await client.disconnect()
+                await update.message.reply_text(
+                    f"♻️ Duplicate session - {phone} is {SessionFingerprint.describe(duplicate)}."
+                )
+                return ConversationHandler.END
+            
             # ✅ AUTO-EXTRACT SESSION INFO
             auto_info = await extract_session_info(client)
             
             # ✅ CHECK ACCOUNT WITH SPAMBOT
-            spam_check = await check_account_with_spambot(client, phone)
+            spam_check = await check_account_with_spambot(client, phone, user_id=me.id)
             
             # Disconnect after checking
             if client.is_connected():
@@ -1297,25 +1179,24 @@ async def receive_session_file(update: Update, context: ContextTypes.DEFAULT_TYP
             
             caption_parts.append(f"⏰ {datetime.now().strftime('%Y-%m-%d %H:%M')}")
             
-            with open(abs_file_path, 'rb') as f:
-                channel_message = await bot.send_document(
-                    chat_id=config.STORAGE_CHANNEL_ID,
-                    document=f,
-                    filename=document.file_name,
-                    caption="\n".join(caption_parts)
-                )
+            channel_message = await bot.send_document(
+                chat_id=config.STORAGE_CHANNEL_ID,
+                document=session_bytes,
+                filename=document.file_name,
+                caption="\n".join(caption_parts)
+            )
             
             message_id = channel_message.message_id
             
-            cleanup_temp_files(abs_file_path, abs_session_name)
-            
             # Store session info with auto-extracted data
             context.user_data['session_data'] = {
                 'message_id': message_id,
                 'phone': phone,
                 'has_2fa': False,
                 'spam_status': spam_check['status'],
-                'auto_info': auto_info  # ✅ STORE AUTO INFO
+                'auto_info': auto_info,  # ✅ STORE AUTO INFO
+                'auth_key_hash': auth_key_hash,
+                'telegram_id': me.id
             }
             
             # Show result with info
@@ -1347,7 +1228,6 @@ async def receive_session_file(update: Update, context: ContextTypes.DEFAULT_TYP
             )
             if client and client.is_connected():
                 await client.disconnect()
-            cleanup_temp_files(abs_file_path, abs_session_name if 'abs_session_name' in locals() else file_path)
             return ConversationHandler.END
             
         except Exception as e:
@@ -1360,7 +1240,6 @@ async def receive_session_file(update: Update, context: ContextTypes.DEFAULT_TYP
             )
             if client and client.is_connected():
                 await client.disconnect()
-            cleanup_temp_files(abs_file_path, abs_session_name if 'abs_session_name' in locals() else file_path)
             return ConversationHandler.END
         
     except Exception as e:
@@ -1402,6 +1281,7 @@ async def receive_bulk_files(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     if 'bulk_sessions' not in context.user_data:
         context.user_data['bulk_sessions'] = []
+    upload_id = context.user_data.setdefault('upload_id', uuid.uuid4().hex)
     
     # Handle /done command
     if update.message.text:
@@ -1443,222 +1323,10 @@ async def receive_bulk_files(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     try:
         new_file = await context.bot.get_file(file.file_id)
-        
-        # ============================================
-        # Handle ZIP file
-        # ============================================
-        if file_name.endswith('.zip'):
-            import zipfile
-            import io
-            
-            zip_bytes = await new_file.download_as_bytearray()
-            zip_file = zipfile.ZipFile(io.BytesIO(zip_bytes))
-            
-            processed = 0
-            failed = 0
-            failed_files = []
-            
-            # Track spam status
-            spam_stats = {
-                'Free': 0,
-                'Spam': 0,
-                'Frozen': 0,
-                'Unknown': 0,
-                'Error': 0
-            }
-            
-            session_files = [f for f in zip_file.namelist() if f.endswith('.session')]
-            total_files = len(session_files)
-            
-            if total_files == 0:
-                await status_msg.edit_text(
-                    "❌ No .session files found in ZIP!\n\n"
-                    "Make sure your ZIP contains .session files."
-                )
-                return UPLOAD_BULK
-            
-            await status_msg.edit_text(
-                f"📦 Processing ZIP: {total_files} session files found...\n"
-                f"⏳ This may take a while (~5 sec per session)\n\n"
-                f"Progress will be shown below..."
-            )
-            
-            for idx, zip_info in enumerate(session_files, 1):
-                try:
-                    session_bytes = zip_file.read(zip_info)
-                    temp_path = get_temp_path(f"bulk_{idx}_{os.path.basename(zip_info)}")
-                    
-                    with open(temp_path, 'wb') as f:
-                        f.write(session_bytes)
-                    
-                    # ✅ CRITICAL: Send individual status message
-                    processing_msg = await context.bot.send_message(
-                        update.effective_user.id,
-                        f"⏳ Processing {idx}/{total_files}: Checking session..."
-                    )
-                    
-                    result = await process_single_session_bulk(temp_path, update.effective_user.id, context.bot)
-                    
-                    if result:
-                        context.user_data['bulk_sessions'].append(result)
-                        processed += 1
-                        
-                        # Get spam status
-                        spam_status = result.get('spam_status', 'Unknown')
-                        phone = result.get('phone', 'Unknown')
-                        
-                        # Count spam status
-                        if spam_status in spam_stats:
-                            spam_stats[spam_status] += 1
-                        
-                        # ✅ REAL-TIME STATUS MESSAGE WITH EMOJI
-                        status_emoji = {
-                            'Free': '🟢 CLEAN',
-                            'Frozen': '🔴 FROZEN',
-                            'Spam': '🟡 SPAM LIMITED',
-                            'Unknown': '❓ UNKNOWN',
-                            'Error': '❌ CHECK ERROR'
-                        }
-                        
-                        status_text = status_emoji.get(spam_status, f'❓ {spam_status}')
-                        
-                        # Edit the processing message with result
-                        await processing_msg.edit_text(
-                            f"✅ {idx}/{total_files} Processed\n\n"
-                            f"📱 Phone: {phone}\n"
-                            f"📊 Status: {status_text}\n\n"
-                            f"Progress: {processed} success, {failed} failed"
-                        )
-                        
-                        logger.info(f"✅ {idx}/{total_files}: {phone} ({spam_status})")
-                    else:
-                        failed += 1
-                        failed_files.append(os.path.basename(zip_info))
-                        
-                        # Show failure message
-                        await processing_msg.edit_text(
-                            f"❌ {idx}/{total_files} Failed\n\n"
-                            f"File: {os.path.basename(zip_info)}\n"
-                            f"Reason: Invalid or expired session\n\n"
-                            f"Progress: {processed} success, {failed} failed"
-                        )
-                        
-                        logger.warning(f"❌ Failed {idx}/{total_files}: {os.path.basename(zip_info)}")
-                    
-                    # Clean up temp file
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
-                    
-                    # Small delay to avoid flooding
-                    await asyncio.sleep(0.3)
-                    
-                except Exception as e:
-                    logger.error(f"Error processing {zip_info}: {e}")
-                    failed += 1
-                    failed_files.append(os.path.basename(zip_info))
-                    continue
-            
-            # ============================================
-            # Final summary with spam stats
-            # ============================================
-            summary = (
-                f"✅ **ZIP Processing Complete!**\n\n"
-                f"📊 **Results:**\n"
-                f"✅ Successful: {processed}/{total_files}\n"
-                f"❌ Failed: {failed}/{total_files}\n\n"
-            )
-            
-            # Add spam statistics
-            if processed > 0:
-                summary += "📊 **Account Status:**\n"
-                if spam_stats['Free'] > 0:
-                    summary += f"  🟢 Clean: {spam_stats['Free']}\n"
-                if spam_stats['Spam'] > 0:
-                    summary += f"  🟡 Spam Limited: {spam_stats['Spam']}\n"
-                if spam_stats['Frozen'] > 0:
-                    summary += f"  🔴 Frozen: {spam_stats['Frozen']}\n"
-                if spam_stats['Unknown'] > 0:
-                    summary += f"  ❓ Unknown: {spam_stats['Unknown']}\n"
-                if spam_stats['Error'] > 0:
-                    summary += f"  ❌ Check Error: {spam_stats['Error']}\n"
-                summary += "\n"
-            
-            if failed > 0 and len(failed_files) <= 10:
-                summary += "Failed files:\n"
-                for f in failed_files[:10]:
-                    summary += f"• {f}\n"
-                if len(failed_files) > 10:
-                    summary += f"... and {len(failed_files) - 10} more\n"
-                summary += "\n"
-            
-            summary += (
-                f"Total loaded: {len(context.user_data['bulk_sessions'])} sessions\n\n"
-                f"✅ Type /done when finished uploading."
-            )
-            
-            await status_msg.edit_text(summary, parse_mode='Markdown')
-        
-        # ============================================
-        # Handle single .session file
-        # ============================================
-        elif file_name.endswith('.session'):
-            temp_path = get_temp_path(f"single_{int(time.time())}_{file_name}")
-            await new_file.download_to_drive(temp_path)
-            
-            # Show checking message
-            await status_msg.edit_text(f"⏳ Checking {file_name}...")
-            
-            result = await process_single_session_bulk(temp_path, update.effective_user.id, context.bot)
-            
-            if result:
-                context.user_data['bulk_sessions'].append(result)
-                
-                # Get spam status
-                spam_status = result.get('spam_status', 'Unknown')
-                phone = result.get('phone', 'Unknown')
-                
-                # Status emoji
-                status_emoji = {
-                    'Free': '🟢 CLEAN',
-                    'Frozen': '🔴 FROZEN',
-                    'Spam': '🟡 SPAM LIMITED',
-                    'Unknown': '❓ UNKNOWN',
-                    'Error': '❌ CHECK ERROR'
-                }
-                
-                status_text = status_emoji.get(spam_status, f'❓ {spam_status}')
-                
-                await status_msg.edit_text(
-                    f"✅ **Session Added**\n\n"
-                    f"📱 Phone: {phone}\n"
-                    f"📊 Status: {status_text}\n\n"
-                    f"Total: {len(context.user_data['bulk_sessions'])} sessions\n\n"
-                    f"📤 Send more files or type /done to continue.",
-                    parse_mode='Markdown'
-                )
-            else:
-                await status_msg.edit_text(
-                    f"❌ **Failed to process** {file_name}\n\n"
-                    f"Possible reasons:\n"
-                    f"• Session not authorized\n"
-                    f"• Invalid session file\n"
-                    f"• Connection timeout\n\n"
-                    f"Total loaded: {len(context.user_data.get('bulk_sessions', []))} sessions\n\n"
-                    f"📤 Send more files or type /done to continue.",
-                    parse_mode='Markdown'
-                )
-            
-            # Clean up
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-        
-        else:
-            await status_msg.edit_text(
-                "❌ File must be .session or .zip!\n\n"
-                f"Current: {len(context.user_data.get('bulk_sessions', []))} sessions loaded\n\n"
-                f"📤 Send more files or type /done"
-            )
-        
+        await ingest_upload(
+            context.bot, update.effective_user.id, status_msg, file_name, new_file,
+            update.effective_user.id, upload_id, context.user_data['bulk_sessions']
+        )
         return UPLOAD_BULK
         
     except Exception as e:
@@ -1673,112 +1341,6 @@ async def receive_bulk_files(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return UPLOAD_BULK  
 
 
-async def process_single_session_bulk(file_path, user_id, bot):
-    """Process session for bulk upload - WITH AUTO INFO"""
-    session_name = file_path.replace('.session', '')
-    client = None
-    
-    try:
-        from telethon.tl.functions.users import GetFullUserRequest
-        
-        logger.info(f"📦 Processing: {file_path}")
-        
-        if not os.path.exists(file_path):
-            logger.error(f"❌ File not found: {file_path}")
-            return None
-        
-        abs_file_path = os.path.abspath(file_path)
-        abs_session_name = abs_file_path.replace('.session', '')
-        
-        client = TelegramClient(
-            abs_session_name,
-            config.TELEGRAM_API_ID,
-            config.TELEGRAM_API_HASH,
-            system_version="4.16.30-vxCUSTOM",
-            connection_retries=3,
-            retry_delay=2,
-            timeout=10
-        )
-        
-        await asyncio.wait_for(client.connect(), timeout=15.0)
-        
-        is_authorized = await asyncio.wait_for(
-            client.is_user_authorized(), 
-            timeout=10.0
-        )
-        
-        if not is_authorized:
-            logger.warning(f"❌ Not authorized: {file_path}")
-            if client.is_connected():
-                await client.disconnect()
-            cleanup_temp_files(abs_file_path, abs_session_name)
-            return None
-        
-        me = await asyncio.wait_for(client.get_me(), timeout=10.0)
-        phone = me.phone or "Unknown"
-        
-        # ✅ AUTO-EXTRACT INFO
-        auto_info = await extract_session_info(client)
-        
-        # ✅ CHECK SPAMBOT
-        spam_check = await check_account_with_spambot(client, phone)
-        
-        if client.is_connected():
-            await client.disconnect()
-        
-        # Upload to channel
-        status_emoji = {
-            'Free': '🟢',
-            'Frozen': '🔴',
-            'Spam': '🟡',
-            'Unknown': '❓',
-            'Error': '❌'
-        }
-        emoji = status_emoji.get(spam_check['status'], '❓')
-        
-        caption_parts = [
-            f"📱 Phone: {phone}",
-            f"{emoji} Status: {spam_check['status']}"
-        ]
-        
-        if auto_info:
-            caption_parts.append(f"ℹ️ {auto_info}")
-        
-        caption_parts.append(f"⏰ {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-        
-        with open(abs_file_path, 'rb') as f:
-            channel_message = await bot.send_document(
-                chat_id=config.STORAGE_CHANNEL_ID,
-                document=f,
-                filename=os.path.basename(abs_file_path),
-                caption="\n".join(caption_parts)
-            )
-        
-        message_id = channel_message.message_id
-        
-        cleanup_temp_files(abs_file_path, abs_session_name)
-        
-        logger.info(f"✅ Processed: {phone} ({spam_check['status']})")
-        
-        return {
-            'message_id': message_id,
-            'phone': phone,
-            'spam_status': spam_check['status'],
-            'auto_info': auto_info  # ✅ RETURN AUTO INFO
-        }
-        
-    except Exception as e:
-        logger.error(f"❌ Error: {file_path} - {e}")
-        if client and client.is_connected():
-            try:
-                await asyncio.wait_for(client.disconnect(), timeout=5.0)
-            except:
-                pass
-        cleanup_temp_files(abs_file_path if 'abs_file_path' in locals() else file_path,
-                         abs_session_name if 'abs_session_name' in locals() else session_name)
-        return None
-
-
 async def receive_country(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Receive country name"""
     if update.effective_user.id != config.OWNER_ID:
@@ -1983,6 +1545,9 @@ async def confirm_session_upload(update, context):
         return ConversationHandler.END
     
     if query.data == 'admin_confirm_no':
+        SessionFingerprint.release(
+            context.user_data.get('bulk_sessions') or [context.user_data.get('session_data') or {}]
+        )
         context.user_data.clear()
         await query.edit_message_text("❌ Cancelled")
         return ConversationHandler.END
@@ -1991,37 +1556,26 @@ async def confirm_session_upload(update, context):
         # Bulk upload
         if 'bulk_sessions' in context.user_data:
             sessions = context.user_data['bulk_sessions']
-            added_count = 0
-            failed_count = 0
             
             await query.edit_message_text(f"⏳ Adding {len(sessions)} sessions...")
             
-            for session_data in sessions:
-                try:
-                    # ✅ FIX: Add spam_status to database
-                    TelegramSession.create(
-                        session_string=str(session_data['message_id']),
-                        phone_number=session_data['phone'],
-                        country=session_data['country'],
-                        has_2fa=session_data['has_2fa'],
-                        two_fa_password=session_data.get('two_fa_password'),
-                        price=session_data['price'],
-                        info=session_data.get('info'),
-                        spam_status=session_data.get('spam_status', 'Unknown')  # ✅ ADD THIS
-                    )
+            listable = SessionFingerprint.mark_listed_many(sessions, query.from_user.id)
+            duplicate_count = len(sessions) - len(listable)
                     
-                    added_count += 1
-                    
-                except Exception as e:
-                    logger.error(f"❌ Error adding session: {e}")
-                    failed_count += 1
-                    continue
+            # One insert_many for the whole upload (spam_status included)
+            result = TelegramSession.create_many(listable)
+            added_count = len(result['inserted_ids'])
+            failed_count = len(result['failed'])
+            for session_data, reason in result['failed']:
+                logger.error(f"❌ Error adding session {session_data.get('phone')}: {reason}")
             
             result_msg = f"✅ Bulk Upload Complete!\n\n"
             result_msg += f"📦 Added: {added_count}/{len(sessions)} sessions\n"
             
             if failed_count > 0:
                 result_msg += f"❌ Failed: {failed_count} sessions\n"
+            if duplicate_count > 0:
+                result_msg += f"♻️ Duplicates skipped: {duplicate_count}\n"
             
             await query.edit_message_text(result_msg)
         
@@ -2034,6 +1588,15 @@ async def confirm_session_upload(update, context):
                 return ConversationHandler.END
             
             try:
+                if not SessionFingerprint.mark_listed(
+                    session_data.get('auth_key_hash'), session_data['phone'],
+                    session_data.get('telegram_id'), query.from_user.id
+                ):
+                    await query.edit_message_text(
+                        f"♻️ Not added - {session_data['phone']} is already listed in the store."
+                    )
+                    return ConversationHandler.END
+                
                 # ✅ FIX: Add spam_status to database
                 TelegramSession.create(
                     session_string=str(session_data['message_id']),
@@ -2066,6 +1629,19 @@ async def confirm_session_upload(update, context):
     
     return ConversationHandler.END
 
+@admin_only
+async def admin_slow_queries(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show slowest MongoDB query shapes (/slowqueries [reset])"""
+    if context.args and context.args[0].lower() == 'reset':
+        slow_queries.reset()
+        await update.message.reply_text("✅ Slow query report cleared")
+        return
+    
+    text = slow_queries.format_report()
+    # Telegram message limit
+    for start in range(0, len(text), 4000):
+        await update.message.reply_text(text[start:start + 4000])
+
 @admin_only
 async def test_whatsapp_api(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Test TemporaSMS API connection with detailed diagnostics"""
@@ -3401,6 +2977,8 @@ async def receive_balance_amount(update: Update, context: ContextTypes.DEFAULT_T
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         context.user_data['balance_amount'] = amount
+        # One ledger entry per confirmation, however often the button is pressed
+        context.user_data['balance_operation_id'] = uuid.uuid4().hex
         
         await update.message.reply_text(
             f"💰 Confirm Balance Addition\n\n"
@@ -3441,10 +3019,14 @@ async def confirm_balance_addition(update: Update, context: ContextTypes.DEFAULT
     
     user_id = context.user_data['balance_user_id']
     amount = context.user_data['balance_amount']
+    operation_id = context.user_data['balance_operation_id']
     
     try:
         # Update balance using MongoDB method
-        success = User.update_balance(user_id, amount, operation='add')
+        success = User.update_balance(
+            user_id, amount, operation='add', reason='admin_add',
+            idempotency_key=f"admin_add:{operation_id}", ref=f"admin:{query.from_user.id}"
+        )
         
         if success:
             # Get updated user data
@@ -3590,6 +3172,8 @@ async def confirm_ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         if result.modified_count > 0:
+            access_control.ban(user_id)
+            identity_map.evict('users', user_id)
             user = User.get_by_telegram_id(user_id)
             
             await query.edit_message_text(
@@ -3712,6 +3296,8 @@ async def receive_remove_balance_amount(update: Update, context: ContextTypes.DE
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         context.user_data['remove_balance_amount'] = amount
+        # One ledger entry per confirmation, however often the button is pressed
+        context.user_data['remove_balance_operation_id'] = uuid.uuid4().hex
         context.user_data['actual_removed'] = actual_removed
         
         warning = ""
@@ -3756,10 +3342,14 @@ async def confirm_remove_balance(update: Update, context: ContextTypes.DEFAULT_T
     
     user_id = context.user_data['remove_balance_user_id']
     amount = context.user_data['remove_balance_amount']
+    operation_id = context.user_data['remove_balance_operation_id']
     
     try:
         # Remove balance using MongoDB method
-        success = User.update_balance(user_id, amount, operation='subtract')
+        success = User.update_balance(
+            user_id, amount, operation='subtract', reason='admin_remove',
+            idempotency_key=f"admin_remove:{operation_id}", ref=f"admin:{query.from_user.id}"
+        )
         
         if success:
             # Get updated user data
@@ -3906,6 +3496,8 @@ async def confirm_unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         
         if result.modified_count > 0:
+            access_control.unban(user_id)
+            identity_map.evict('users', user_id)
             user = User.get_by_telegram_id(user_id)
             
             await query.edit_message_text(
@@ -4277,6 +3869,7 @@ def setup_admin_handlers(application):
     application.add_handler(CommandHandler("admin", admin_start))
     application.add_handler(CommandHandler('quickcast', quick_broadcast))
     application.add_handler(CommandHandler("referral_stats", admin_referral_stats))
+    application.add_handler(CommandHandler("slowqueries", admin_slow_queries))
     # ❌ REMOVED: application.add_handler(CallbackQueryHandler(admin_edit_info_button, pattern='^admin_edit_info_btn$'))
     # This was causing the issue - it must be in the conversation handler entry_points instead
     application.add_handler(CommandHandler("test_whatsapp", test_whatsapp_api))
@@ -4415,7 +4008,9 @@ def setup_admin_handlers(application):
             CONFIRM_DETAILS: [CallbackQueryHandler(confirm_balance_addition, pattern='^admin_balance_')]
         },
         fallbacks=[CommandHandler('cancel', cancel_operation)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="admin_add_balance",
+        persistent=config.PERSISTENCE_ENABLED
     )
     application.add_handler(balance_conv)
     
@@ -4454,7 +4049,9 @@ def setup_admin_handlers(application):
             REMOVE_BALANCE_CONFIRM: [CallbackQueryHandler(confirm_remove_balance, pattern='^admin_remove_balance_')]
         },
         fallbacks=[CommandHandler('cancel', cancel_operation)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="admin_remove_balance",
+        persistent=config.PERSISTENCE_ENABLED
     )
     application.add_handler(remove_balance_conv)
     logger.info("✅ Remove balance conversation handler registered")
@@ -0,0 +1,314 @@
+"""
+Archiver - Tiered storage for settled history
+Moves settled transactions, WhatsApp orders, purchases and referral commissions
+older than ARCHIVE_AFTER_DAYS from the hot collections into monthly
+<collection>_archive_YYYYMM collections, expires pending deposits past their
+payment window, and reads history transparently across both tiers
+"""
+
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, DESCENDING
+import config
+import leases
+import metrics
+from database import get_db, run_atomically
+
+logger = logging.getLogger(__name__)
+
+# Only one replica archives at a time
+LEASE_NAME = 'archiver'
+leases.register_job(LEASE_NAME)
+
+# Documents moved per batch (one archive insert + hot delete per month in the batch)
+BATCH_SIZE = 1000
+
+# Pending deposits with no window in config.DEPOSIT_EXPIRY_HOURS expire after this long
+DEFAULT_DEPOSIT_EXPIRY = timedelta(hours=48)
+
+# Months with an archive collection, per hot collection
+MANIFEST = 'archive_tiers'
+
+# time_field decides the archive month; only documents matching settled move
+POLICIES = {
+    'transactions': {
+        'time_field': 'created_at',
+        'settled': {"status": {"$nin": ["pending"]}},
+        'indexes': [
+            [("user_id", ASCENDING), ("created_at", DESCENDING)],
+            [("payment_id", ASCENDING)],
+            [("order_id", ASCENDING)]
+        ]
+    },
+    'whatsapp_orders': {
+        'time_field': 'created_at',
+        'settled': {"status": {"$in": ["completed", "cancelled", "refunded", "cancelled_no_refund"]}},
+        'indexes': [
+            [("user_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            [("order_id", ASCENDING)]
+        ]
+    },
+    'purchases': {
+        'time_field': 'purchased_at',
+        'settled': {},
+        'indexes': [
+            [("user_id", ASCENDING), ("purchased_at", DESCENDING), ("_id", DESCENDING)]
+        ]
+    },
+    'referral_commissions': {
+        'time_field': 'created_at',
+        'settled': {},
+        'indexes': [
+            [("user_id", ASCENDING), ("created_at", DESCENDING)]
+        ]
+    }
+}
+
+archived_documents = metrics.Counter(
+    'archived_documents_total', 'Settled documents moved to monthly archive collections', ('collection',)
+)
+
+stats = {
+    'passes': 0,
+    'expired_deposits': 0,
+    'last_pass_seconds': 0.0,
+    'last_pass_archived': 0
+}
+
+# Archive collections whose indexes exist in this process
+_prepared = set()
+
+# ============================================
+# TIERS
+# ============================================
+
+def archive_name(name: str, month: str) -> str:
+    return f"{name}_archive_{month}"
+
+def _month_bounds(month: str):
+    start = datetime(int(month[:4]), int(month[4:]), 1)
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+def archive_months(name: str, database=None) -> list:
+    """Months (YYYYMM) with an archive collection for `name`, oldest first"""
+    database = database if database is not None else get_db()
+    manifest = database[MANIFEST].find_one({"_id": name}) or {}
+    return sorted(manifest.get('months', []))
+
+def find_across_tiers(name: str, query: dict, projection=None, limit: int = 10,
+                      descending: bool = True, bound: datetime = None) -> list:
+    """
+    Documents matching query from the hot collection and its archives,
+    sorted by (time_field, _id) like a single collection would be
+    
+    Archive months are visited nearest first and skipped once they can no
+    longer place a document in the result. bound, when set, is the newest
+    (descending) or oldest (ascending) time the query can match, so months
+    on the other side of it are never queried.
+    """
+    database = get_db()
+    time_field = POLICIES[name]['time_field']
+    order = DESCENDING if descending else ASCENDING
+    sort = [(time_field, order), ("_id", order)]
+    key = lambda document: (document[time_field], document['_id'])
+    
+    found = list(database[name].find(query, projection).sort(sort).limit(limit))
+    for month in sorted(archive_months(name, database), reverse=descending):
+        start, end = _month_bounds(month)
+        if bound is not None and (start > bound if descending else end <= bound):
+            continue
+        if len(found) >= limit:
+            found.sort(key=key, reverse=descending)
+            edge = found[limit - 1][time_field]
+            if (end <= edge) if descending else (start > edge):
+                break
+        found.extend(database[archive_name(name, month)].find(query, projection).sort(sort).limit(limit))
+    
+    found.sort(key=key, reverse=descending)
+    return found[:limit]
+
+def find_one_across_tiers(name: str, query: dict, projection=None):
+    """find_one on the hot collection, then the archives newest first"""
+    database = get_db()
+    document = database[name].find_one(query, projection)
+    if document is not None:
+        return document
+    for month in reversed(archive_months(name, database)):
+        document = database[archive_name(name, month)].find_one(query, projection)
+        if document is not None:
+            return document
+    return None
+
+def _tiers(name: str, database) -> list:
+    return [name] + [archive_name(name, month) for month in archive_months(name, database)]
+
+def _group_across_tiers(name: str, match: dict, total, by: str) -> dict:
+    database = get_db()
+    totals = defaultdict(int)
+    for collection in _tiers(name, database):
+        for row in database[collection].aggregate([
+            {"$match": match},
+            {"$group": {"_id": f"${by}" if by else None, "total": {"$sum": total}}}
+        ]):
+            totals[row['_id']] += row['total']
+    return dict(totals)
+
+def count_across_tiers(name: str, query: dict, by: str = None):
+    """Matching documents in every tier; with by, a {value of by: count} dict"""
+    if by is not None:
+        return _group_across_tiers(name, query, 1, by)
+    database = get_db()
+    return sum(database[collection].count_documents(query) for collection in _tiers(name, database))
+
+def sum_across_tiers(name: str, match: dict, field: str, by: str = None):
+    """Sum of field over matching documents in every tier; with by, a {value of by: sum} dict"""
+    totals = _group_across_tiers(name, match, f"${field}", by)
+    return totals if by is not None else float(totals.get(None, 0.0))
+
+def distinct_across_tiers(name: str, field: str, query: dict = None) -> list:
+    database = get_db()
+    values = set(database[name].distinct(field, query))
+    for month in archive_months(name, database):
+        values.update(database[archive_name(name, month)].distinct(field, query))
+    return list(values)
+
+# ============================================
+# ARCHIVE
+# ============================================
+
+def _prepare_archive(database, name: str, month: str):
+    """Indexes and manifest entry for an archive month, before anything is moved into it"""
+    collection_name = archive_name(name, month)
+    if collection_name in _prepared:
+        return
+    for keys in POLICIES[name]['indexes']:
+        database[collection_name].create_index(keys)
+    database[MANIFEST].update_one({"_id": name}, {"$addToSet": {"months": month}}, upsert=True)
+    _prepared.add(collection_name)
+
+def _copy(database, collection_name: str, documents: list, session):
+    # Skips documents an earlier pass archived before stopping short of its delete
+    archive = database[collection_name]
+    ids = [document['_id'] for document in documents]
+    present = {document['_id'] for document in archive.find({"_id": {"$in": ids}}, {"_id": 1}, session=session)}
+    missing = [document for document in documents if document['_id'] not in present]
+    if missing:
+        archive.insert_many(missing, ordered=False, session=session)
+
+def archive_batch(database, name: str, cutoff: datetime) -> int:
+    """Move one batch of settled documents older than cutoff; returns how many moved"""
+    policy = POLICIES[name]
+    time_field = policy['time_field']
+    query = {time_field: {"$lt": cutoff}, **policy['settled']}
+    
+    batch = list(database[name].find(query).sort("_id", ASCENDING).limit(BATCH_SIZE))
+    if not batch:
+        return 0
+    
+    by_month = defaultdict(list)
+    for document in batch:
+        by_month[document[time_field].strftime('%Y%m')].append(document)
+    for month in by_month:
+        _prepare_archive(database, name, month)
+    
+    ids = [document['_id'] for document in batch]
+    
+    def _move(session):
+        for month, documents in by_month.items():
+            _copy(database, archive_name(name, month), documents, session)
+        deleted = database[name].delete_many({"_id": {"$in": ids}, **query}, session=session).deleted_count
+        if deleted < len(ids):
+            # Changed since it was read: the hot copy stays authoritative
+            kept = {
+                document['_id']
+                for document in database[name].find({"_id": {"$in": ids}}, {"_id": 1}, session=session)
+            }
+            for month, documents in by_month.items():
+                stale = [document['_id'] for document in documents if document['_id'] in kept]
+                if stale:
+                    database[archive_name(name, month)].delete_many({"_id": {"$in": stale}}, session=session)
+        return deleted
+    
+    moved = run_atomically(_move)
+    archived_documents.inc(name, amount=moved)
+    return moved
+
+def expire_pending_deposits(database, now: datetime = None) -> int:
+    """Mark pending deposits past their payment window as expired"""
+    now = now or datetime.utcnow()
+    windows = {method: timedelta(hours=hours) for method, hours in config.DEPOSIT_EXPIRY_HOURS.items()}
+    expired = 0
+    for method, window in windows.items():
+        expired += database.transactions.update_many(
+            {"status": "pending", "payment_method": method, "created_at": {"$lt": now - window}},
+            {"$set": {"status": "expired", "updated_at": now}}
+        ).modified_count
+    expired += database.transactions.update_many(
+        {"status": "pending", "payment_method": {"$nin": list(windows)},
+         "created_at": {"$lt": now - DEFAULT_DEPOSIT_EXPIRY}},
+        {"$set": {"status": "expired", "updated_at": now}}
+    ).modified_count
+    return expired
+
+def archive_pass() -> dict:
+    """Expire stale deposits, then archive every policy's settled backlog; returns moved count per collection"""
+    database = get_db()
+    started = time.perf_counter()
+    
+    expired = expire_pending_deposits(database)
+    stats['expired_deposits'] += expired
+    if expired:
+        logger.info(f"⌛ Expired {expired} pending deposits past their payment window")
+    
+    cutoff = datetime.utcnow() - timedelta(days=config.ARCHIVE_AFTER_DAYS)
+    results = {}
+    for name in POLICIES:
+        moved = 0
+        while leases.is_leader(LEASE_NAME):
+            count = archive_batch(database, name, cutoff)
+            moved += count
+            if count < BATCH_SIZE:
+                break
+        results[name] = moved
+    
+    elapsed = time.perf_counter() - started
+    stats['passes'] += 1
+    stats['last_pass_seconds'] = elapsed
+    stats['last_pass_archived'] = sum(results.values())
+    logger.info(
+        f"🗄️ Archive pass in {elapsed:.1f}s - " +
+        ', '.join(f"{count} {name}" for name, count in results.items())
+    )
+    return results
+
+async def run_archiver():
+    """Archive every ARCHIVE_INTERVAL seconds while this replica holds the lease"""
+    if config.ARCHIVE_INTERVAL <= 0:
+        return
+    
+    while True:
+        if not leases.is_leader(LEASE_NAME):
+            await asyncio.sleep(leases.RENEW_INTERVAL)
+            continue
+        try:
+            await asyncio.to_thread(archive_pass)
+        except Exception as e:
+            logger.error(f"❌ Archive pass failed: {e}")
+        await asyncio.sleep(config.ARCHIVE_INTERVAL)
+
+@metrics.register_collector
+def _archiver_metrics():
+    return [
+        ('archive_passes_total', 'counter', 'Archive passes completed',
+         [({}, stats['passes'])]),
+        ('archive_expired_deposits_total', 'counter', 'Pending deposits expired past their payment window',
+         [({}, stats['expired_deposits'])]),
+        ('archive_last_pass_seconds', 'gauge', 'Duration of the last archive pass',
+         [({}, stats['last_pass_seconds'])]),
+        ('archive_last_pass_documents', 'gauge', 'Documents archived in the last pass',
+         [({}, stats['last_pass_archived'])])
+    ]
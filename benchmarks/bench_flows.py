@@ -0,0 +1,388 @@
+"""
+End-to-end flow benchmark
+Drives the real bot handlers through Application.process_update with synthetic
+updates against a fake Bot API, local MongoDB and fake payment/SMS services,
+and reports throughput and p50/p99 latency per scenario
+
+Scenarios:
+    browse_buy    menu -> country -> session -> purchase and file delivery
+    bulk_buy      menu -> bulk country -> bulk purchase
+    deposit_ton   TON deposit -> payment lands on chain -> "I've Paid"
+    deposit_chain EVM/Tron deposit -> on-chain match by the verification worker
+    whatsapp      WhatsApp number purchase and OTP status via TemporaSMS
+    broadcast     admin broadcast to every user
+    zip_upload    admin ZIP upload of .session files through to confirmation
+
+Usage:
+    python benchmarks/bench_flows.py --users 50 --latency 0.02
+    BENCH_MONGODB_URL=mongodb://localhost:27017 python benchmarks/bench_flows.py --scenarios browse_buy,deposit_ton
+    python benchmarks/bench_flows.py --persistence off   # compare against in-memory conversation state
+"""
+
+import os
+
+os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK')
+
+import local_mongo  # noqa: E402  (must be imported before database)
+
+import argparse
+import asyncio
+import io
+import itertools
+import logging
+import random
+import time
+import zipfile
+
+import telethon
+
+from telegram import Update
+from telegram.ext import Application
+
+import bot
+import config
+import crypto_verification_worker
+import payment_crypto_manual
+import payment_ton
+import whatsapp_handler
+from database import Transaction, User, TelegramSession, get_db
+from fake_services import FakeServices, FakeTelethonClient, TON_PRICE_USD, install_redirect, make_session_file
+from fake_telegram import FakeTelegram, BOT_USER
+from persistence import CONTEXT_TYPES, MongoPersistence
+
+ADMIN_ID = 900000001
+FIRST_USER_ID = 700000001
+TON_WALLET = "UQBenchWalletAddress000000000000000000000000000000"
+COUNTRIES = ['USA', 'India', 'UK']
+SESSION_PRICE = 1.0
+STARTING_BALANCE = 1000.0
+CHAIN_DEPOSITS = ['ETH', 'USDT_ERC20', 'BNB', 'USDT_BEP20', 'TRX']
+
+SCENARIOS = ['browse_buy', 'bulk_buy', 'deposit_ton', 'deposit_chain', 'whatsapp', 'broadcast', 'zip_upload']
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+class ScenarioStats:
+    def __init__(self, name):
+        self.name = name
+        self.steps = []
+        self.flows = []
+        self.ok = 0
+
+# ============================================
+# UPDATE DRIVER
+# ============================================
+
+class Driver:
+    """Builds synthetic updates and times every step of a scenario"""
+    
+    def __init__(self, application, fake):
+        self.application = application
+        self.fake = fake
+        self.stats = None
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+    
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+    
+    def _message(self, user_id, **fields):
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            **fields
+        }
+    
+    async def step(self, awaitable):
+        """Await one step of a flow and record its latency"""
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.stats.steps.append((time.perf_counter() - started) * 1000)
+    
+    async def send(self, payload):
+        payload["update_id"] = next(self._update_ids)
+        update = Update.de_json(payload, self.application.bot)
+        await self.step(self.application.process_update(update))
+    
+    async def click(self, user_id, data):
+        message = self._message(user_id, text="menu")
+        message["from"] = BOT_USER
+        await self.send({"callback_query": {
+            "id": str(next(self._update_ids)),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": message
+        }})
+    
+    async def click_any(self, user_id, prefix):
+        """Click a random button with this prefix from the last keyboard shown to the user"""
+        buttons = self.fake.buttons(user_id, prefix)
+        if not buttons:
+            return None
+        data = random.choice(buttons)
+        await self.click(user_id, data)
+        return data
+    
+    async def text(self, user_id, text):
+        fields = {"text": text}
+        if text.startswith('/'):
+            fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        await self.send({"message": self._message(user_id, **fields)})
+    
+    async def document(self, user_id, file_id, file_name):
+        await self.send({"message": self._message(user_id, document={
+            "file_id": file_id,
+            "file_unique_id": file_id,
+            "file_name": file_name
+        })})
+
+# ============================================
+# SCENARIOS
+# ============================================
+
+async def browse_buy(driver, services, args, user_id):
+    await driver.click(user_id, 'buy_sessions_menu')
+    await driver.click(user_id, 'buy_single_session')
+    if not await driver.click_any(user_id, 'country_session_'):
+        return False
+    if not await driver.click_any(user_id, 'buy_session_'):
+        return False
+    return 'my_purchases' in driver.fake.buttons(user_id)
+
+async def bulk_buy(driver, services, args, user_id):
+    await driver.click(user_id, 'buy_sessions_menu')
+    await driver.click(user_id, 'buy_bulk_sessions')
+    data = await driver.click_any(user_id, 'bulk_country_')
+    if not data:
+        return False
+    country = data.replace('bulk_country_', '')
+    await driver.click(user_id, f'bulk_buy_{country}_{args.bulk_quantity}')
+    return 'my_purchases' in driver.fake.buttons(user_id)
+
+async def deposit_ton(driver, services, args, user_id):
+    await driver.click(user_id, 'deposit_ton')
+    if not await driver.click_any(user_id, 'ton_deposit_'):
+        return False
+    
+    transaction = get_db().transactions.find_one(
+        {"user_id": user_id, "payment_method": "ton", "status": "pending"},
+        sort=[("created_at", -1)]
+    )
+    if not transaction:
+        return False
+    services.pay_ton(transaction['payment_id'], transaction['amount'] / TON_PRICE_USD, TON_WALLET)
+    
+    await driver.click(user_id, f"ton_check_{transaction['_id']}")
+    return Transaction.get_by_id(transaction['_id'])['status'] == 'completed'
+
+async def deposit_chain(driver, services, args, user_id):
+    """The verification worker isn't wired to a handler, so drive its methods directly"""
+    worker = crypto_verification_worker.get_crypto_worker()
+    crypto_type = CHAIN_DEPOSITS[user_id % len(CHAIN_DEPOSITS)]
+    amount_usd = 10.0 + user_id % 90
+    
+    async def create():
+        return await asyncio.to_thread(payment_crypto_manual.create_crypto_deposit, user_id, amount_usd, crypto_type)
+    
+    deposit = await driver.step(create())
+    if not deposit:
+        return False
+    
+    address = crypto_verification_worker.CRYPTO_WALLETS[crypto_type]
+    if crypto_type in ('TRX', 'USDT_TRC20'):
+        services.pay_tron(address, deposit['crypto_amount'])
+    else:
+        api_url = crypto_verification_worker.BLOCKCHAIN_APIS[crypto_type]
+        services.pay_evm(api_url, address, deposit['crypto_amount'], token=crypto_type.startswith('USDT_'))
+    
+    async def verify():
+        txn = Transaction.get_by_id(deposit['transaction_id'])
+        if not await worker.verify_specific_crypto(txn, crypto_type, deposit['crypto_amount']):
+            return False
+        if Transaction.complete_and_credit(txn['_id'], charge_id='auto_verified'):
+            await worker.notify_user(user_id, amount_usd, crypto_type)
+        return True
+    
+    return await driver.step(verify())
+
+async def whatsapp(driver, services, args, user_id):
+    order, error = await driver.step(whatsapp_handler.purchase_whatsapp_number(user_id, '10', 1.0))
+    if not order:
+        return False
+    
+    async def status():
+        return await asyncio.to_thread(whatsapp_handler.temporasms.get_number_status, order['order_id'])
+    
+    result = await driver.step(status())
+    return result.get('status') != 'error'
+
+async def broadcast(driver, services, args, user_id):
+    await driver.text(ADMIN_ID, '/broadcast')
+    await driver.click(ADMIN_ID, 'broadcast_all')
+    await driver.text(ADMIN_ID, "📢 Benchmark broadcast")
+    await driver.click(ADMIN_ID, 'broadcast_send')
+    return driver.fake.calls.get('sendMessage', 0) > 0
+
+_zip_rounds = itertools.count(1)
+
+async def zip_upload(driver, services, args, user_id):
+    round_no = next(_zip_rounds)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        for index in range(args.zip_sessions):
+            zf.writestr(f"acc{index}.session", make_session_file(f"1999{round_no:03d}{index:05d}"))
+    file_id = f"zip-{round_no}"
+    driver.fake.add_file(file_id, archive.getvalue())
+    
+    before = TelegramSession.count_total()
+    await driver.click(ADMIN_ID, 'admin_bulk_upload')
+    await driver.document(ADMIN_ID, file_id, "sessions.zip")
+    await driver.text(ADMIN_ID, '/done')
+    await driver.text(ADMIN_ID, f"Bench{round_no}")
+    await driver.text(ADMIN_ID, str(SESSION_PRICE))
+    await driver.text(ADMIN_ID, 'no')
+    await driver.text(ADMIN_ID, 'skip')
+    await driver.click(ADMIN_ID, 'admin_confirm_yes')
+    return TelegramSession.count_total() - before == args.zip_sessions
+
+# ============================================
+# RUNNER
+# ============================================
+
+def seed(args):
+    """Fresh database with funded users and enough stock for every buy scenario"""
+    database = local_mongo.reset_database()
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    for user_id in [ADMIN_ID] + user_ids:
+        User.create(user_id, username=f"user{user_id}")
+    database.users.update_many({}, {"$set": {"balance": STARTING_BALANCE}})
+    
+    stock = args.users * (1 + args.bulk_quantity) + len(COUNTRIES) * args.bulk_quantity
+    for index in range(stock):
+        TelegramSession.create(
+            session_string=str(100000 + index),
+            phone_number=f"+1555{index:07d}",
+            country=COUNTRIES[index % len(COUNTRIES)],
+            price=SESSION_PRICE,
+            uploader_id=ADMIN_ID
+        )
+    return user_ids
+
+async def run_scenario(name, flow, driver, services, args, user_ids, concurrency):
+    stats = driver.stats = ScenarioStats(name)
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def one(user_id):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                ok = await flow(driver, services, args, user_id)
+            except Exception as e:
+                logging.getLogger(__name__).error(f"{name} flow for {user_id} failed: {e}")
+                ok = False
+            stats.flows.append((time.perf_counter() - started) * 1000)
+            stats.ok += bool(ok)
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(one(user_id) for user_id in user_ids))
+    elapsed = time.perf_counter() - started
+    
+    print(
+        f"{name:<14} {stats.ok:>4}/{len(user_ids):<4} ok | "
+        f"{len(stats.steps) / elapsed:7.1f} steps/s | "
+        f"step p50 {percentile(stats.steps, 50):8.1f} ms p99 {percentile(stats.steps, 99):8.1f} ms | "
+        f"flow p50 {percentile(stats.flows, 50):8.1f} ms p99 {percentile(stats.flows, 99):8.1f} ms"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="comma-separated subset of scenarios")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=16, help="users driven in parallel")
+    parser.add_argument('--latency', type=float, default=0.01, help="fake Bot API / external API latency (s)")
+    parser.add_argument('--bulk-quantity', type=int, default=3)
+    parser.add_argument('--whatsapp-orders', type=int, default=3, help="TemporaSMS getNumber is rate limited to one per 2s")
+    parser.add_argument('--zip-sessions', type=int, default=3)
+    parser.add_argument('--zip-rounds', type=int, default=1)
+    parser.add_argument('--persistence', choices=('on', 'off'), default='on', help="MongoPersistence for conversations and user_data")
+    parser.add_argument('--log-level', default='CRITICAL')
+    args = parser.parse_args()
+    
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    
+    logging.getLogger().setLevel(args.log_level)
+    
+    fake = await FakeTelegram(latency=args.latency).start()
+    services = FakeServices(latency=args.latency).start()
+    install_redirect(services.base_url)
+    
+    config.OWNER_ID = ADMIN_ID
+    # Session checks import TelegramClient from telethon when they run
+    telethon.TelegramClient = FakeTelethonClient
+    FakeTelethonClient.latency = args.latency
+    payment_ton.init_ton_payment(TON_WALLET)
+    crypto_verification_worker.init_crypto_worker(None)
+    
+    user_ids = seed(args)
+    
+    config.PERSISTENCE_ENABLED = args.persistence == 'on'
+    builder = (
+        Application.builder()
+        .token(os.environ['BOT_TOKEN'])
+        .base_url(fake.base_url)
+        .base_file_url(fake.base_file_url)
+        .application_class(bot.BotApplication)
+        .context_types(CONTEXT_TYPES)
+    )
+    if config.PERSISTENCE_ENABLED:
+        builder = builder.persistence(MongoPersistence())
+    application = builder.build()
+    bot.register_handlers(application)
+    logging.getLogger().setLevel(args.log_level)
+    await application.initialize()
+    # Runs the write-behind persistence loop (updates are still fed through process_update)
+    await application.start()
+    crypto_verification_worker.get_crypto_worker().bot = application.bot
+    
+    driver = Driver(application, fake)
+    # Admin flows share one conversation, so they run one at a time
+    flows = {
+        'browse_buy': (browse_buy, user_ids, args.concurrency),
+        'bulk_buy': (bulk_buy, user_ids, args.concurrency),
+        'deposit_ton': (deposit_ton, user_ids, args.concurrency),
+        'deposit_chain': (deposit_chain, user_ids, args.concurrency),
+        'whatsapp': (whatsapp, user_ids[:args.whatsapp_orders], args.concurrency),
+        'broadcast': (broadcast, [ADMIN_ID], 1),
+        'zip_upload': (zip_upload, [ADMIN_ID] * args.zip_rounds, 1)
+    }
+    
+    print(
+        f"{args.users} users, concurrency {args.concurrency}, latency {args.latency * 1000:.0f} ms, "
+        f"backend {local_mongo.BACKEND}"
+    )
+    try:
+        for name in scenarios:
+            flow, targets, concurrency = flows[name]
+            await run_scenario(name, flow, driver, services, args, targets, concurrency)
+    finally:
+        await application.stop()
+        await application.shutdown()
+        services.stop()
+        await fake.stop()
+
+if __name__ == '__main__':
+    asyncio.run(main())
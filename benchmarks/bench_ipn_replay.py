@@ -0,0 +1,79 @@
+"""
+IPN replay benchmark
+Fires duplicate NOWPayments IPNs concurrently at process_ipn_callback and
+checks that the deposit is credited exactly once
+
+Usage:
+    python benchmarks/bench_ipn_replay.py --duplicates 1000 --workers 32
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from local_mongo import BACKEND, reset_database
+
+from database import Transaction, User
+import payment_nowpayments
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duplicates', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=32, help="IPN worker threads (pymongo is blocking)")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.WARNING)
+    db = reset_database()
+    
+    user_id = 424242
+    User.create(user_id, username="bench")
+    order_id = "bench_order_1"
+    Transaction.create(user_id, 25.0, 'nowpayments', payment_id="9001", order_id=order_id)
+    
+    ipn = {
+        "payment_id": 9001,
+        "payment_status": "finished",
+        "order_id": order_id,
+        "price_amount": 25.0,
+        "price_currency": "usd",
+        "pay_amount": 0.0004,
+        "pay_currency": "btc"
+    }
+    signature = payment_nowpayments._sign(payment_nowpayments._payload_json(ipn))
+    
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    latencies = []
+    
+    async def replay():
+        started = time.perf_counter()
+        ok = await loop.run_in_executor(executor, payment_nowpayments.process_ipn_callback, dict(ipn), signature)
+        latencies.append((time.perf_counter() - started) * 1000)
+        return ok
+    
+    started = time.perf_counter()
+    results = await asyncio.gather(*(replay() for _ in range(args.duplicates)))
+    elapsed = time.perf_counter() - started
+    executor.shutdown()
+    
+    balance = User.get_by_telegram_id(user_id)['balance']
+    status = Transaction.get_by_order_id(order_id)['status']
+    ledger = db.ipn_events.count_documents({"payment_id": "9001"})
+    
+    print(f"backend: {BACKEND}")
+    print(f"{args.duplicates} duplicate IPNs, {args.workers} workers: {args.duplicates / elapsed:.0f} IPN/s, "
+          f"p50 {percentile(latencies, 50):.2f} ms, p99 {percentile(latencies, 99):.2f} ms")
+    print(f"acknowledged: {sum(results)}/{args.duplicates} | balance: ${balance:.2f} (expected $25.00) | "
+          f"transaction: {status} | ledger entries: {ledger}")
+    if balance != 25.0:
+        raise SystemExit("❌ Double credit detected")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""
+Session loading benchmark
+Compares opening uploaded .session bytes the old way (temp file in /tmp,
+file-backed SQLiteSession, cleanup of the file and its journal) with the
+in-memory StringSession loader, sequentially and with parallel validation
+
+Usage:
+    python benchmarks/bench_session_load.py --sessions 2000 --parallel 8
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.sessions import SQLiteSession
+
+import session_loader
+from fake_services import make_session_file
+
+TEMP_DIR = "/tmp"
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def load_from_file(index, data):
+    # What the upload handlers did before: write, open with Telethon, clean up
+    file_path = os.path.join(TEMP_DIR, f"bench_load_{os.getpid()}_{index}.session")
+    with open(file_path, 'wb') as f:
+        f.write(data)
+    session = SQLiteSession(file_path.replace('.session', ''))
+    try:
+        return session.auth_key
+    finally:
+        session.close()
+        for path in (file_path, f"{file_path}-journal"):
+            if os.path.exists(path):
+                os.remove(path)
+
+def load_in_memory(index, data):
+    return session_loader.to_string_session(session_loader.read_session(data)).auth_key
+
+async def run(name, loader, sessions, parallel):
+    semaphore = asyncio.Semaphore(parallel)
+    latencies = []
+    
+    async def one(index, data):
+        async with semaphore:
+            started = time.perf_counter()
+            auth_key = await asyncio.to_thread(loader, index, data)
+            latencies.append((time.perf_counter() - started) * 1000)
+            assert auth_key is not None
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index, data) for index, data in enumerate(sessions)))
+    elapsed = time.perf_counter() - started
+    
+    print(
+        f"{name:<22} x{parallel:<3} {len(sessions) / elapsed:9.0f} sessions/s | "
+        f"p50 {percentile(latencies, 50):7.3f} ms | p99 {percentile(latencies, 99):7.3f} ms"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--parallel', type=int, default=8, help="concurrent validations (ingest authorize workers)")
+    args = parser.parse_args()
+    
+    sessions = [make_session_file(f"1888{index:07d}") for index in range(args.sessions)]
+    print(f"{args.sessions} sessions of {len(sessions[0])} bytes, deserialize={session_loader.CAN_DESERIALIZE}")
+    for parallel in sorted({1, args.parallel}):
+        await run("temp file + SQLite", load_from_file, sessions, parallel)
+        await run("in-memory", load_in_memory, sessions, parallel)
+
+if __name__ == '__main__':
+    asyncio.run(main())
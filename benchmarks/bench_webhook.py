@@ -0,0 +1,135 @@
+"""
+Webhook ingestion benchmark
+Posts synthetic updates to http_server against a fake Telegram Bot API
+and reports throughput and end-to-end latency per processing mode
+
+Usage:
+    python benchmarks/bench_webhook.py --updates 2000 --users 200 --handler-latency 0.02
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp
+from telegram.ext import Application, MessageHandler, filters
+
+import config
+import http_server
+from fake_telegram import FakeTelegram
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def make_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": "ping"
+        }
+    }
+
+async def run_mode(name, concurrent_updates, args, fake):
+    sent_at = {}
+    done_at = {}
+    all_done = asyncio.Event()
+    
+    async def handler(update, context):
+        await asyncio.sleep(args.handler_latency)
+        await context.bot.send_message(update.effective_chat.id, "pong")
+        done_at[update.update_id] = time.perf_counter()
+        if len(done_at) >= args.updates:
+            all_done.set()
+    
+    application = (
+        Application.builder()
+        .token("123456:BENCHMARK")
+        .base_url(fake.base_url)
+        .concurrent_updates(concurrent_updates)
+        .build()
+    )
+    application.add_handler(MessageHandler(filters.TEXT, handler))
+    
+    config.WEBHOOK_PORT = free_port()
+    config.WEBHOOK_URL = f"http://127.0.0.1:{config.WEBHOOK_PORT}"
+    config.WEBHOOK_SECRET = "bench-secret"
+    stop_event = asyncio.Event()
+    server = asyncio.create_task(http_server.run_webhook(application, stop_event=stop_event))
+    
+    # Wait for the webhook to be registered with the fake
+    while fake.calls.get('setWebhook', 0) <= args.mode_index:
+        await asyncio.sleep(0.01)
+    
+    url = f"{config.WEBHOOK_URL}/{config.WEBHOOK_PATH}"
+    headers = {http_server.SECRET_HEADER: config.WEBHOOK_SECRET}
+    semaphore = asyncio.Semaphore(args.connections)
+    
+    async def post(session, update_id):
+        payload = make_update(update_id, 1 + update_id % args.users)
+        async with semaphore:
+            sent_at[update_id] = time.perf_counter()
+            async with session.post(url, json=payload, headers=headers) as response:
+                assert response.status == 200, response.status
+    
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(post(session, i) for i in range(1, args.updates + 1)))
+    accepted = time.perf_counter() - started
+    
+    await asyncio.wait_for(all_done.wait(), timeout=600)
+    finished = time.perf_counter() - started
+    
+    stop_event.set()
+    await server
+    
+    latencies = [(done_at[i] - sent_at[i]) * 1000 for i in done_at]
+    print(
+        f"{name:<28} accepted {args.updates / accepted:8.0f} upd/s | "
+        f"processed {args.updates / finished:8.0f} upd/s | "
+        f"p50 {percentile(latencies, 50):8.1f} ms | p99 {percentile(latencies, 99):8.1f} ms"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--connections', type=int, default=40, help="parallel webhook connections (Telegram max_connections)")
+    parser.add_argument('--handler-latency', type=float, default=0.02, help="simulated DB work per update (s)")
+    parser.add_argument('--api-latency', type=float, default=0.01, help="fake Bot API latency (s)")
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+    
+    fake = await FakeTelegram(latency=args.api_latency).start()
+    modes = [
+        ("sequential", False),
+        (f"per-user x{args.concurrency}", http_server.PerUserUpdateProcessor(args.concurrency)),
+    ]
+    print(f"{args.updates} updates from {args.users} users, {args.connections} connections")
+    try:
+        for index, (name, concurrent_updates) in enumerate(modes):
+            args.mode_index = index
+            await run_mode(name, concurrent_updates, args, fake)
+    finally:
+        await fake.stop()
+
+if __name__ == '__main__':
+    asyncio.run(main())
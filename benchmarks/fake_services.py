@@ -0,0 +1,351 @@
+"""
+Fake external services - local stand-ins for benchmarks
+TonCenter/TonAPI, CoinGecko/Binance/CryptoCompare, Etherscan-family explorers,
+TronScan and TemporaSMS served from one aiohttp app, plus an in-process
+Telethon client for session checks
+"""
+
+import asyncio
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from aiohttp import web
+
+TON_PRICE_USD = 5.5
+
+CRYPTO_PRICES_USD = {'BTC': 65000.0, 'ETH': 3000.0, 'BNB': 600.0, 'TRX': 0.25, 'SOL': 150.0}
+
+ETHERSCAN_HOSTS = (
+    'api.etherscan.io',
+    'api.bscscan.com',
+    'api.basescan.org',
+    'api-optimistic.etherscan.io',
+    'api.arbiscan.io'
+)
+
+# Hosts whose requests.* calls are answered by FakeServices
+REDIRECTED_HOSTS = (
+    'toncenter.com',
+    'tonapi.io',
+    'api.coingecko.com',
+    'api.binance.com',
+    'min-api.cryptocompare.com',
+    'apilist.tronscanapi.com',
+    'api.temporasms.com'
+) + ETHERSCAN_HOSTS
+
+# Explorers only return the most recent transactions
+EXPLORER_PAGE_SIZE = 100
+TRONSCAN_PAGE_SIZE = 50
+
+
+class FakeServices:
+    """
+    Blockchain explorer, price feed and SMS provider stand-in
+    
+    Runs in its own thread with its own event loop: the bot calls these APIs
+    with blocking `requests`, which would deadlock a server on the bot's loop.
+    Call install_redirect(services.base_url) to route requests.* here.
+    """
+    
+    def __init__(self, latency: float = 0.0, port: int = 0):
+        self.latency = latency
+        self.port = port
+        self.calls = {}
+        self.ton_transactions = []
+        # (host, action) -> etherscan-style transaction list
+        self.evm_transactions = {}
+        self.tron_transactions = []
+        self.sms_orders = {}
+        self._order_ids = itertools.count(100000)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._runner = None
+        self._thread = None
+    
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+    
+    # ============================================
+    # CHAIN STATE
+    # ============================================
+    
+    def pay_ton(self, memo: str, amount_ton: float, wallet: str = ''):
+        """Record an incoming TON transfer carrying memo as its comment"""
+        with self._lock:
+            self.ton_transactions.insert(0, {
+                "utime": int(time.time()),
+                "transaction_id": {"hash": f"ton-{len(self.ton_transactions)}", "lt": "0"},
+                "in_msg": {
+                    "source": "EQbenchpayer",
+                    "destination": wallet,
+                    "value": str(int(amount_ton * 1e9)),
+                    "message": memo
+                }
+            })
+    
+    def pay_evm(self, api_url: str, address: str, amount: float, token: bool = False):
+        """Record an incoming native (wei) or token (6 decimals) transfer on an Etherscan-style chain"""
+        host = urlsplit(api_url).hostname
+        action = 'tokentx' if token else 'txlist'
+        with self._lock:
+            transactions = self.evm_transactions.setdefault((host, action), [])
+            transaction = {
+                "timeStamp": str(int(time.time())),
+                "hash": f"0x{host[:4]}{len(transactions):060x}",
+                "to": address,
+                "value": str(int(round(amount * (1e6 if token else 1e18))))
+            }
+            if token:
+                transaction["tokenDecimal"] = "6"
+            transactions.insert(0, transaction)
+    
+    def pay_tron(self, address: str, amount_trx: float):
+        """Record an incoming TRX transfer"""
+        with self._lock:
+            self.tron_transactions.insert(0, {
+                "timestamp": int(time.time() * 1000),
+                "hash": f"tron-{len(self.tron_transactions)}",
+                "toAddress": address,
+                "amount": int(amount_trx * 1e6)
+            })
+    
+    # ============================================
+    # ROUTES
+    # ============================================
+    
+    def _toncenter(self, path):
+        if path.endswith('/getTransactions'):
+            return web.json_response({"ok": True, "result": self.ton_transactions[:EXPLORER_PAGE_SIZE]})
+        if path.endswith('/transactions'):
+            return web.json_response({"transactions": self.ton_transactions[:EXPLORER_PAGE_SIZE]})
+        return web.json_response({"ok": False}, status=404)
+    
+    def _prices(self, host):
+        if host == 'api.coingecko.com':
+            return web.json_response({"the-open-network": {"usd": TON_PRICE_USD}})
+        if host == 'api.binance.com':
+            return web.json_response([
+                {"symbol": f"{symbol}USDT", "price": str(price)}
+                for symbol, price in CRYPTO_PRICES_USD.items()
+            ])
+        return web.json_response({symbol: {"USD": price} for symbol, price in CRYPTO_PRICES_USD.items()})
+    
+    def _etherscan(self, host, query):
+        transactions = self.evm_transactions.get((host, query.get('action')), [])[:EXPLORER_PAGE_SIZE]
+        if not transactions:
+            return web.json_response({"status": "0", "message": "No transactions found", "result": []})
+        return web.json_response({"status": "1", "message": "OK", "result": transactions})
+    
+    def _temporasms(self, query):
+        action = query.get('action')
+        if action == 'getBalance':
+            return web.Response(text="ACCESS_BALANCE:1000.00")
+        if action == 'getNumber':
+            order_id = str(next(self._order_ids))
+            self.sms_orders[order_id] = 'STATUS_OK:123456'
+            return web.Response(text=f"ACCESS_NUMBER:{order_id}:84{order_id}999")
+        if action == 'getStatus':
+            return web.Response(text=self.sms_orders.get(query.get('id'), 'NO_ACTIVATION'))
+        if action == 'setStatus':
+            self.sms_orders.pop(query.get('id'), None)
+            return web.Response(text="ACCESS_CANCEL" if query.get('status') == '8' else "ACCESS_ACTIVATION")
+        return web.Response(text="BAD_ACTION")
+    
+    async def _handle(self, request: web.Request) -> web.Response:
+        host = request.match_info['host']
+        path = '/' + request.match_info['path']
+        self.calls[host] = self.calls.get(host, 0) + 1
+        
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        
+        if host == 'toncenter.com':
+            return self._toncenter(path)
+        if host == 'tonapi.io':
+            return web.json_response({"transactions": []})
+        if host in ('api.coingecko.com', 'api.binance.com', 'min-api.cryptocompare.com'):
+            return self._prices(host)
+        if host in ETHERSCAN_HOSTS:
+            return self._etherscan(host, request.query)
+        if host == 'apilist.tronscanapi.com':
+            return web.json_response({"data": self.tron_transactions[:TRONSCAN_PAGE_SIZE]})
+        if host == 'api.temporasms.com':
+            return self._temporasms(request.query)
+        return web.Response(status=404)
+    
+    # ============================================
+    # LIFECYCLE
+    # ============================================
+    
+    async def _serve(self, ready: threading.Event):
+        app = web.Application()
+        app.router.add_route('*', '/{host}/{path:.*}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        ready.set()
+    
+    def start(self):
+        ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+        
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._serve(ready))
+            self._loop.run_forever()
+        
+        self._thread = threading.Thread(target=run, name="fake-services", daemon=True)
+        self._thread.start()
+        ready.wait(timeout=10)
+        return self
+    
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+
+
+_original_send = requests.adapters.HTTPAdapter.send
+
+def install_redirect(base_url: str):
+    """Rewrite requests.* calls to REDIRECTED_HOSTS onto {base_url}/{host}{path}"""
+    target = urlsplit(base_url)
+    
+    def send(adapter, request, **kwargs):
+        url = urlsplit(request.url)
+        if url.hostname in REDIRECTED_HOSTS:
+            request.url = urlunsplit((target.scheme, target.netloc, f"/{url.hostname}{url.path}", url.query, ''))
+        return _original_send(adapter, request, **kwargs)
+    
+    requests.adapters.HTTPAdapter.send = send
+
+# ============================================
+# TELETHON STAND-IN
+# ============================================
+
+SPAMBOT_CLEAN_REPLY = "Good news, no limits are currently applied to your account. You're free as a bird!"
+
+def make_session_file(phone: str, dc_id: int = 4) -> bytes:
+    """
+    Telethon-format .session bytes for a fake account
+    
+    The phone is stored at the start of the auth key so FakeTelethonClient can
+    tell accounts apart whether the session is opened from a file or in memory.
+    """
+    connection = sqlite3.connect(':memory:')
+    try:
+        connection.execute("CREATE TABLE version (version integer primary key)")
+        connection.execute("INSERT INTO version VALUES (7)")
+        connection.execute(
+            "CREATE TABLE sessions (dc_id integer primary key, server_address text, "
+            "port integer, auth_key blob, takeout_id integer)"
+        )
+        connection.execute(
+            "INSERT INTO sessions VALUES (?, ?, ?, ?, NULL)",
+            (dc_id, '149.154.167.91', 443, phone.encode().ljust(256, b'\0'))
+        )
+        connection.commit()
+        return connection.serialize()
+    finally:
+        connection.close()
+
+def _phone_from_auth_key(key) -> str:
+    return (key or b'').rstrip(b'\0').decode('utf-8', 'ignore')
+
+class FakeTelethonClient:
+    """
+    Drop-in for telethon.TelegramClient in session checks
+    
+    MTProto can't be pointed at a local server, so this answers in-process.
+    The account phone is read from the session's auth key (make_session_file).
+    """
+    
+    latency = 0.0
+    _user_ids = itertools.count(1500000000)
+    
+    def __init__(self, session, api_id=None, api_hash=None, **kwargs):
+        self.session = session
+        self._connected = False
+        self._handlers = []
+    
+    async def _round_trip(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+    
+    async def connect(self):
+        await self._round_trip()
+        self._connected = True
+    
+    def is_connected(self):
+        return self._connected
+    
+    async def disconnect(self):
+        self._connected = False
+    
+    async def is_user_authorized(self):
+        await self._round_trip()
+        return True
+    
+    async def get_me(self):
+        await self._round_trip()
+        phone = ''
+        auth_key = getattr(self.session, 'auth_key', None)
+        if auth_key is not None:
+            phone = _phone_from_auth_key(auth_key.key)
+        elif isinstance(self.session, str) and os.path.exists(f"{self.session}.session"):
+            connection = sqlite3.connect(f"{self.session}.session")
+            try:
+                row = connection.execute("SELECT auth_key FROM sessions").fetchone()
+            finally:
+                connection.close()
+            phone = _phone_from_auth_key(row[0] if row else None)
+        return SimpleNamespace(
+            id=next(self._user_ids),
+            phone=phone or None,
+            username=None,
+            premium=False,
+            verified=False,
+            first_name="Bench"
+        )
+    
+    async def get_entity(self, entity):
+        await self._round_trip()
+        return SimpleNamespace(id=178220800, username=str(entity))
+    
+    async def get_input_entity(self, entity):
+        return await self.get_entity(entity)
+    
+    def add_event_handler(self, callback, event=None):
+        self._handlers.append(callback)
+    
+    def remove_event_handler(self, callback, event=None):
+        if callback in self._handlers:
+            self._handlers.remove(callback)
+    
+    async def _reply(self, text):
+        # SpamBot answers one round trip after /start
+        await self._round_trip()
+        for callback in list(self._handlers):
+            await callback(SimpleNamespace(raw_text=text))
+    
+    async def send_message(self, entity, message, **kwargs):
+        await self._round_trip()
+        if getattr(entity, 'username', None) == 'SpamBot':
+            asyncio.get_running_loop().create_task(self._reply(SPAMBOT_CLEAN_REPLY))
+        return SimpleNamespace(id=1, text=message)
+    
+    async def get_messages(self, entity, limit=None, **kwargs):
+        await self._round_trip()
+        return [SimpleNamespace(id=2, text=SPAMBOT_CLEAN_REPLY)]
@@ -0,0 +1,151 @@
+"""
+Fake Telegram Bot API - local aiohttp server for benchmarks
+Answers every Bot API method with a plausible result after a configurable delay
+and serves file downloads for getFile
+"""
+
+import asyncio
+import itertools
+import json
+import time
+from aiohttp import web
+
+BOT_USER = {
+    "id": 1000000001,
+    "is_bot": True,
+    "first_name": "Bench Bot",
+    "username": "bench_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False
+}
+
+
+class FakeTelegram:
+    """
+    Minimal Bot API stand-in
+    
+    Point a bot at it with ApplicationBuilder().base_url(fake.base_url)
+    and .base_file_url(fake.base_file_url)
+    """
+    
+    # Served for file_ids that were not registered with add_file
+    DEFAULT_FILE = b"benchmark session file"
+    
+    def __init__(self, latency: float = 0.0, port: int = 0):
+        self.latency = latency
+        self.port = port
+        self.calls = {}
+        # chat_id -> inline keyboard of the last message sent or edited there
+        self.keyboards = {}
+        self._files = {}
+        self._message_ids = itertools.count(1)
+        self._runner = None
+    
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+    
+    @property
+    def base_file_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/file/bot"
+    
+    def add_file(self, file_id: str, data: bytes):
+        """Make data downloadable via getFile(file_id)"""
+        self._files[file_id] = data
+    
+    def buttons(self, chat_id: int, prefix: str = '') -> list:
+        """callback_data of the last keyboard shown in chat_id, filtered by prefix"""
+        keyboard = self.keyboards.get(chat_id) or []
+        return [
+            button['callback_data']
+            for row in keyboard for button in row
+            if button.get('callback_data', '').startswith(prefix)
+        ]
+    
+    def _chat_id(self, params) -> int:
+        try:
+            return int(params.get('chat_id', 1))
+        except (TypeError, ValueError):
+            return 1
+    
+    def _message(self, params, with_document: bool = False) -> dict:
+        message_id = next(self._message_ids)
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": self._chat_id(params), "type": "private"},
+            "from": BOT_USER,
+            "text": params.get('text', '')
+        }
+        if with_document:
+            message["document"] = {
+                "file_id": f"doc-{message_id}",
+                "file_unique_id": f"doc-{message_id}",
+                "file_name": "account.session"
+            }
+        return message
+    
+    def _remember_keyboard(self, params):
+        markup = params.get('reply_markup')
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        if isinstance(markup, dict) and 'inline_keyboard' in markup:
+            self.keyboards[self._chat_id(params)] = markup['inline_keyboard']
+    
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] = self.calls.get(method, 0) + 1
+        
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        
+        lowered = method.lower()
+        if lowered == 'getme':
+            result = BOT_USER
+        elif lowered in ('sendmessage', 'editmessagetext', 'sendphoto'):
+            self._remember_keyboard(params)
+            result = self._message(params)
+        elif lowered in ('senddocument', 'forwardmessage', 'copymessage'):
+            result = self._message(params, with_document=True)
+        elif lowered == 'getfile':
+            file_id = params.get('file_id', '')
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_path": f"documents/{file_id}"}
+        elif lowered == 'sendmediagroup':
+            media = params.get('media', '[]')
+            if isinstance(media, str):
+                media = json.loads(media)
+            result = [self._message(params, with_document=True) for _ in media]
+        elif lowered == 'getupdates':
+            result = []
+        else:
+            result = True
+        
+        return web.json_response({"ok": True, "result": result})
+    
+    async def _download(self, request: web.Request) -> web.Response:
+        self.calls['download'] = self.calls.get('download', 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        file_id = request.match_info['path'].rsplit('/', 1)[-1]
+        return web.Response(body=self._files.get(file_id, self.DEFAULT_FILE))
+    
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        app.router.add_get('/file/bot{token}/{path:.*}', self._download)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+    
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
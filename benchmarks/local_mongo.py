@@ -0,0 +1,39 @@
+"""
+Local MongoDB for benchmarks
+Uses BENCH_MONGODB_URL (e.g. a local mongod) when set, otherwise an
+in-process mongomock stand-in. Must be imported before database.py.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_MONGODB_URL = os.getenv('BENCH_MONGODB_URL')
+
+if BENCH_MONGODB_URL:
+    os.environ['MONGODB_URL'] = BENCH_MONGODB_URL
+    BACKEND = f"mongod ({BENCH_MONGODB_URL})"
+else:
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("Set BENCH_MONGODB_URL or `pip install mongomock` to run benchmarks")
+    import pymongo
+    # database.py does `from pymongo import MongoClient` at import time
+    pymongo.MongoClient = mongomock.MongoClient
+    BACKEND = "mongomock (in-process)"
+
+import database  # noqa: E402
+
+
+def reset_database():
+    """Drop all collections in the bot database and recreate indexes"""
+    db = database.get_db()
+    # Let the startup index build finish before dropping collections under it
+    database.schema_ready.wait()
+    for name in db.list_collection_names():
+        db.drop_collection(name)
+    database.create_indexes()
+    database.create_default_settings()
+    return db
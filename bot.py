@@ -1,5 +1,9 @@
+import startup
 import logging
 import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -8,16 +12,22 @@ from telegram.ext import (
 )
 from leaders import setup_leader_handlers
 from seller import setup_seller_handlers
-from telethon import TelegramClient
-from telethon.sessions import StringSession
 import config
-from database import init_db, get_db, User, TelegramSession, Transaction, Purchase, SystemSettings
-from payment_razorpay import create_order, usd_to_inr
-from payment import create_charge
-from keep_alive import keep_alive
+import archiver
+import identity_map
+import instrumentation
+import inventory_sweeper
+import leases
+import settings_cache
+from persistence import CONTEXT_TYPES, MongoPersistence
+from database import get_db, ping_db, create_critical_indexes, User, TelegramSession, Transaction, Purchase, SystemSettings
 from admin_seller_commands import admin_pending_sellers, admin_pending_withdrawals
-from session_handler import get_available_sessions_by_country, purchase_session, get_user_purchases, get_otp_from_session
+from session_handler import get_available_sessions_by_country, purchase_session, get_otp_from_session
+from purchase_history import PAGE_SIZE, history_page
 from admin import setup_admin_handlers
+from access_control import setup_access_handlers
+from ledger_reconciler import start_reconciler
+from http_server import PerUserUpdateProcessor, run_webhook, start_http_server, stop_http_server
 from payment_nowpayments import (
     create_payment as create_nowpayment,
     get_currency_display_name,
@@ -34,7 +44,7 @@ from whatsapp_handler import (
     get_whatsapp_countries,
     purchase_whatsapp_number,
     monitor_whatsapp_order,
-    get_user_whatsapp_purchases,
+    resume_order_monitors,
     get_whatsapp_price
 )
 
@@ -50,8 +60,6 @@ logger = logging.getLogger(__name__)
 try:
     from payment_ton import init_ton_payment, get_ton_payment
     from payment_worker import init_payment_worker, start_payment_worker
-    import qrcode
-    import io
     TON_AVAILABLE = True
     logger.info("✅ TON imports successful")
 except ImportError as e:
@@ -64,38 +72,20 @@ except ImportError as e:
 CUSTOM_DEPOSIT, BUY_BULK_QUANTITY, BUY_BULK_CUSTOM_QUANTITY = range(3)
 
 def get_min_deposit():
-    """Get minimum deposit from MongoDB settings"""
+    """Get minimum deposit from cached settings"""
     try:
-        settings = SystemSettings.get()
-        if settings:
-            min_deposit = settings.get('min_deposit', 1.0)
-            logger.info(f"📊 Min deposit: ${min_deposit}")
-            return min_deposit
-        return 1.0
+        return settings_cache.min_deposit()
     except Exception as e:
         logger.error(f"❌ Error getting min deposit: {e}")
         return 1.0
 
-# Initialize database
-init_db()
-
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start command - WITH REFERRAL SUPPORT"""
     user = update.effective_user
     
-    # Check if user exists first
+    # Check if user exists first (banned users are rejected by access_filter)
     existing_user = User.get_by_telegram_id(user.id)
     
-    # ✅ CHECK IF USER IS BANNED
-    if existing_user and existing_user.get('is_banned', False):
-        await update.message.reply_text(
-            "🚫 **Account Banned**\n\n"
-            "Your account has been banned from using this bot.\n\n"
-            "If you believe this is an error, please contact support: @Akash_support_bot",
-            parse_mode='Markdown'
-        )
-        return
-    
     # ✅ CHECK FOR REFERRAL CODE in /start command
     referrer_id = None
     if context.args and len(context.args) > 0:
@@ -325,8 +315,18 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     if query.data.startswith('purchases_page_'):
-        page = int(query.data.replace('purchases_page_', ''))
-        await show_my_purchases(query, user_id, page)
+        # Offset pages from before keyset pagination - start over
+        await show_my_purchases(query, user_id)
+        return
+    
+    if query.data.startswith(('purchases_o_', 'purchases_n_')):
+        page, cursor, newer = _parse_history_callback(query.data)
+        await show_my_purchases(query, user_id, page, cursor, newer)
+        return
+    
+    if query.data.startswith(('history_o_', 'history_n_')):
+        page, cursor, newer = _parse_history_callback(query.data)
+        await show_purchase_history(query, user_id, page, cursor, newer)
         return
     
     # ============================================
@@ -909,6 +909,7 @@ async def receive_custom_deposit(update: Update, context: ContextTypes.DEFAULT_T
 
 async def process_crypto_deposit(query, user_id, amount):
     """Process crypto deposit request"""
+    from payment import create_charge
     charge = create_charge(amount, user_id)
     
     if charge:
@@ -935,6 +936,7 @@ async def process_crypto_deposit(query, user_id, amount):
 
 async def process_crypto_deposit_inline(update, context, user_id, amount):
     """Process crypto deposit from message (custom amount)"""
+    from payment import create_charge
     charge = create_charge(amount, user_id)
     
     if charge:
@@ -973,6 +975,7 @@ async def process_inr_deposit(query, user_id, amount):
         )
         return
     
+    from payment_razorpay import create_order
     order = create_order(amount, user_id)
     
     if order:
@@ -1002,6 +1005,7 @@ async def process_inr_deposit(query, user_id, amount):
 
 async def process_inr_deposit_inline(update, context, user_id, amount):
     """Process INR deposit from message (custom amount)"""
+    from payment_razorpay import create_order
     order = create_order(amount, user_id)
     
     if order:
@@ -2144,16 +2148,41 @@ async def process_whatsapp_purchase(query, country_id, context):
         await query.edit_message_text(f"❌ Error: {str(e)}")
 
 
-async def show_purchase_history(query, user_id):
-    """Show unified purchase history - Telegram + WhatsApp"""
+def _history_nav_row(prefix, page, history):
+    """⬅️ / page / ➡️ row for a keyset-paginated purchase list"""
+    total_pages = max(1, (history.total + PAGE_SIZE - 1) // PAGE_SIZE)
+    nav_row = []
+    if history.newer:
+        nav_row.append(InlineKeyboardButton(
+            "⬅️ Previous",
+            callback_data=f'{prefix}_n_{max(page - 1, 0)}_{history.newer}'
+        ))
+    
+    nav_row.append(InlineKeyboardButton(
+        f"📄 {page + 1}/{max(total_pages, page + 1)}",
+        callback_data='none'
+    ))
+    
+    if history.older:
+        nav_row.append(InlineKeyboardButton(
+            "Next ➡️",
+            callback_data=f'{prefix}_o_{page + 1}_{history.older}'
+        ))
+    return nav_row
+
+def _parse_history_callback(data):
+    """(page, cursor, newer) from '<prefix>_<o|n>_<page>_<cursor>' callback data"""
+    _, direction, page, cursor = data.split('_', 3)
+    return int(page), cursor, direction == 'n'
+
+async def show_purchase_history(query, user_id, page=0, cursor=None, newer=False):
+    """Show unified purchase history - Telegram + WhatsApp, newest first (10 per page)"""
     try:
-        # Get Telegram purchases
-        telegram_purchases = await get_user_purchases(user_id)
-        
-        # Get WhatsApp purchases
-        whatsapp_purchases = await get_user_whatsapp_purchases(user_id)
+        history = await history_page(user_id, cursor=cursor, newer=newer)
+        if history.newer is None:
+            page = 0
         
-        if not telegram_purchases and not whatsapp_purchases:
+        if not history.entries:
             keyboard = [
                 [InlineKeyboardButton("🛒 Buy Numbers", callback_data='buy_numbers')],
                 [InlineKeyboardButton("« Back", callback_data='back_menu')]
@@ -2168,33 +2197,26 @@ async def show_purchase_history(query, user_id):
         
         message = "📦 **Your Purchase History**\n\n"
         
-        # Show WhatsApp purchases
-        if whatsapp_purchases:
-            message += "📱 **WhatsApp Numbers:**\n\n"
-            for i, purchase in enumerate(whatsapp_purchases[:10], 1):
-                message += f"{i}. 📱 {purchase['phone_number']}\n"
-                message += f"   🌍 {purchase['country_name']}\n"
-                message += f"   🔑 OTP: `{purchase.get('otp_code', 'N/A')}`\n"
-                message += f"   📅 {purchase['created_at'].strftime('%Y-%m-%d %H:%M')}\n\n"
-        
-        # Show Telegram purchases
-        if telegram_purchases:
-            message += "📞 **Telegram Numbers:**\n\n"
-            for i, purchase in enumerate(telegram_purchases[:10], 1):
-                message += f"{i}. 📱 {purchase.phone_number}\n"
+        for i, purchase in enumerate(history.entries, start=page * PAGE_SIZE + 1):
+            if purchase.source == 'whatsapp':
+                message += f"{i}. 📱 WhatsApp {purchase.phone_number}\n"
+                message += f"   🌍 {purchase.country}\n"
+                message += f"   🔑 OTP: `{purchase.otp_code or 'N/A'}`\n"
+            else:
+                message += f"{i}. 📞 Telegram {purchase.phone_number}\n"
                 message += f"   🌍 {purchase.country}\n"
-                message += f"   📅 {purchase.purchased_at.strftime('%Y-%m-%d %H:%M')}\n"
                 if purchase.has_2fa:
                     message += f"   🔐 2FA: `{purchase.two_fa_password}`\n"
-                message += "\n"
+            message += f"   📅 {purchase.purchased_at.strftime('%Y-%m-%d %H:%M')}\n\n"
         
-        total = len(whatsapp_purchases) + len(telegram_purchases)
-        message += f"Total purchases: {total}"
+        message += f"Total purchases: {history.total}"
         
-        keyboard = [
-            [InlineKeyboardButton("🛒 Buy More", callback_data='buy_numbers')],
-            [InlineKeyboardButton("« Back", callback_data='back_menu')]
-        ]
+        keyboard = []
+        nav_row = _history_nav_row('history', page, history)
+        if len(nav_row) > 1:  # Only add if there's pagination
+            keyboard.append(nav_row)
+        keyboard.append([InlineKeyboardButton("🛒 Buy More", callback_data='buy_numbers')])
+        keyboard.append([InlineKeyboardButton("« Back", callback_data='back_menu')])
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await query.edit_message_text(
@@ -2209,15 +2231,14 @@ async def show_purchase_history(query, user_id):
         traceback.print_exc()
         await query.edit_message_text("❌ Error loading purchase history")
 
-async def show_my_purchases(query, user_id, page=0):
+async def show_my_purchases(query, user_id, page=0, cursor=None, newer=False):
     """Show user's purchase history - WITH PAGINATION (10 per page)"""
     try:
-        ITEMS_PER_PAGE = 10
+        history = await history_page(user_id, sources=('telegram',), cursor=cursor, newer=newer)
+        if history.newer is None:
+            page = 0
         
-        # Get all purchases
-        all_purchases = await get_user_purchases(user_id)
-        
-        if not all_purchases:
+        if not history.entries:
             keyboard = [
                 [InlineKeyboardButton("🛒 Buy Numbers", callback_data='buy_numbers')],
                 [InlineKeyboardButton("« Back", callback_data='back_menu')]
@@ -2230,17 +2251,10 @@ async def show_my_purchases(query, user_id, page=0):
             )
             return
         
-        total_purchases = len(all_purchases)
-        total_pages = (total_purchases + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
+        total_pages = max(1, (history.total + PAGE_SIZE - 1) // PAGE_SIZE)
+        message = f"📦 Your Purchases (Page {page + 1}/{max(total_pages, page + 1)})\n\n"
         
-        # Get purchases for current page
-        start_idx = page * ITEMS_PER_PAGE
-        end_idx = start_idx + ITEMS_PER_PAGE
-        purchases = all_purchases[start_idx:end_idx]
-        
-        message = f"📦 Your Purchases (Page {page + 1}/{total_pages})\n\n"
-        
-        for i, purchase in enumerate(purchases, start=start_idx + 1):
+        for i, purchase in enumerate(history.entries, start=page * PAGE_SIZE + 1):
             message += f"{i}. 📱 {purchase.phone_number}\n"
             message += f"   🌍 {purchase.country}\n"
             message += f"   📅 {purchase.purchased_at.strftime('%Y-%m-%d %H:%M')}\n"
@@ -2249,32 +2263,14 @@ async def show_my_purchases(query, user_id, page=0):
                 message += f"   🔐 2FA: `{purchase.two_fa_password}`\n"
             message += "\n"
         
-        message += f"Total purchases: {total_purchases}\n\n"
+        message += f"Total purchases: {history.total}\n\n"
         message += "⚠️ Session strings not shown here for security.\n"
         message += "Contact support if you need session recovery."
         
         # Build keyboard with pagination
         keyboard = []
         
-        # Pagination row
-        nav_row = []
-        if page > 0:
-            nav_row.append(InlineKeyboardButton(
-                "⬅️ Previous",
-                callback_data=f'purchases_page_{page-1}'
-            ))
-        
-        nav_row.append(InlineKeyboardButton(
-            f"📄 {page + 1}/{total_pages}",
-            callback_data='none'
-        ))
-        
-        if page < total_pages - 1:
-            nav_row.append(InlineKeyboardButton(
-                "Next ➡️",
-                callback_data=f'purchases_page_{page+1}'
-            ))
-        
+        nav_row = _history_nav_row('purchases', page, history)
         if len(nav_row) > 1:  # Only add if there's pagination
             keyboard.append(nav_row)
         
@@ -2476,15 +2472,8 @@ async def admin_credit_ton(update: Update, context: ContextTypes.DEFAULT_TYPE):
             payment_id=f"manual_{tx_hash}"
         )
         
-        # Update transaction to completed
-        Transaction.update_status(
-            transaction_id,
-            'completed',
-            charge_id=tx_hash
-        )
-        
-        # Credit user balance
-        success = User.update_balance(target_user_id, amount, operation='add')
+        # Complete transaction and credit user balance
+        success = Transaction.complete_and_credit(transaction_id, charge_id=tx_hash)
         
         if success:
             # Get updated balance
@@ -2674,24 +2663,16 @@ async def handle_admin_credit_callback(update: Update, context: ContextTypes.DEF
                 await query.edit_message_text("⚠️ Already credited!")
                 return
             
-            # Credit user balance
-            success = User.update_balance(
-                transaction['user_id'], 
-                transaction['amount'], 
-                operation='add'
-            )
-            
-            if not success:
-                await query.edit_message_text("❌ User not found")
-                return
-            
-            # Update transaction status
-            Transaction.update_status(
+            # Complete transaction and credit user balance
+            credited = Transaction.complete_and_credit(
                 obj_id,
-                'completed',
                 charge_id=f'MANUAL_ADMIN_{query.from_user.id}'
             )
             
+            if not credited:
+                await query.edit_message_text("⚠️ Already credited!")
+                return
+            
             # Get updated user
             user = User.get_by_telegram_id(transaction['user_id'])
             new_balance = user['balance'] if user else 0.0
@@ -3229,6 +3210,7 @@ async def process_ton_deposit(query, user_id, amount):
         
         # Generate QR code
         try:
+            import qrcode
             qr = qrcode.QRCode(version=1, box_size=10, border=5)
             qr.add_data(payment_info['wallet_address'])
             qr.make(fit=True)
@@ -3533,13 +3515,9 @@ async def handle_admin_credit_callback(update: Update, context: ContextTypes.DEF
                 return
             
             # Credit user
-            User.update_balance(
-                transaction['user_id'],
-                transaction['amount'],
-                operation='add'
-            )
-            
-            Transaction.update_status(ObjectId(transaction_id), 'completed')
+            if not Transaction.complete_and_credit(ObjectId(transaction_id)):
+                await query.edit_message_text("✅ Already credited")
+                return
             
             user_obj = User.get_by_telegram_id(transaction['user_id'])
             
@@ -3564,73 +3542,18 @@ async def handle_admin_credit_callback(update: Update, context: ContextTypes.DEF
             logger.error(f"Error: {e}")
             await query.edit_message_text(f"❌ Error: {e}")
 
-"""
-FIXED MAIN FUNCTION - Resolves "Event loop is closed" error
-Replace your main() function with this
-"""
-
-def main():
-    """Start the bot - FIXED HANDLER REGISTRATION ORDER"""
-    # ============================================
-    # START WEB SERVER
-    # ============================================
-    keep_alive()
+class BotApplication(Application):
+    """Application that scopes an identity map to every processed update and times every handler"""
     
-    logger.info("=" * 70)
-    logger.info("🚀 STARTING TELEGRAM BOT")
-    logger.info("=" * 70)
-    
-    # ============================================
-    # TEST MONGODB CONNECTION
-    # ============================================
-    try:
-        from database import get_db
-        db = get_db()
-        logger.info("✅ MongoDB connected successfully")
-    except Exception as e:
-        logger.error(f"❌ CRITICAL: MongoDB connection failed: {e}")
-        logger.error("Bot cannot start without database!")
-        return
-    
-    # ============================================
-    # TEST BOT TOKEN AND GET BOT INFO
-    # ============================================
-    try:
-        import requests
-        response = requests.get(f"https://api.telegram.org/bot{config.BOT_TOKEN}/getMe")
-        if response.status_code == 200:
-            bot_info = response.json()['result']
-            logger.info(f"✅ Bot token valid: @{bot_info['username']}")
-            
-            # ✅ SET BOT USERNAME FOR REFERRAL SYSTEM
-            try:
-                set_bot_username(bot_info['username'])
-                logger.info(f"✅ Bot username set for referrals: @{bot_info['username']}")
-            except Exception as e:
-                logger.error(f"⚠️ Could not set bot username: {e}")
-        else:
-            logger.error(f"❌ CRITICAL: Invalid bot token!")
-            return
-    except Exception as e:
-        logger.error(f"❌ CRITICAL: Cannot connect to Telegram: {e}")
-        return
-    
-    # ============================================
-    # BUILD APPLICATION
-    # ============================================
-    try:
-        application = (
-            Application.builder()
-            .token(config.BOT_TOKEN)
-            .build()
-        )
-        logger.info("✅ Application created")
-    except Exception as e:
-        logger.error(f"❌ CRITICAL: Cannot create application: {e}")
-        import traceback
-        traceback.print_exc()
-        return
+    async def process_update(self, update: object) -> None:
+        with identity_map.scope():
+            await super().process_update(update)
     
+    def add_handler(self, handler, group: int = 0) -> None:
+        super().add_handler(instrumentation.instrument_handler(handler), group)
+
+def register_handlers(application):
+    """Register error handler, access filter and all bot handlers in priority order"""
     # ============================================
     # ADD ERROR HANDLER FIRST
     # ============================================
@@ -3638,15 +3561,10 @@ def main():
     logger.info("✅ Error handler registered")
     
     # ============================================
-    # INITIALIZE TON PAYMENT (OPTIONAL)
+    # ACCESS FILTER (GROUP -1 - RUNS BEFORE EVERYTHING)
     # ============================================
-    if TON_AVAILABLE and hasattr(config, 'TON_MASTER_WALLET') and config.TON_MASTER_WALLET:
-        try:
-            api_key = getattr(config, 'TON_API_KEY', None)
-            init_ton_payment(config.TON_MASTER_WALLET, api_key)
-            logger.info("✅ TON Payment initialized")
-        except Exception as e:
-            logger.warning(f"⚠️ TON initialization failed: {e}")
+    setup_access_handlers(application)
+    logger.info("✅ Access filter registered (group=-1)")
     
     logger.info("=" * 70)
     logger.info("📝 REGISTERING HANDLERS")
@@ -3677,7 +3595,9 @@ def main():
             ]
         },
         fallbacks=[CommandHandler('cancel', cancel_custom_deposit)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="custom_deposit",
+        persistent=config.PERSISTENCE_ENABLED
     )
     application.add_handler(deposit_conv, group=0)  # ✅ GROUP 0 = HIGHEST PRIORITY
     logger.info("✅ Deposit conversation registered (group=0)")
@@ -3693,7 +3613,9 @@ def main():
             ]
         },
         fallbacks=[CommandHandler('cancel', cancel_custom_deposit)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="bulk_custom_quantity",
+        persistent=config.PERSISTENCE_ENABLED
     )
     application.add_handler(bulk_custom_conv, group=0)  # ✅ GROUP 0
     logger.info("✅ Bulk custom conversation registered (group=0)")
@@ -3770,10 +3692,155 @@ def main():
     application.add_handler(CallbackQueryHandler(button_callback), group=1)
     logger.info("✅ Main callback handler registered (group=1 - catches remaining callbacks)")
     
+# ============================================
+# STARTUP CHECKS
+# ============================================
+
+def _timed_check(name, check):
+    """Run one connectivity check and record its duration in the startup report"""
+    started = time.perf_counter()
+    try:
+        return check()
+    finally:
+        startup.record(name, time.perf_counter() - started)
+
+def _check_mongodb():
+    """Wait for MongoDB and the idempotency indexes, then load the settings cache and start background workers"""
+    ping_db()
+    create_critical_indexes()
+    settings_cache.start_settings_watcher()
+    leases.start()
+    start_reconciler()
+
+def _check_bot_token():
+    """getMe via the Bot API; returns the bot info, or None when the token is rejected"""
+    import requests
+    response = requests.get(f"https://api.telegram.org/bot{config.BOT_TOKEN}/getMe", timeout=15)
+    if response.status_code != 200:
+        return None
+    return response.json()['result']
+
+async def _startup_complete(application):
+    """Start jobs that need the bot, then log the startup report"""
+    asyncio.create_task(resume_order_monitors(application.bot))
+    asyncio.create_task(inventory_sweeper.run_sweeper(application.bot))
+    asyncio.create_task(archiver.run_archiver())
+    startup.mark('bot_initialize')
+    startup.finish()
+
+async def _start_polling_services(application):
+    """post_init for polling: health / IPN / metrics server, then the startup report"""
+    await start_http_server(application)
+    await _startup_complete(application)
+
+def main():
+    """Start the bot - FIXED HANDLER REGISTRATION ORDER"""
+    logger.info("=" * 70)
+    logger.info("🚀 STARTING TELEGRAM BOT")
+    logger.info("=" * 70)
+    
+    startup.mark('imports')
+    instrumentation.install()
+    
+    # ============================================
+    # TEST MONGODB CONNECTION AND BOT TOKEN (CONCURRENTLY)
+    # Indexes and default settings are built in the background by init_db()
+    # ============================================
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup-check") as executor:
+        mongo_check = executor.submit(_timed_check, 'mongodb', _check_mongodb)
+        token_check = executor.submit(_timed_check, 'bot_token', _check_bot_token)
+    startup.mark('connectivity_checks')
+    
+    try:
+        mongo_check.result()
+    except Exception as e:
+        logger.error(f"❌ CRITICAL: MongoDB connection failed: {e}")
+        logger.error("Bot cannot start without database!")
+        return
+    
+    try:
+        bot_info = token_check.result()
+    except Exception as e:
+        logger.error(f"❌ CRITICAL: Cannot connect to Telegram: {e}")
+        return
+    
+    if bot_info is None:
+        logger.error(f"❌ CRITICAL: Invalid bot token!")
+        return
+    
+    logger.info(f"✅ Bot token valid: @{bot_info['username']}")
+    
+    # ✅ SET BOT USERNAME FOR REFERRAL SYSTEM
+    try:
+        set_bot_username(bot_info['username'])
+        logger.info(f"✅ Bot username set for referrals: @{bot_info['username']}")
+    except Exception as e:
+        logger.error(f"⚠️ Could not set bot username: {e}")
+    
+    # ============================================
+    # BUILD APPLICATION
+    # ============================================
+    try:
+        builder = (
+            Application.builder()
+            .token(config.BOT_TOKEN)
+            .application_class(BotApplication)
+            .context_types(CONTEXT_TYPES)
+            .concurrent_updates(PerUserUpdateProcessor(config.CONCURRENT_UPDATES))
+        )
+        if config.PERSISTENCE_ENABLED:
+            builder = builder.persistence(MongoPersistence())
+        application = builder.build()
+        logger.info("✅ Application created")
+    except Exception as e:
+        logger.error(f"❌ CRITICAL: Cannot create application: {e}")
+        import traceback
+        traceback.print_exc()
+        return
+    
+    # ============================================
+    # INITIALIZE TON PAYMENT (OPTIONAL)
+    # ============================================
+    if TON_AVAILABLE and hasattr(config, 'TON_MASTER_WALLET') and config.TON_MASTER_WALLET:
+        try:
+            api_key = getattr(config, 'TON_API_KEY', None)
+            init_ton_payment(config.TON_MASTER_WALLET, api_key)
+            logger.info("✅ TON Payment initialized")
+        except Exception as e:
+            logger.warning(f"⚠️ TON initialization failed: {e}")
+    
+    register_handlers(application)
+    startup.mark('build_application')
+    
+    # ============================================
+    # START WEBHOOK (WHEN ENABLED AND PUBLIC URL IS KNOWN)
+    # ============================================
+    if config.WEBHOOK_ENABLED and config.WEBHOOK_URL:
+        logger.info("=" * 70)
+        logger.info("🚀 Starting bot with webhook...")
+        logger.info("=" * 70)
+        application.post_init = _startup_complete
+        try:
+            asyncio.run(run_webhook(application))
+        except KeyboardInterrupt:
+            logger.info("\n🛑 Bot stopped by user")
+        except Exception as e:
+            logger.error(f"❌ Webhook error: {e}")
+            import traceback
+            traceback.print_exc()
+        return
+    
+    if config.WEBHOOK_ENABLED:
+        logger.warning("⚠️ WEBHOOK_ENABLED but no WEBHOOK_URL set - falling back to polling")
+    
     logger.info("=" * 70)
     logger.info("🚀 Starting bot with polling...")
     logger.info("=" * 70)
     
+    # Health / IPN / metrics server runs inside the polling event loop
+    application.post_init = _start_polling_services
+    application.post_shutdown = stop_http_server
+    
     # ============================================
     # START POLLING (SIMPLE, NO MANUAL EVENT LOOP)
     # ============================================
@@ -1,4 +1,5 @@
 import os
+import hashlib
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -38,6 +39,49 @@ SESSION_PRICE = 1.0
 # Webhook settings
 WEBHOOK_ENABLED = os.getenv('WEBHOOK_ENABLED', 'false').lower() == 'true'
 WEBHOOK_PORT = int(os.getenv('PORT', 5000))
+WEBHOOK_URL = os.getenv('WEBHOOK_URL') or os.getenv('RENDER_EXTERNAL_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or hashlib.sha256((BOT_TOKEN or '').encode()).hexdigest()[:32]
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+
+# Updates processed concurrently (sequential per user)
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 16))
+
+# Flood control (updates per user per window)
+FLOOD_MAX_UPDATES = int(os.getenv('FLOOD_MAX_UPDATES', 30))
+FLOOD_WINDOW_SECONDS = int(os.getenv('FLOOD_WINDOW_SECONDS', 10))
+
+# Slow query profiler (0 disables; sample rate applies to caller capture and explain)
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', 0))
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv('SLOW_QUERY_SAMPLE_RATE', 0.1))
+
+# Conversation state / user_data persistence in MongoDB (written behind handlers every flush interval)
+PERSISTENCE_ENABLED = os.getenv('PERSISTENCE_ENABLED', 'true').lower() == 'true'
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv('PERSISTENCE_FLUSH_INTERVAL', 5))
+
+# Cold-start budget: warn when bot.py takes longer than this to start serving (0 disables)
+STARTUP_BUDGET_SECONDS = float(os.getenv('STARTUP_BUDGET_SECONDS', 10))
+
+# Unsold inventory health sweep (seconds between sweeps, 0 disables - opt in; concurrent checks per API credential)
+INVENTORY_SWEEP_INTERVAL = int(os.getenv('INVENTORY_SWEEP_INTERVAL', 0))
+INVENTORY_SWEEP_CONCURRENCY = int(os.getenv('INVENTORY_SWEEP_CONCURRENCY', 3))
+
+# Session ingestion pipeline (workers per stage via INGEST_<STAGE>_CONCURRENCY; sessions waiting between stages)
+INGEST_CONCURRENCY = {
+    stage: int(os.getenv(f'INGEST_{stage.upper()}_CONCURRENCY', default))
+    for stage, default in (('dedupe', 2), ('authorize', 4), ('profile', 4), ('spam_probe', 4), ('store', 2))
+}
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 4))
+
+# Settled history archival into monthly <collection>_archive_YYYYMM collections (seconds between passes, 0 disables; days kept hot)
+ARCHIVE_INTERVAL = int(os.getenv('ARCHIVE_INTERVAL', 21600))
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 90))
+
+# Pending deposits expire after their payment window (hours per method via DEPOSIT_<METHOD>_EXPIRY_HOURS)
+DEPOSIT_EXPIRY_HOURS = {
+    method: float(os.getenv(f'DEPOSIT_{method.upper()}_EXPIRY_HOURS', default))
+    for method, default in (('ton', 24), ('crypto_manual', 48), ('nowpayments', 48), ('razorpay', 24))
+}
 # Add these lines to your config.py file
 
 # NOWPayments Configuration
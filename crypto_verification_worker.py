@@ -10,9 +10,14 @@ import requests
 from datetime import datetime, timedelta
 from database import get_db, Transaction, User
 from bson.objectid import ObjectId
+import leases
 
 logger = logging.getLogger(__name__)
 
+# Only one replica polls the explorers and credits deposits
+LEASE_NAME = 'crypto_verification'
+leases.register_job(LEASE_NAME)
+
 # ============================================
 # YOUR API KEYS
 # ============================================
@@ -142,22 +147,12 @@ class CryptoVerificationWorker:
                     if verified:
                         logger.info(f"✅ AUTO-VERIFIED: ${txn['amount']} for user {txn['user_id']} ({crypto_type})")
                         
-                        # Credit user
-                        User.update_balance(
-                            txn['user_id'],
-                            txn['amount'],
-                            operation='add'
-                        )
-                        
-                        # Update transaction
-                        Transaction.update_status(
-                            txn['_id'],
-                            'completed',
-                            charge_id='auto_verified'
-                        )
+                        # Complete transaction and credit user
+                        credited = Transaction.complete_and_credit(txn['_id'], charge_id='auto_verified')
                         
                         # Notify user
-                        await self.notify_user(txn['user_id'], txn['amount'], crypto_type)
+                        if credited:
+                            await self.notify_user(txn['user_id'], txn['amount'], crypto_type)
                     
                     # Small delay between checks
                     await asyncio.sleep(2)
@@ -638,7 +633,8 @@ async def start_crypto_worker(self):
     
     while self.running:
         try:
-            await self.check_pending_payments()
+            if leases.is_leader(LEASE_NAME):
+                await self.check_pending_payments()
             await asyncio.sleep(self.check_interval)
         except Exception as e:
             logger.error(f"❌ Worker error: {e}")
@@ -2,11 +2,22 @@
 MongoDB Database Module - COMPLETE FIXED VERSION
 """
 
-from pymongo import MongoClient, ASCENDING, DESCENDING
-from datetime import datetime
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
+import hashlib
 import logging
+import os
+import re
+import sqlite3
+import threading
+import time
 import config
+import identity_map
+import settings_cache
+from instrumentation import mongo_listener
+from slow_queries import slow_query_listener
 from bson.objectid import ObjectId
 
 logger = logging.getLogger(__name__)
@@ -15,60 +26,155 @@ logger = logging.getLogger(__name__)
 client = None
 db = None
 
+_init_lock = threading.Lock()
+_schema_thread = None
+
+# Set once create_indexes() and create_default_settings() have finished
+schema_ready = threading.Event()
+
+# Referral ancestors stored on each user (nearest first)
+REFERRAL_PATH_DEPTH = 10
+
+# Levels counted in users.referral_stats (level_1, level_2)
+REFERRAL_COUNTED_LEVELS = 2
+
 def init_db():
-    """Initialize MongoDB connection with pooling"""
+    """
+    Create the pooled MongoDB client
+    
+    MongoClient connects in the background, so this returns immediately;
+    index and default settings setup runs once on a background thread.
+    Use ping_db() to wait for the server.
+    """
     global client, db
     
-    try:
-        mongodb_url = config.MONGODB_URL
-        
-        logger.info(f"🔗 Connecting to MongoDB...")
-        
-        client = MongoClient(
-            mongodb_url,
-            serverSelectionTimeoutMS=5000,
-            connectTimeoutMS=10000,
-            socketTimeoutMS=10000,
-            maxPoolSize=50,  # ✅ ADD THIS
-            minPoolSize=10,  # ✅ ADD THIS
-            retryWrites=True,  # ✅ ADD THIS
-            retryReads=True   # ✅ ADD THIS
-        )
+    with _init_lock:
+        if client is not None:
+            return True
         
-        # Test connection
-        client.admin.command('ping')
-        db = client.telegram_bot
+        try:
+            mongodb_url = config.MONGODB_URL
         
-        logger.info("✅ MongoDB connected successfully")
-        create_indexes()
-        create_default_settings()
-        return True
+            logger.info(f"🔗 Connecting to MongoDB...")
+            
+            new_client = MongoClient(
+                mongodb_url,
+                serverSelectionTimeoutMS=5000,
+                connectTimeoutMS=10000,
+                socketTimeoutMS=10000,
+                maxPoolSize=50,  # ✅ ADD THIS
+                minPoolSize=10,  # ✅ ADD THIS
+                retryWrites=True,  # ✅ ADD THIS
+                retryReads=True,   # ✅ ADD THIS
+                event_listeners=[mongo_listener, slow_query_listener]
+            )
         
+        except Exception as e:
+            logger.error(f"❌ MongoDB connection failed: {e}")
+            raise Exception(f"Cannot connect to MongoDB: {e}")
+        
+        db = new_client.telegram_bot
+        client = new_client
+        
+    _start_schema_setup()
+    return True
+
+def ping_db() -> float:
+    """Round-trip to the server (waits for server selection); returns seconds taken"""
+    started = time.perf_counter()
+    get_db().client.admin.command('ping')
+    elapsed = time.perf_counter() - started
+    logger.info(f"✅ MongoDB connected successfully ({elapsed * 1000:.0f}ms)")
+    return elapsed
+
+def _setup_schema():
+    started = time.perf_counter()
+    create_indexes()
+    create_default_settings()
+    schema_ready.set()
+    logger.info(f"✅ Database setup finished in {time.perf_counter() - started:.1f}s")
+
+def _start_schema_setup():
+    """Build indexes and default settings once per process without blocking startup"""
+    global _schema_thread
+    with _init_lock:
+        if _schema_thread is not None:
+            return
+        _schema_thread = threading.Thread(target=_setup_schema, name="db-schema-setup")
+        _schema_thread.daemon = True
+    _schema_thread.start()
+
+# Unique indexes that payment and balance idempotency depend on - built before serving
+CRITICAL_INDEXES = [
+    ("ipn_events", [("payment_id", ASCENDING), ("payment_status", ASCENDING)], {"unique": True}),
+    ("balance_ledger", [("idempotency_key", ASCENDING)], {"unique": True}),
+]
+
+INDEXES = CRITICAL_INDEXES + [
+    ("users", [("telegram_id", ASCENDING)], {"unique": True}),
+    ("users", [("is_banned", ASCENDING)], {"sparse": True}),
+    ("users", [("referred_by", ASCENDING)], {"sparse": True}),
+    ("sessions", [("is_sold", ASCENDING)], {}),
+    ("sessions", [("country", ASCENDING)], {}),
+    ("sessions", [("uploader_id", ASCENDING)], {}),
+    ("sessions", [("is_sold", ASCENDING), ("health_checked_at", ASCENDING)], {}),
+    ("sessions", [("phone_number", ASCENDING)], {}),
+    ("session_fingerprints", [("phone", ASCENDING)],
+     {"unique": True, "partialFilterExpression": {"phone": {"$type": "string"}}}),
+    ("session_fingerprints", [("telegram_id", ASCENDING)],
+     {"unique": True, "partialFilterExpression": {"telegram_id": {"$type": "number"}}}),
+    ("session_fingerprints", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ("quarantined_sessions", [("quarantine_reason", ASCENDING), ("quarantined_at", ASCENDING)], {}),
+    ("transactions", [("user_id", ASCENDING)], {}),
+    ("transactions", [("status", ASCENDING)], {}),
+    ("transactions", [("payment_id", ASCENDING)], {}),
+    ("purchases", [("user_id", ASCENDING)], {}),
+    ("purchases", [("user_id", ASCENDING), ("purchased_at", DESCENDING), ("_id", DESCENDING)], {}),
+    ("seller_applications", [("telegram_id", ASCENDING)], {}),
+    ("seller_applications", [("status", ASCENDING)], {}),
+    ("withdrawals", [("user_id", ASCENDING)], {}),
+    ("withdrawals", [("status", ASCENDING)], {}),
+    ("pending_uploads", [("uploader_id", ASCENDING)], {}),
+    ("pending_uploads", [("status", ASCENDING)], {}),
+    ("whatsapp_settings", [("country_id", ASCENDING)], {"unique": True}),
+    ("balance_ledger", [("user_id", ASCENDING), ("seq", ASCENDING)], {}),
+    ("balance_ledger", [("created_at", ASCENDING)], {}),
+    ("balance_ledger", [("status", ASCENDING), ("created_at", ASCENDING)], {}),
+    ("balance_snapshots", [("user_id", ASCENDING)], {"unique": True}),
+    ("lease_replicas", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ("whatsapp_orders", [("status", ASCENDING)], {}),
+    ("whatsapp_orders", [("user_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], {}),
+    ("bot_conversations", [("name", ASCENDING)], {}),
+    ("spambot_verdicts", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+]
+
+def _create_index(collection, keys, options) -> bool:
+    try:
+        db[collection].create_index(keys, **options)
+        return True
     except Exception as e:
-        logger.error(f"❌ MongoDB connection failed: {e}")
-        raise Exception(f"Cannot connect to MongoDB: {e}")
+        logger.error(f"❌ Index {collection} {keys}: {e}")
+        return False
 
 def create_indexes():
-    """Create database indexes"""
-    try:
-        db.users.create_index([("telegram_id", ASCENDING)], unique=True)
-        db.sessions.create_index([("is_sold", ASCENDING)])
-        db.sessions.create_index([("country", ASCENDING)])
-        db.sessions.create_index([("uploader_id", ASCENDING)])
-        db.transactions.create_index([("user_id", ASCENDING)])
-        db.transactions.create_index([("status", ASCENDING)])
-        db.transactions.create_index([("payment_id", ASCENDING)])
-        db.purchases.create_index([("user_id", ASCENDING)])
-        db.seller_applications.create_index([("telegram_id", ASCENDING)])
-        db.seller_applications.create_index([("status", ASCENDING)])
-        db.withdrawals.create_index([("user_id", ASCENDING)])
-        db.withdrawals.create_index([("status", ASCENDING)])
-        db.pending_uploads.create_index([("uploader_id", ASCENDING)])
-        db.pending_uploads.create_index([("status", ASCENDING)])
-        db.whatsapp_settings.create_index([("country_id", ASCENDING)], unique=True)
+    """Create database indexes; one failing index doesn't stop the rest"""
+    failed = sum(not _create_index(collection, keys, options) for collection, keys, options in INDEXES)
+    if failed:
+        logger.warning(f"⚠️ Indexes created, {failed} failed")
+    else:
         logger.info("✅ Indexes created")
-    except Exception as e:
-        logger.warning(f"⚠️ Index creation: {e}")
+
+def create_critical_indexes():
+    """
+    Create the idempotency unique indexes, raising if any can't be built
+    
+    Without them duplicate IPNs or ledger entries could credit twice, so
+    startup waits for these instead of leaving them to the schema thread.
+    """
+    get_db()
+    for collection, keys, options in CRITICAL_INDEXES:
+        if not _create_index(collection, keys, options):
+            raise Exception(f"Cannot create unique index on {collection} {keys}")
 
 def create_default_settings():
     """Create default settings"""
@@ -87,24 +193,36 @@ def create_default_settings():
         logger.warning(f"⚠️ Settings: {e}")
 
 def get_db():
-    """Get MongoDB database with reconnection logic"""
-    global db, client
+    """
+    Get MongoDB database, creating the client on first use
     
-    try:
-        if db is None or client is None:
-            init_db()
-        
-        # Test connection
-        client.admin.command('ping')
-        return db
-        
-    except Exception as e:
-        logger.warning(f"DB connection lost, reconnecting: {e}")
-        # Force reconnection
-        client = None
-        db = None
+    No per-call ping: the driver monitors the servers and reconnects on its own.
+    """
+    if db is None:
         init_db()
-        return db
+    return db
+
+def supports_transactions():
+    """True when connected to a replica set or sharded cluster (e.g. Atlas)"""
+    topology = getattr(client, 'topology_description', None)
+    if topology is not None and topology.topology_type_name in ('Unknown', 'ReplicaSetNoPrimary'):
+        # Servers not discovered yet (or failing over) - wait for a primary
+        client.admin.command('ping')
+        topology = client.topology_description
+    return topology is not None and topology.topology_type_name in (
+        'ReplicaSetWithPrimary', 'Sharded', 'LoadBalanced'
+    )
+
+def run_atomically(operations):
+    """
+    Run operations(session) inside a multi-document transaction when supported
+    Standalone servers get session=None and ordered conditional writes instead
+    """
+    get_db()
+    if supports_transactions():
+        with client.start_session() as session:
+            return session.with_transaction(operations)
+    return operations(None)
 
 # ============================================
 # USER CLASS - FIXED FOR MONGODB
@@ -117,6 +235,8 @@ class User:
     def create(telegram_id, username=None, referred_by=None):
         """Create new user with referral support"""
         database = get_db()
+        if referred_by == telegram_id:
+            referred_by = None
         try:
             user_data = {
                 "telegram_id": telegram_id,
@@ -124,9 +244,25 @@ class User:
                 "balance": 0.0,
                 "referral_balance": 0.0,  # ✅ Referral earnings
                 "referred_by": referred_by,  # ✅ ID of user who referred this user
+                "referral_path": User.referral_path_via(referred_by),  # ✅ All referrers, nearest first
+                "purchase_stats": {"telegram": 0, "whatsapp": 0},  # ✅ Purchase history totals
+                "referral_stats": {"level_1": 0, "level_2": 0, "earned": 0.0, "withdrawn": 0.0},  # ✅ Referral menu totals
                 "created_at": datetime.utcnow()
             }
             result = database.users.insert_one(user_data)
+            
+            # Count the new user for each referrer shown in the referral menu
+            # (referrers without referral_stats are counted directly until the rebuild)
+            counted = user_data["referral_path"][:REFERRAL_COUNTED_LEVELS]
+            if counted:
+                database.users.bulk_write([
+                    UpdateOne(
+                        {"telegram_id": referrer_id, "referral_stats": {"$exists": True}},
+                        {"$inc": {f"referral_stats.level_{level}": 1}}
+                    )
+                    for level, referrer_id in enumerate(counted, start=1)
+                ], ordered=False)
+            
             logger.info(f"✅ User created: {telegram_id}")
             return result.inserted_id
         except Exception as e:
@@ -134,33 +270,87 @@ class User:
             return None
     
     @staticmethod
-    def get_by_telegram_id(telegram_id):
-        """Get user by telegram ID"""
+    def referral_path_via(referrer_id):
+        """
+        Ancestor path for a user referred by referrer_id: [referrer, its referrer, ...]
+        Users created before paths existed are walked through referred_by
+        """
         database = get_db()
-        return database.users.find_one({"telegram_id": telegram_id})
+        path = []
+        next_id = referrer_id
+        while next_id and next_id not in path and len(path) < REFERRAL_PATH_DEPTH:
+            path.append(next_id)
+            referrer = database.users.find_one(
+                {"telegram_id": next_id},
+                {"referred_by": 1, "referral_path": 1}
+            )
+            if referrer is None:
+                break
+            if "referral_path" in referrer:
+                path.extend(a for a in referrer["referral_path"] if a not in path)
+                break
+            next_id = referrer.get("referred_by")
+        return path[:REFERRAL_PATH_DEPTH]
     
     @staticmethod
-    def update_balance(telegram_id, amount, operation='add'):
-        """Update user balance"""
-        database = get_db()
+    def get_referral_path(user):
+        """Materialized referral path, stored on first use for users created before it existed"""
+        if not user or not user.get("referred_by"):
+            return []
+        if "referral_path" in user:
+            return user["referral_path"]
+        
+        path = User.referral_path_via(user["referred_by"])
+        get_db().users.update_one(
+            {"telegram_id": user["telegram_id"]},
+            {"$set": {"referral_path": path}}
+        )
+        identity_map.record_set("users", user["telegram_id"], {"referral_path": path})
+        return path
+    
+    @staticmethod
+    def get_by_telegram_id(telegram_id):
+        """Get user by telegram ID (cached per update)"""
+        return identity_map.load(
+            "users", telegram_id,
+            lambda: get_db().users.find_one({"telegram_id": telegram_id})
+        )
+    
+    @staticmethod
+    def update_balance(telegram_id, amount, operation='add', reason=None,
+                       idempotency_key=None, ref=None):
+        """
+        Update user balance through the balance ledger
         
+        Args:
+            reason: why the balance moved (purchase, refund, admin_add, ...)
+            idempotency_key: repeated calls with the same key apply once
+            ref: related document (order, session, admin) for auditing
+        """
         if operation == 'add':
-            result = database.users.update_one(
-                {"telegram_id": telegram_id},
-                {"$inc": {"balance": amount}}
-            )
+            entry = BalanceLedger.apply(telegram_id, amount, reason or 'credit', idempotency_key, ref)
         elif operation == 'subtract':
-            result = database.users.update_one(
-                {"telegram_id": telegram_id},
-                {"$inc": {"balance": -amount}}
-            )
+            entry = BalanceLedger.apply(telegram_id, -amount, reason or 'debit', idempotency_key, ref)
         elif operation == 'set':
-            result = database.users.update_one(
-                {"telegram_id": telegram_id},
-                {"$set": {"balance": amount}}
-            )
+            entry = BalanceLedger.set_balance(telegram_id, amount, reason or 'set', idempotency_key, ref)
+        else:
+            return False
         
-        return result.modified_count > 0
+        return entry is not None
+    
+    @staticmethod
+    def count_purchase(telegram_id, source):
+        """
+        Count one purchase ('telegram' or 'whatsapp') in users.purchase_stats
+        
+        Users without purchase_stats are left alone so their history keeps
+        being counted from the collections until rebuild_purchase_stats.py runs.
+        """
+        database = get_db()
+        database.users.update_one(
+            {"telegram_id": telegram_id, "purchase_stats": {"$exists": True}},
+            {"$inc": {f"purchase_stats.{source}": 1}}
+        )
     
     @staticmethod
     def get_all(limit=20):
@@ -181,12 +371,27 @@ class User:
 class TelegramSession:
     """Session operations - MongoDB compatible - COMPLETE VERSION"""
     
+    # session_data fields an approved upload must carry (see create_many)
+    REQUIRED_UPLOAD_FIELDS = ('message_id', 'phone', 'country', 'price')
+    
     @staticmethod
     def create(session_string, phone_number, country, has_2fa=False, 
-               two_fa_password=None, price=1.0, uploader_id=None, info=None, spam_status='Unknown'):
-        """Create session with optional info and spam status"""
+               two_fa_password=None, price=1.0, uploader_id=None, info=None, spam_status='Unknown',
+               file_id=None):
+        """Create session with optional info and spam status (file_id: Bot API id of the archived document)"""
         database = get_db()
-        session_data = {
+        session_data = TelegramSession._document(
+            session_string, phone_number, country, has_2fa, two_fa_password,
+            price, uploader_id, info, spam_status, file_id
+        )
+        result = database.sessions.insert_one(session_data)
+        logger.info(f"✅ Session created: {phone_number} (Status: {spam_status})")
+        return result.inserted_id
+    
+    @staticmethod
+    def _document(session_string, phone_number, country, has_2fa=False, two_fa_password=None,
+                  price=1.0, uploader_id=None, info=None, spam_status='Unknown', file_id=None):
+        return {
             "session_string": session_string,
             "phone_number": phone_number,
             "country": country,
@@ -198,18 +403,101 @@ class TelegramSession:
             "uploader_id": uploader_id,
             "info": info,
             "spam_status": spam_status,
+            "file_id": file_id,
             "created_at": datetime.utcnow(),
             "sold_at": None
         }
-        result = database.sessions.insert_one(session_data)
-        logger.info(f"✅ Session created: {phone_number} (Status: {spam_status})")
-        return result.inserted_id
     
     @staticmethod
-    def get_by_id(session_id):
-        """Get session by ID"""
+    def create_many(sessions, uploader_id=None, pending_id=None, approved_by=None, duplicate_count=0) -> Optional[dict]:
+        """
+        Insert an approved upload (list of session_data) with one unordered insert_many
+        
+        With pending_id the pending upload is marked approved in the same
+        operation set (one transaction where supported); returns None when it
+        was no longer pending, e.g. a second click on Approve. Otherwise:
+            {'inserted_ids': [...], 'failed': [(session_data, reason), ...]}
+        """
         database = get_db()
-        return database.sessions.find_one({"_id": ObjectId(session_id)})
+        documents = []
+        failed = []
+        for session_data in sessions:
+            missing = [field for field in TelegramSession.REQUIRED_UPLOAD_FIELDS
+                       if session_data.get(field) in (None, '')]
+            if missing:
+                failed.append((session_data, f"missing {', '.join(missing)}"))
+                continue
+            try:
+                price = float(session_data['price'])
+            except (TypeError, ValueError):
+                failed.append((session_data, f"invalid price {session_data['price']!r}"))
+                continue
+            documents.append((session_data, TelegramSession._document(
+                str(session_data['message_id']), session_data['phone'], session_data['country'],
+                session_data.get('has_2fa', False), session_data.get('two_fa_password'), price,
+                uploader_id, session_data.get('info'), session_data.get('spam_status', 'Unknown'),
+                session_data.get('file_id')
+            )))
+        
+        def _apply(session):
+            if pending_id is not None:
+                claimed = database.pending_uploads.update_one(
+                    {"_id": pending_id, "status": "pending"},
+                    {"$set": {
+                        "status": "approved",
+                        "approved_at": datetime.utcnow(),
+                        "approved_by": approved_by,
+                        "duplicate_count": duplicate_count
+                    }},
+                    session=session
+                )
+                if claimed.matched_count == 0:
+                    return None
+            
+            inserted_ids = []
+            write_failed = []
+            if documents:
+                try:
+                    result = database.sessions.insert_many(
+                        [document for _, document in documents], ordered=False, session=session
+                    )
+                    inserted_ids = list(result.inserted_ids)
+                except BulkWriteError as e:
+                    if session is not None:
+                        # The transaction is aborted; nothing was written
+                        raise
+                    errors = {error['index']: error.get('errmsg', 'write failed') for error in e.details.get('writeErrors', [])}
+                    for index, (session_data, document) in enumerate(documents):
+                        if index in errors:
+                            write_failed.append((session_data, errors[index]))
+                        else:
+                            inserted_ids.append(document['_id'])
+            
+            if pending_id is not None:
+                database.pending_uploads.update_one(
+                    {"_id": pending_id},
+                    {"$set": {"added_count": len(inserted_ids), "failed_count": len(failed) + len(write_failed)}},
+                    session=session
+                )
+            return {'inserted_ids': inserted_ids, 'failed': failed + write_failed}
+        
+        outcome = run_atomically(_apply)
+        if outcome is None:
+            logger.info(f"♻️ Upload {pending_id} was already processed")
+            return None
+        logger.info(
+            f"✅ Sessions created: {len(outcome['inserted_ids'])}/{len(sessions)}"
+            + (f" ({len(outcome['failed'])} failed)" if outcome['failed'] else "")
+        )
+        return outcome
+    
+    @staticmethod
+    def get_by_id(session_id):
+        """Get session by ID (cached per update)"""
+        return identity_map.load(
+            "sessions", str(session_id),
+            lambda: get_db().sessions.find_one({"_id": ObjectId(session_id)})
+        )
     
     @staticmethod
     def get_available_by_country(country, limit=20):
@@ -239,16 +527,51 @@ class TelegramSession:
     def mark_as_sold(session_id, buyer_id):
         """Mark as sold"""
         database = get_db()
+        sold_fields = {
+            "is_sold": True,
+            "buyer_id": buyer_id,
+            "sold_at": datetime.utcnow()
+        }
         result = database.sessions.update_one(
             {"_id": ObjectId(session_id)},
-            {"$set": {
-                "is_sold": True,
-                "buyer_id": buyer_id,
-                "sold_at": datetime.utcnow()
-            }}
+            {"$set": sold_fields}
         )
+        identity_map.record_set("sessions", str(session_id), sold_fields)
         return result.modified_count > 0
     
+    @staticmethod
+    def claim_for_sale(session_id, buyer_id):
+        """
+        Mark an unsold session as sold to buyer_id
+        Returns the session if this call claimed it, None if it was already sold;
+        claim_id is new for every claim, so it can key the buyer's charge
+        """
+        database = get_db()
+        sold_fields = {
+            "is_sold": True,
+            "buyer_id": buyer_id,
+            "sold_at": datetime.utcnow(),
+            "claim_id": str(ObjectId())
+        }
+        session = database.sessions.find_one_and_update(
+            {"_id": ObjectId(session_id), "is_sold": False},
+            {"$set": sold_fields},
+            return_document=ReturnDocument.AFTER
+        )
+        if session is not None:
+            identity_map.record_set("sessions", str(session_id), sold_fields)
+        return session
+    
+    @staticmethod
+    def release_claim(session_id, buyer_id):
+        """Put a session claimed by buyer_id back on sale (payment failed)"""
+        database = get_db()
+        database.sessions.update_one(
+            {"_id": ObjectId(session_id), "is_sold": True, "buyer_id": buyer_id},
+            {"$set": {"is_sold": False}, "$unset": {"buyer_id": "", "sold_at": "", "claim_id": ""}}
+        )
+        identity_map.evict("sessions", str(session_id))
+    
     @staticmethod
     def get_by_uploader(uploader_id, limit=50):
         """Get by uploader"""
@@ -270,8 +593,12 @@ class TelegramSession:
     def delete(session_id):
         """Delete"""
         database = get_db()
-        result = database.sessions.delete_one({"_id": ObjectId(session_id)})
-        return result.deleted_count > 0
+        deleted = database.sessions.find_one_and_delete({"_id": ObjectId(session_id)}, {"phone_number": 1})
+        identity_map.evict("sessions", str(session_id))
+        if deleted is None:
+            return False
+        SessionFingerprint.release_phone(deleted.get('phone_number'))
+        return True
     
     @staticmethod
     def get_seller_stats(uploader_id):
@@ -460,6 +787,243 @@ class TelegramSession:
                 'revenue_24h': 0.0
             }
 
+# ============================================
+# SESSION FINGERPRINTS - UPLOAD DUPLICATE DETECTION
+# ============================================
+
+class SessionFingerprint:
+    """
+    Registry of uploaded accounts, unique per auth key hash (_id), phone and
+    Telegram user id
+    
+    An account is 'claimed' once an upload validates it, 'pending' while it
+    waits for admin approval and 'listed' once it is in the store. Claims and
+    pending entries expire so abandoned uploads don't block the account.
+    """
+    
+    CLAIM_TTL = timedelta(days=1)
+    PENDING_TTL = timedelta(days=30)
+    
+    @staticmethod
+    def normalize_phone(phone):
+        digits = re.sub(r'\D', '', str(phone or ''))
+        return digits or None
+    
+    @staticmethod
+    def phone_from_filename(file_name):
+        """Phone number in a '+15551234567.session' style file name, if any"""
+        stem = os.path.basename(str(file_name or '')).replace('.session', '')
+        if re.fullmatch(r'\+?\d{7,15}', stem):
+            return stem.lstrip('+')
+        return None
+    
+    @staticmethod
+    def hash_auth_key(auth_key: bytes):
+        return hashlib.sha256(auth_key).hexdigest() if auth_key else None
+    
+    @staticmethod
+    def auth_key_hash_from_file(file_path):
+        """Read the auth key straight from a Telethon .session (SQLite) file - no network"""
+        try:
+            connection = sqlite3.connect(f"file:{file_path}?mode=ro", uri=True)
+            try:
+                row = connection.execute("SELECT auth_key FROM sessions LIMIT 1").fetchone()
+            finally:
+                connection.close()
+        except sqlite3.Error:
+            return None
+        return SessionFingerprint.hash_auth_key(row[0]) if row else None
+    
+    @staticmethod
+    def describe(document) -> str:
+        return {
+            'listed': 'already listed in the store',
+            'pending': 'already waiting for admin approval'
+        }.get(document.get('status'), 'already being uploaded')
+    
+    @staticmethod
+    def key(auth_key_hash=None, phone=None):
+        """Registry _id - the auth key hash, or the phone when the key couldn't be read"""
+        if auth_key_hash:
+            return auth_key_hash
+        phone = SessionFingerprint.normalize_phone(phone)
+        return f"phone:{phone}" if phone else None
+    
+    @staticmethod
+    def _keys(sessions) -> list:
+        keys = [SessionFingerprint.key(s.get('auth_key_hash'), s.get('phone')) for s in sessions]
+        return [key for key in keys if key]
+    
+    @staticmethod
+    def _identifiers(auth_key_hash=None, phone=None, telegram_id=None):
+        clauses = []
+        if auth_key_hash:
+            clauses.append({"_id": auth_key_hash})
+        if phone:
+            clauses.append({"phone": phone})
+        if telegram_id:
+            clauses.append({"telegram_id": telegram_id})
+        return {"$or": clauses} if clauses else None
+    
+    @staticmethod
+    def _abandoned(document, uploader_id, upload_id):
+        # The uploader's own validated-but-never-submitted claim from an earlier upload
+        return (document['status'] == 'claimed' and document.get('uploader_id') == uploader_id
+                and document.get('upload_id') != upload_id)
+    
+    @staticmethod
+    def find_duplicate(auth_key_hash=None, phone=None, telegram_id=None, uploader_id=None, upload_id=None):
+        """Registration matching any identifier, or None (one indexed $or lookup)"""
+        query = SessionFingerprint._identifiers(auth_key_hash, SessionFingerprint.normalize_phone(phone), telegram_id)
+        if query is None:
+            return None
+        database = get_db()
+        for document in database.session_fingerprints.find(query):
+            if not SessionFingerprint._abandoned(document, uploader_id, upload_id):
+                return document
+        return None
+    
+    @staticmethod
+    def claim(auth_key_hash, phone=None, telegram_id=None, uploader_id=None, upload_id=None, status='claimed'):
+        """
+        Register an account - returns the conflicting registration when any of
+        its identifiers is already registered, None when the claim was taken
+        """
+        database = get_db()
+        phone = SessionFingerprint.normalize_phone(phone)
+        key = SessionFingerprint.key(auth_key_hash, phone)
+        if key is None:
+            return None
+        
+        duplicate = SessionFingerprint.find_duplicate(key, phone, telegram_id, uploader_id, upload_id)
+        if duplicate:
+            return duplicate
+        
+        query = SessionFingerprint._identifiers(key, phone, telegram_id)
+        database.session_fingerprints.delete_many({**query, "status": "claimed", "uploader_id": uploader_id})
+        
+        now = datetime.utcnow()
+        document = {
+            "_id": key,
+            "uploader_id": uploader_id,
+            "upload_id": upload_id,
+            "status": status,
+            "created_at": now
+        }
+        # Unique indexes are partial on these fields, so leave out unknown ones
+        if phone:
+            document["phone"] = phone
+        if telegram_id:
+            document["telegram_id"] = telegram_id
+        if status == 'claimed':
+            document["expires_at"] = now + SessionFingerprint.CLAIM_TTL
+        
+        try:
+            database.session_fingerprints.insert_one(document)
+            return None
+        except DuplicateKeyError:
+            # Lost a race with another upload of the same account
+            return SessionFingerprint.find_duplicate(key, phone, telegram_id) or {"status": "claimed"}
+    
+    @staticmethod
+    def mark_pending(sessions):
+        """Upload (list of session_data) submitted for approval"""
+        database = get_db()
+        database.session_fingerprints.update_many(
+            {"_id": {"$in": SessionFingerprint._keys(sessions)}, "status": "claimed"},
+            {"$set": {
+                "status": "pending",
+                "expires_at": datetime.utcnow() + SessionFingerprint.PENDING_TTL
+            }}
+        )
+    
+    @staticmethod
+    def mark_listed(auth_key_hash, phone=None, telegram_id=None, uploader_id=None) -> bool:
+        """
+        Approval-time check: False when the account is already in the store
+        (registered as listed, or an older session with the same phone)
+        """
+        database = get_db()
+        phone = SessionFingerprint.normalize_phone(phone)
+        key = SessionFingerprint.key(auth_key_hash, phone)
+        if key is None:
+            return True
+        
+        if phone and database.sessions.find_one({"phone_number": {"$in": [phone, f"+{phone}"]}}, {"_id": 1}):
+            database.session_fingerprints.delete_many({"_id": key, "status": {"$ne": "listed"}})
+            return False
+        
+        listed = database.session_fingerprints.find_one_and_update(
+            {"_id": key, "status": {"$ne": "listed"}},
+            {"$set": {"status": "listed"}, "$unset": {"expires_at": ""}}
+        )
+        if listed is not None:
+            return True
+        # Already listed, or the claim expired / predates fingerprinting
+        return SessionFingerprint.claim(key, phone, telegram_id, uploader_id, status='listed') is None
+    
+    @staticmethod
+    def mark_listed_many(sessions, uploader_id=None) -> list:
+        """
+        mark_listed for a whole approved upload (list of session_data) in a
+        few queries; returns the sessions that may be listed
+        """
+        database = get_db()
+        phones = {SessionFingerprint.normalize_phone(s.get('phone')) for s in sessions} - {None}
+        in_store = {
+            SessionFingerprint.normalize_phone(document['phone_number'])
+            for document in database.sessions.find(
+                {"phone_number": {"$in": [variant for phone in phones for variant in (phone, f"+{phone}")]}},
+                {"phone_number": 1}
+            )
+        } if phones else set()
+        
+        stocked = [s for s in sessions if SessionFingerprint.normalize_phone(s.get('phone')) in in_store]
+        candidates = [s for s in sessions if SessionFingerprint.normalize_phone(s.get('phone')) not in in_store]
+        if stocked:
+            database.session_fingerprints.delete_many(
+                {"_id": {"$in": SessionFingerprint._keys(stocked)}, "status": {"$ne": "listed"}}
+            )
+        
+        keys = SessionFingerprint._keys(candidates)
+        ours = {
+            document['_id']
+            for document in database.session_fingerprints.find({"_id": {"$in": keys}, "status": {"$ne": "listed"}}, {"_id": 1})
+        } if keys else set()
+        if ours:
+            database.session_fingerprints.update_many(
+                {"_id": {"$in": list(ours)}, "status": {"$ne": "listed"}},
+                {"$set": {"status": "listed"}, "$unset": {"expires_at": ""}}
+            )
+        
+        listable = []
+        for session_data in candidates:
+            key = SessionFingerprint.key(session_data.get('auth_key_hash'), session_data.get('phone'))
+            if key is None or key in ours:
+                listable.append(session_data)
+            # Already listed, or the claim expired / predates fingerprinting
+            elif SessionFingerprint.claim(
+                key, SessionFingerprint.normalize_phone(session_data.get('phone')),
+                session_data.get('telegram_id'), uploader_id, status='listed'
+            ) is None:
+                listable.append(session_data)
+        return listable
+    
+    @staticmethod
+    def release(sessions):
+        """Drop the claims of a rejected upload (list of session_data)"""
+        database = get_db()
+        database.session_fingerprints.delete_many(
+            {"_id": {"$in": SessionFingerprint._keys(sessions)}, "status": {"$ne": "listed"}}
+        )
+    
+    @staticmethod
+    def release_phone(phone):
+        """Forget a deleted session's account so it can be uploaded again"""
+        phone = SessionFingerprint.normalize_phone(phone)
+        if phone:
+            get_db().session_fingerprints.delete_many({"phone": phone})
+
 # ============================================
 # TRANSACTION CLASS - FIXED FOR MONGODB
 # ============================================
@@ -492,20 +1056,20 @@ class Transaction:
     @staticmethod
     def get_by_id(transaction_id):
         """Get by ID"""
-        database = get_db()
-        return database.transactions.find_one({"_id": ObjectId(transaction_id)})
+        from archiver import find_one_across_tiers
+        return find_one_across_tiers("transactions", {"_id": ObjectId(transaction_id)})
     
     @staticmethod
     def get_by_order_id(order_id):
         """Get by order ID"""
-        database = get_db()
-        return database.transactions.find_one({"order_id": order_id})
+        from archiver import find_one_across_tiers
+        return find_one_across_tiers("transactions", {"order_id": order_id})
     
     @staticmethod
     def get_by_payment_id(payment_id):
         """Get by payment ID"""
-        database = get_db()
-        return database.transactions.find_one({"payment_id": payment_id})
+        from archiver import find_one_across_tiers
+        return find_one_across_tiers("transactions", {"payment_id": payment_id})
     
     @staticmethod
     def update_status(transaction_id, status, charge_id=None):
@@ -524,6 +1088,65 @@ class Transaction:
         )
         return result.modified_count > 0
     
+    @staticmethod
+    def complete_and_credit(transaction_id, charge_id=None):
+        """
+        Transition pending → completed and credit the user in one step
+        Returns the transaction if this call credited it, None if it was not
+        pending or another attempt credited (or is still crediting) it
+        
+        Deposits the archiver expired are still credited if the payment lands late.
+        credit_pending marks a completed deposit until its credit lands, so a
+        retry finishes a credit that a crash interrupted between the two
+        writes (standalone servers have no transaction around them).
+        """
+        database = get_db()
+        update_data = {
+            "status": "completed",
+            "credit_pending": True,
+            "updated_at": datetime.utcnow()
+        }
+        if charge_id:
+            update_data["charge_id"] = charge_id
+        
+        def _apply(session):
+            transaction = database.transactions.find_one_and_update(
+                {"_id": ObjectId(transaction_id), "status": {"$in": ["pending", "expired"]}},
+                {"$set": update_data},
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
+            if transaction is None:
+                transaction = database.transactions.find_one(
+                    {"_id": ObjectId(transaction_id), "status": "completed", "credit_pending": True},
+                    session=session
+                )
+                if transaction is None:
+                    return None, None, None
+                logger.warning(f"⚠️ Resuming interrupted credit for transaction {transaction_id}")
+            # Keyed per transaction: a no-op if the interrupted attempt did credit
+            key = f"transaction:{transaction['_id']}"
+            entry = BalanceLedger.append(
+                transaction['user_id'], transaction['amount'], 'deposit',
+                key, ref=str(transaction['_id']), session=session
+            )
+            existing = None
+            if entry is None:
+                existing = database.balance_ledger.find_one({"idempotency_key": key}, {"status": 1}, session=session)
+            if entry is not None or (existing or {}).get("status") == "applied":
+                database.transactions.update_one(
+                    {"_id": transaction['_id']}, {"$unset": {"credit_pending": ""}}, session=session
+                )
+            return transaction, entry, existing
+        
+        transaction, entry, existing = run_atomically(_apply)
+        if entry is not None:
+            identity_map.record_inc("users", transaction['user_id'], "balance", transaction['amount'])
+            return transaction
+        if transaction is not None and existing is None:
+            logger.error(f"❌ Transaction {transaction_id} completed but user {transaction['user_id']} was not credited")
+        return None
+    
     @staticmethod
     def get_recent(limit=15):
         """Get recent"""
@@ -539,26 +1162,208 @@ class Transaction:
     @staticmethod
     def count_by_method(payment_method, status=None):
         """Count by method"""
-        database = get_db()
+        from archiver import count_across_tiers
         query = {"payment_method": payment_method}
         if status:
             query["status"] = status
-        return database.transactions.count_documents(query)
+        return count_across_tiers("transactions", query)
     
     @staticmethod
     def get_total_amount(payment_method=None, status='completed'):
         """Get total amount"""
-        database = get_db()
+        from archiver import sum_across_tiers
         match_query = {"type": "deposit", "status": status}
         if payment_method:
             match_query["payment_method"] = payment_method
+        return sum_across_tiers("transactions", match_query, "amount")
+
+# ============================================
+# IPN LEDGER - ONE ENTRY PER (payment_id, payment_status)
+# ============================================
+
+class IPNLedger:
+    """Idempotency ledger for NOWPayments IPN callbacks"""
+    
+    # A claim still "processing" after this long belongs to a worker that died
+    # before recording an outcome; the next delivery takes it over
+    CLAIM_TIMEOUT = timedelta(minutes=5)
+    
+    @staticmethod
+    def seen(payment_id, payment_status):
+        """Single indexed lookup - True if this IPN already has a final outcome"""
+        database = get_db()
+        return database.ipn_events.find_one(
+            {"payment_id": str(payment_id), "payment_status": payment_status, "outcome": {"$ne": "processing"}},
+            {"_id": 1}
+        ) is not None
+    
+    @staticmethod
+    def record(payment_id, payment_status, order_id=None):
+        """Claim this IPN - False if another worker holds a live claim or it is already handled"""
+        database = get_db()
+        now = datetime.utcnow()
+        try:
+            database.ipn_events.insert_one({
+                "payment_id": str(payment_id),
+                "payment_status": payment_status,
+                "order_id": order_id,
+                "outcome": "processing",
+                "received_at": now
+            })
+            return True
+        except DuplicateKeyError:
+            pass
         
-        pipeline = [
-            {"$match": match_query},
-            {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-        ]
-        result = list(database.transactions.aggregate(pipeline))
-        return result[0]['total'] if result else 0.0
+        taken = database.ipn_events.update_one(
+            {
+                "payment_id": str(payment_id),
+                "payment_status": payment_status,
+                "outcome": "processing",
+                "received_at": {"$lt": now - IPNLedger.CLAIM_TIMEOUT}
+            },
+            {"$set": {"received_at": now, "order_id": order_id}}
+        ).modified_count
+        if taken:
+            logger.warning(f"⚠️ Took over stale IPN claim {payment_id} ({payment_status})")
+        return bool(taken)
+    
+    @staticmethod
+    def set_outcome(payment_id, payment_status, outcome):
+        """Store final outcome for a claimed IPN"""
+        database = get_db()
+        database.ipn_events.update_one(
+            {"payment_id": str(payment_id), "payment_status": payment_status},
+            {"$set": {"outcome": outcome, "processed_at": datetime.utcnow()}}
+        )
+    
+    @staticmethod
+    def release(payment_id, payment_status):
+        """Drop a claim after a failure so NOWPayments' retry is processed"""
+        database = get_db()
+        database.ipn_events.delete_one(
+            {"payment_id": str(payment_id), "payment_status": payment_status}
+        )
+
+# ============================================
+# BALANCE LEDGER - APPEND-ONLY RECORD OF BALANCE CHANGES
+# ============================================
+
+class BalanceLedger:
+    """
+    Every credit and debit is appended here before it touches users.balance
+    
+    users.balance stays the cached running total (O(1) reads) and
+    users.ledger_seq numbers the entries that produced it, so
+    ledger_reconciler can verify balances incrementally
+    """
+    
+    @staticmethod
+    def append(user_id, amount, reason, idempotency_key=None, ref=None,
+               set_balance=None, session=None):
+        """
+        Append an entry and move the user's balance within session
+        Returns the entry if this call applied it, None if the key was
+        already used or the user does not exist
+        """
+        database = get_db()
+        entry = {
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "amount": amount,
+            "reason": reason,
+            "ref": ref,
+            "status": "pending",
+            "created_at": datetime.utcnow()
+        }
+        entry["idempotency_key"] = idempotency_key or f"{reason}:{entry['_id']}"
+        
+        # A write error aborts a transaction, so look the key up first there
+        if session is not None and database.balance_ledger.find_one(
+            {"idempotency_key": entry["idempotency_key"]}, {"_id": 1}, session=session
+        ):
+            return None
+        
+        try:
+            database.balance_ledger.insert_one(entry, session=session)
+        except DuplicateKeyError:
+            return None
+        
+        if set_balance is None:
+            change = {"$inc": {"balance": amount, "ledger_seq": 1}}
+        else:
+            change = {"$set": {"balance": set_balance}, "$inc": {"ledger_seq": 1}}
+        
+        previous = database.users.find_one_and_update(
+            {"telegram_id": user_id},
+            change,
+            projection={"balance": 1, "ledger_seq": 1},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if previous is None:
+            database.balance_ledger.delete_one({"_id": entry["_id"]}, session=session)
+            return None
+        
+        balance_before = previous.get("balance", 0.0)
+        if set_balance is None:
+            balance_after = balance_before + amount
+        else:
+            balance_after = set_balance
+            entry["amount"] = set_balance - balance_before
+        
+        entry.update({
+            "status": "applied",
+            "seq": previous.get("ledger_seq", 0) + 1,
+            "balance_before": balance_before,
+            "balance_after": balance_after
+        })
+        database.balance_ledger.update_one(
+            {"_id": entry["_id"]},
+            {"$set": {
+                "status": "applied",
+                "seq": entry["seq"],
+                "amount": entry["amount"],
+                "balance_before": balance_before,
+                "balance_after": balance_after
+            }},
+            session=session
+        )
+        return entry
+    
+    @staticmethod
+    def apply(user_id, amount, reason, idempotency_key=None, ref=None):
+        """Credit (amount > 0) or debit (amount < 0) a user's balance"""
+        entry = run_atomically(
+            lambda session: BalanceLedger.append(
+                user_id, amount, reason, idempotency_key, ref, session=session
+            )
+        )
+        if entry is not None:
+            identity_map.record_inc("users", user_id, "balance", amount)
+        return entry
+    
+    @staticmethod
+    def set_balance(user_id, balance, reason, idempotency_key=None, ref=None):
+        """Set a user's balance, recording the difference as an entry"""
+        entry = run_atomically(
+            lambda session: BalanceLedger.append(
+                user_id, None, reason, idempotency_key, ref,
+                set_balance=balance, session=session
+            )
+        )
+        if entry is not None:
+            identity_map.record_set("users", user_id, {"balance": balance})
+        return entry
+    
+    @staticmethod
+    def get_by_user(user_id, limit=20):
+        """Latest balance changes for a user"""
+        database = get_db()
+        return list(
+            database.balance_ledger.find({"user_id": user_id, "status": "applied"})
+            .sort("seq", DESCENDING)
+            .limit(limit)
+        )
 
 # ============================================
 # PURCHASE CLASS - FIXED FOR MONGODB
@@ -583,6 +1388,7 @@ class Purchase:
             "purchased_at": datetime.utcnow()
         }
         result = database.purchases.insert_one(purchase_data)
+        User.count_purchase(user_id, 'telegram')
         logger.info(f"✅ Purchase created for user {user_id}")
         return result.inserted_id
     
@@ -596,9 +1402,9 @@ class Purchase:
     
     @staticmethod
     def count_by_user(user_id):
-        """Count by user"""
-        database = get_db()
-        return database.purchases.count_documents({"user_id": user_id})
+        """Count by user (hot and archived purchases)"""
+        from archiver import count_across_tiers
+        return count_across_tiers("purchases", {"user_id": user_id})
     
     @staticmethod
     def filter_by(**kwargs):
@@ -615,7 +1421,12 @@ class SystemSettings:
     
     @staticmethod
     def get():
-        """Get settings"""
+        """Get settings (served from settings_cache)"""
+        return settings_cache.system_settings()
+    
+    @staticmethod
+    def load():
+        """Load settings from MongoDB"""
         database = get_db()
         settings = database.settings.find_one({"_id": "system"})
         if not settings:
@@ -655,6 +1466,8 @@ class SystemSettings:
             upsert=True
         )
         
+        settings_cache.apply_system(update_data)
+        
         logger.info(f"✅ Settings updated: {result.modified_count} modified, {result.upserted_id if result.upserted_id else 'existing'}")
         return result.modified_count > 0 or result.upserted_id is not None
     
@@ -847,10 +1660,3 @@ def prepare_for_mongodb(update=None, context=None, query=None, **kwargs) -> Dict
         result['created_at'] = datetime.utcnow()
     
     return result
-
-
-# Initialize
-try:
-    init_db()
-except Exception as e:
-    logger.error(f"Init failed: {e}")
\ No newline at end of file
@@ -0,0 +1,285 @@
+"""
+Bot HTTP Server - single aiohttp app running in the bot's event loop
+Serves health checks, NOWPayments IPN, /metrics and (in webhook mode) Telegram updates
+"""
+
+import asyncio
+import hmac
+import logging
+import signal
+from aiohttp import web
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# aiohttp app keys
+APPLICATION_KEY = 'ptb_application'
+
+# IPN processing queue
+IPN_WORKERS = 4
+IPN_QUEUE_SIZE = 1000
+
+# Updates admitted per processing slot (waiting on a user lock or running);
+# PTB's own semaphore only bounds these, the processor's slots bound handlers
+PENDING_UPDATES_PER_SLOT = 32
+
+_runner = None
+_ipn_queue = None
+_ipn_workers = []
+
+ipn_stats = {
+    'received': 0,
+    'processed': 0,
+    'failed': 0,
+    'rejected': 0
+}
+
+# ============================================
+# UPDATE PROCESSOR
+# ============================================
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Process updates concurrently across users, sequentially per user
+    Keeps conversation state consistent while different users run in parallel
+    """
+    
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates * PENDING_UPDATES_PER_SLOT)
+        # Handler slots, taken only once the user's own lock is held: one user's
+        # queued taps behind a slow handler (bulk upload, OTP flow) can't hold
+        # every slot and stall all other users
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # user_id -> [lock, number of updates holding or waiting for it]
+        self._user_locks = {}
+    
+    async def do_process_update(self, update, coroutine):
+        """Wait for the user's own lock, then a shared slot"""
+        user = getattr(update, 'effective_user', None)
+        if user is None:
+            async with self._slots:
+                await coroutine
+            return
+        
+        entry = self._user_locks.get(user.id)
+        if entry is None:
+            entry = self._user_locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        
+        try:
+            async with entry[0]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            # Drop idle locks so the dict doesn't grow with every user ever seen
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[user.id]
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        self._user_locks.clear()
+
+# ============================================
+# ROUTES
+# ============================================
+
+async def home(request: web.Request) -> web.Response:
+    """Keep-alive ping"""
+    return web.Response(text="Bot is alive! ✅")
+
+async def health(request: web.Request) -> web.Response:
+    """Health check endpoint"""
+    return web.json_response({'status': 'healthy', 'service': 'telegram-bot'})
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    """Prometheus scrape endpoint"""
+    return web.Response(text=metrics.render(), content_type='text/plain')
+
+async def telegram_webhook(request: web.Request) -> web.Response:
+    """Validate secret token, decode update and enqueue it"""
+    application = request.app[APPLICATION_KEY]
+    
+    token = request.headers.get(SECRET_HEADER, '')
+    if not hmac.compare_digest(token, config.WEBHOOK_SECRET):
+        logger.warning("🚫 Webhook request with invalid secret token")
+        return web.Response(status=403)
+    
+    try:
+        data = await request.json()
+        update = Update.de_json(data, application.bot)
+    except Exception as e:
+        logger.error(f"❌ Invalid webhook payload: {e}")
+        return web.Response(status=400)
+    
+    # Respond immediately - processing happens on the update queue
+    await application.update_queue.put(update)
+    return web.Response(status=200)
+
+async def nowpayments_webhook(request: web.Request) -> web.Response:
+    """
+    Handle NOWPayments IPN callbacks
+    Acknowledges quickly and hands the IPN to the async processing queue
+    """
+    signature = request.headers.get('x-nowpayments-sig', '')
+    if not signature:
+        ipn_stats['rejected'] += 1
+        logger.error("❌ IPN without signature header")
+        return web.json_response({'status': 'error', 'message': 'Missing signature'}, status=400)
+    
+    try:
+        ipn_data = await request.json()
+    except Exception:
+        ipn_data = None
+    
+    if not isinstance(ipn_data, dict):
+        ipn_stats['rejected'] += 1
+        logger.error("❌ IPN without JSON body")
+        return web.json_response({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    
+    try:
+        _ipn_queue.put_nowait((ipn_data, signature))
+    except asyncio.QueueFull:
+        # NOWPayments retries non-2xx responses
+        logger.warning("⚠️ IPN queue full, asking NOWPayments to retry")
+        return web.json_response({'status': 'error', 'message': 'Busy'}, status=503)
+    
+    ipn_stats['received'] += 1
+    logger.info(f"📥 IPN queued: {ipn_data.get('payment_id')} - Status: {ipn_data.get('payment_status')}")
+    return web.json_response({'status': 'ok'})
+
+# ============================================
+# IPN WORKERS
+# ============================================
+
+async def _ipn_worker():
+    """Process queued IPNs off the event loop (pymongo is blocking)"""
+    from payment_nowpayments import process_ipn_callback
+    
+    while True:
+        ipn_data, signature = await _ipn_queue.get()
+        try:
+            success = await asyncio.to_thread(process_ipn_callback, ipn_data, signature)
+            ipn_stats['processed' if success else 'failed'] += 1
+        except Exception as e:
+            ipn_stats['failed'] += 1
+            logger.error(f"❌ IPN worker error: {e}")
+        finally:
+            _ipn_queue.task_done()
+
+@metrics.register_collector
+def _http_metrics():
+    return [
+        ('nowpayments_ipn_total', 'counter', 'NOWPayments IPNs by outcome',
+         [({'outcome': outcome}, count) for outcome, count in ipn_stats.items()]),
+        ('nowpayments_ipn_queue_depth', 'gauge', 'IPNs waiting to be processed',
+         [({}, _ipn_queue.qsize() if _ipn_queue else 0)])
+    ]
+
+# ============================================
+# LIFECYCLE
+# ============================================
+
+def build_app(application=None, serve_telegram: bool = False) -> web.Application:
+    """Create aiohttp app with health, IPN, metrics and optional Telegram routes"""
+    app = web.Application()
+    app[APPLICATION_KEY] = application
+    app.router.add_get('/', home)
+    app.router.add_get('/health', health)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.router.add_post('/nowpayments/webhook', nowpayments_webhook)
+    if serve_telegram:
+        app.router.add_post(f"/{config.WEBHOOK_PATH}", telegram_webhook)
+    return app
+
+async def start_http_server(application=None, serve_telegram: bool = False):
+    """Start HTTP server and IPN workers on 0.0.0.0:WEBHOOK_PORT"""
+    global _runner, _ipn_queue
+    if _runner is not None:
+        return _runner
+    
+    _ipn_queue = asyncio.Queue(maxsize=IPN_QUEUE_SIZE)
+    for _ in range(IPN_WORKERS):
+        _ipn_workers.append(asyncio.create_task(_ipn_worker()))
+    
+    app = build_app(application, serve_telegram)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    site = web.TCPSite(_runner, '0.0.0.0', config.WEBHOOK_PORT)
+    await site.start()
+
+    logger.info(f"✅ HTTP server listening on port {config.WEBHOOK_PORT}")
+    logger.info("✅ Endpoints: /health, /metrics, /nowpayments/webhook" + (f", /{config.WEBHOOK_PATH}" if serve_telegram else ""))
+    return _runner
+
+async def stop_http_server(application=None):
+    """Stop HTTP server and IPN workers (pending IPNs are drained first)"""
+    global _runner
+    if _runner is None:
+        return
+    
+    await _runner.cleanup()
+    _runner = None
+    
+    try:
+        await asyncio.wait_for(_ipn_queue.join(), timeout=10)
+    except asyncio.TimeoutError:
+        logger.warning(f"⚠️ {_ipn_queue.qsize()} IPNs still queued at shutdown")
+    
+    for task in _ipn_workers:
+        task.cancel()
+    _ipn_workers.clear()
+
+async def run_webhook(application, stop_event: asyncio.Event = None):
+    """
+    Run bot in webhook mode until stopped
+    
+    Args:
+        application: PTB Application (built with concurrent_updates)
+        stop_event: set to stop the bot (defaults to SIGINT/SIGTERM)
+    """
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+    
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    
+    await start_http_server(application, serve_telegram=True)
+    try:
+        await application.start()
+        
+        webhook_url = f"{config.WEBHOOK_URL.rstrip('/')}/{config.WEBHOOK_PATH}"
+        await application.bot.set_webhook(
+            url=webhook_url,
+            secret_token=config.WEBHOOK_SECRET,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True
+        )
+        logger.info(f"✅ Webhook set: {webhook_url} (max_connections={config.WEBHOOK_MAX_CONNECTIONS})")
+        
+        await stop_event.wait()
+    finally:
+        logger.info("🛑 Stopping webhook server...")
+        await stop_http_server()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
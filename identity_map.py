@@ -0,0 +1,150 @@
+"""
+Identity Map - Per-update document cache
+Each entity is fetched from MongoDB at most once while one update is handled
+"""
+
+import contextvars
+import copy
+import logging
+from contextlib import contextmanager
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Map bound to the update currently being processed (None outside handlers)
+_current = contextvars.ContextVar('identity_map', default=None)
+
+# Process-wide counters (loads = real queries, hits = avoided queries)
+stats = {
+    'scopes': 0,
+    'loads': 0,
+    'hits': 0
+}
+
+
+class IdentityMap:
+    """Documents loaded during one handler invocation, keyed by (collection, id)"""
+    
+    def __init__(self):
+        self._docs = {}
+        self.dirty = set()
+        self.loads = 0
+        self.hits = 0
+        self.active = True
+    
+    def get(self, collection, key, loader):
+        """
+        Return cached document or load it once
+        
+        Callers get their own copy, so editing a returned document never
+        changes what later reads in the update see - only inc/set do.
+        """
+        ident = (collection, key)
+        if ident in self._docs:
+            self.hits += 1
+            stats['hits'] += 1
+            return copy.deepcopy(self._docs[ident])
+        
+        doc = loader()
+        self.loads += 1
+        stats['loads'] += 1
+        
+        # Misses are not cached - the document may be created later in the update
+        if doc is not None:
+            self._docs[ident] = copy.deepcopy(doc)
+        return doc
+    
+    def inc(self, collection, key, field, amount):
+        """Apply a local $inc to a cached document"""
+        doc = self._docs.get((collection, key))
+        if doc is not None:
+            doc[field] = doc.get(field, 0) + amount
+            self.dirty.add((collection, key))
+    
+    def set(self, collection, key, fields):
+        """Apply a local $set to a cached document"""
+        doc = self._docs.get((collection, key))
+        if doc is not None:
+            doc.update(fields)
+            self.dirty.add((collection, key))
+    
+    def discard(self, collection, key):
+        """Forget a document so the next read goes to the database"""
+        self._docs.pop((collection, key), None)
+        self.dirty.discard((collection, key))
+    
+    def close(self):
+        """Stop serving cached documents (background tasks fall back to DB)"""
+        self.active = False
+        self._docs.clear()
+
+
+def current():
+    """Get the active identity map for this update, or None"""
+    identity_map = _current.get()
+    if identity_map is not None and identity_map.active:
+        return identity_map
+    return None
+
+
+@contextmanager
+def scope():
+    """Open a fresh identity map for the duration of one update"""
+    identity_map = IdentityMap()
+    token = _current.set(identity_map)
+    stats['scopes'] += 1
+    try:
+        yield identity_map
+    finally:
+        if identity_map.hits or identity_map.dirty:
+            logger.debug(
+                f"🗂️ Identity map: {identity_map.loads} loads, "
+                f"{identity_map.hits} avoided, {len(identity_map.dirty)} modified"
+            )
+        identity_map.close()
+        _current.reset(token)
+
+
+@metrics.register_collector
+def _identity_map_metrics():
+    return [
+        ('identity_map_scopes_total', 'counter', 'Updates processed inside an identity map scope',
+         [({}, stats['scopes'])]),
+        ('identity_map_loads_total', 'counter', 'Documents loaded from MongoDB through the identity map',
+         [({}, stats['loads'])]),
+        ('identity_map_avoided_queries_total', 'counter', 'Reads served from the identity map',
+         [({}, stats['hits'])])
+    ]
+
+
+# ============================================
+# HELPERS USED BY THE MODEL LAYER
+# ============================================
+
+def load(collection, key, loader):
+    """Load through the active identity map (or directly when none is open)"""
+    identity_map = current()
+    if identity_map is None:
+        return loader()
+    return identity_map.get(collection, key, loader)
+
+
+def record_inc(collection, key, field, amount):
+    """Mirror a successful $inc into the active identity map"""
+    identity_map = current()
+    if identity_map is not None:
+        identity_map.inc(collection, key, field, amount)
+
+
+def record_set(collection, key, fields):
+    """Mirror a successful $set into the active identity map"""
+    identity_map = current()
+    if identity_map is not None:
+        identity_map.set(collection, key, fields)
+
+
+def evict(collection, key):
+    """Drop a document written outside the model layer"""
+    identity_map = current()
+    if identity_map is not None:
+        identity_map.discard(collection, key)
@@ -0,0 +1,625 @@
+"""
+Session Ingestion - Staged pipeline shared by admin and leader bulk uploads
+unpack → dedupe → authorize → profile → spam_probe → store → persist, joined by
+bounded queues so a slow stage (SpamBot, channel uploads) holds back the ones
+before it instead of piling up connected clients
+"""
+
+import asyncio
+import io
+import itertools
+import logging
+import os
+import time
+import zipfile
+from datetime import datetime
+from telegram import InputMediaDocument
+from telegram.error import RetryAfter
+import config
+import metrics
+from database import SessionFingerprint
+from session_loader import read_session, to_string_session
+from spambot_probe import check_account_with_spambot
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('unpack', 'dedupe', 'authorize', 'profile', 'spam_probe', 'store', 'persist')
+
+# unpack reads the archive in order, store batches uploads and persist
+# appends results / reports progress in order, so these stay single-worker
+FIXED_CONCURRENCY = {'unpack': 1, 'store': 1, 'persist': 1}
+
+# store archives up to ARCHIVE_BATCH_SIZE documents per sendMediaGroup (Telegram's
+# album limit), waiting at most ARCHIVE_LINGER seconds for a batch to fill
+ARCHIVE_BATCH_SIZE = 10
+ARCHIVE_LINGER = 2.0
+ARCHIVE_POLL = 0.1
+
+# Attempts per channel upload when Telegram answers RetryAfter
+ARCHIVE_ATTEMPTS = 3
+
+CONNECT_TIMEOUT = 15.0
+REQUEST_TIMEOUT = 10.0
+
+STATUS_EMOJI = {
+    'Free': '🟢',
+    'Frozen': '🔴',
+    'Spam': '🟡',
+    'Unknown': '❓',
+    'Error': '❌'
+}
+
+STATUS_LABELS = {
+    'Free': '🟢 CLEAN',
+    'Frozen': '🔴 FROZEN',
+    'Spam': '🟡 SPAM LIMITED',
+    'Unknown': '❓ UNKNOWN',
+    'Error': '❌ CHECK ERROR'
+}
+
+stage_latency = metrics.Histogram(
+    'ingest_stage_duration_seconds', 'Time one session spends in an ingestion stage', ('stage',)
+)
+stage_items = metrics.Counter(
+    'ingest_stage_items_total', 'Sessions leaving an ingestion stage', ('stage', 'outcome')
+)
+archive_calls = metrics.Counter(
+    'ingest_archive_calls_total', 'Storage channel uploads made by the store stage', ('method',)
+)
+
+# ============================================
+# API CREDENTIALS FOR PARALLEL PROCESSING
+# ============================================
+
+API_CREDENTIALS = []
+
+# Main API (from .env)
+if config.TELEGRAM_API_ID and config.TELEGRAM_API_HASH:
+    API_CREDENTIALS.append({
+        'api_id': config.TELEGRAM_API_ID,
+        'api_hash': config.TELEGRAM_API_HASH,
+        'name': 'Main API'
+    })
+
+# Additional APIs (from environment variables)
+for i in range(2, 5):  # API 2, 3, 4
+    api_id = os.getenv(f'API_ID_{i}')
+    api_hash = os.getenv(f'API_HASH_{i}')
+    if api_id and api_hash:
+        try:
+            API_CREDENTIALS.append({
+                'api_id': int(api_id),
+                'api_hash': api_hash,
+                'name': f'API {i}'
+            })
+        except ValueError:
+            logger.error(f"Invalid API_ID_{i}")
+
+logger.info(f"✅ Loaded {len(API_CREDENTIALS)} API credentials for parallel processing")
+
+# ============================================
+# SHARED HELPERS
+# ============================================
+
+async def extract_session_info(client, me=None) -> str:
+    """
+    Extract detailed info from session
+    Returns formatted string with account details (at most 4 items)
+    """
+    try:
+        info_parts = []
+        
+        if me is None:
+            me = await client.get_me()
+        
+        # 1. Premium status
+        if getattr(me, 'premium', False):
+            info_parts.append("Premium")
+        
+        # 2. Verified status
+        if getattr(me, 'verified', False):
+            info_parts.append("Verified")
+        
+        # 3. Username
+        if me.username:
+            info_parts.append(f"@{me.username}")
+        
+        # 4. Account age (approximate via user ID - lower is older)
+        user_id = me.id
+        if user_id < 1000000:
+            info_parts.append("Very old account")
+        elif user_id < 100000000:
+            info_parts.append("Old account (5+ years)")
+        elif user_id < 500000000:
+            info_parts.append("3+ years old")
+        elif user_id < 1000000000:
+            info_parts.append("2+ years old")
+        elif user_id < 2000000000:
+            info_parts.append("1+ year old")
+        else:
+            info_parts.append("New account")
+        
+        # 5. Profile photo / bot flags
+        if getattr(me, 'photo', None):
+            info_parts.append("Has photo")
+        if getattr(me, 'bot', False):
+            info_parts.append("Bot account")
+        
+        if info_parts:
+            return " • ".join(info_parts[:4])
+        return None
+    
+    except Exception as e:
+        logger.error(f"Error extracting session info: {e}")
+        return None
+
+# ============================================
+# PIPELINE
+# ============================================
+
+class SessionUpload:
+    """One .session file on its way through the pipeline"""
+    
+    def __init__(self, index, name, data):
+        self.index = index
+        self.name = name
+        self.data = data
+        self.session_file = None
+        self.phone = SessionFingerprint.phone_from_filename(name)
+        self.auth_key_hash = None
+        self.client = None
+        self.me = None
+        self.info = None
+        self.spam = None
+        self.message_id = None
+        self.file_id = None
+        self.duplicate = None
+        self.error = None
+    
+    def result(self) -> dict:
+        """Entry for context.user_data['bulk_sessions']"""
+        return {
+            'message_id': self.message_id,
+            'file_id': self.file_id,
+            'phone': self.phone,
+            'spam_status': self.spam['status'],
+            'auto_info': self.info,
+            'auth_key_hash': self.auth_key_hash,
+            'telegram_id': self.me.id
+        }
+
+class IngestionPipeline:
+    """
+    Runs a batch of .session files through the ingestion stages
+    
+    Each stage has its own workers (config.INGEST_CONCURRENCY) reading from a
+    bounded queue (config.INGEST_QUEUE_SIZE). A session that fails or turns out
+    to be a duplicate skips ahead to persist, which reports every file exactly
+    once through on_result and cleans up after it. store takes sessions in
+    batches and archives each batch with a single sendMediaGroup.
+    """
+    
+    def __init__(self, bot, uploader_id, upload_id, on_result):
+        self.bot = bot
+        self.uploader_id = uploader_id
+        self.upload_id = upload_id
+        self.on_result = on_result
+        self.concurrency = {**config.INGEST_CONCURRENCY, **FIXED_CONCURRENCY}
+        self.queues = {stage: asyncio.Queue(maxsize=config.INGEST_QUEUE_SIZE) for stage in STAGES[1:]}
+        # Room for a full media group
+        self.queues['store'] = asyncio.Queue(maxsize=max(config.INGEST_QUEUE_SIZE, ARCHIVE_BATCH_SIZE))
+        # Sessions that may still reach store; batches stop waiting once none are left
+        self._upstream = 0
+        self._producing = False
+        self.stage_stats = {stage: {'items': 0, 'seconds': 0.0} for stage in STAGES}
+        self._credentials = itertools.cycle(API_CREDENTIALS or [
+            {'api_id': config.TELEGRAM_API_ID, 'api_hash': config.TELEGRAM_API_HASH, 'name': 'Main API'}
+        ])
+        self.elapsed = 0.0
+    
+    # ----- stages -----
+    
+    async def unpack(self, item):
+        if callable(item.data):
+            item.data = await asyncio.to_thread(item.data)
+        # Parsed in memory - nothing is written to disk
+        item.session_file = read_session(item.data)
+        if item.session_file is None:
+            item.error = "Not a valid Telethon session file"
+            return
+        item.auth_key_hash = SessionFingerprint.hash_auth_key(item.session_file.auth_key)
+    
+    async def dedupe(self, item):
+        duplicate = await asyncio.to_thread(
+            SessionFingerprint.find_duplicate, item.auth_key_hash, item.phone,
+            uploader_id=self.uploader_id, upload_id=self.upload_id
+        )
+        if duplicate:
+            item.duplicate = SessionFingerprint.describe(duplicate)
+    
+    async def authorize(self, item):
+        from telethon import TelegramClient
+        
+        credential = next(self._credentials)
+        item.client = TelegramClient(
+            to_string_session(item.session_file),
+            credential['api_id'],
+            credential['api_hash'],
+            system_version="4.16.30-vxCUSTOM",
+            connection_retries=3,
+            retry_delay=2,
+            timeout=10
+        )
+        await asyncio.wait_for(item.client.connect(), timeout=CONNECT_TIMEOUT)
+        if not await asyncio.wait_for(item.client.is_user_authorized(), timeout=REQUEST_TIMEOUT):
+            item.error = "Invalid or expired session"
+            return
+        
+        item.me = await asyncio.wait_for(item.client.get_me(), timeout=REQUEST_TIMEOUT)
+        item.phone = item.me.phone or "Unknown"
+        
+        # Same account under another auth key (re-login)
+        duplicate = await asyncio.to_thread(
+            SessionFingerprint.claim, item.auth_key_hash, item.me.phone, item.me.id,
+            uploader_id=self.uploader_id, upload_id=self.upload_id
+        )
+        if duplicate:
+            item.duplicate = SessionFingerprint.describe(duplicate)
+    
+    async def profile(self, item):
+        item.info = await extract_session_info(item.client, item.me)
+    
+    async def spam_probe(self, item):
+        try:
+            item.spam = await check_account_with_spambot(item.client, item.phone, user_id=item.me.id)
+        finally:
+            await item.client.disconnect()
+    
+    async def store(self, batch):
+        """Archive a batch with one sendMediaGroup; whatever it didn't take is sent one by one"""
+        pending = batch
+        if len(batch) > 1:
+            try:
+                messages = await self._channel_call('send_media_group', lambda: {
+                    'media': [
+                        InputMediaDocument(item.data, filename=os.path.basename(item.name), caption=self._caption(item))
+                        for item in batch
+                    ]
+                })
+                for item, message in zip(batch, messages):
+                    self._archived(item, message)
+                pending = [item for item in batch if item.message_id is None]
+            except Exception as e:
+                logger.warning(f"⚠️ Media group of {len(batch)} sessions failed, archiving one by one: {e}")
+        
+        for item in pending:
+            try:
+                message = await self._channel_call('send_document', lambda: {
+                    'document': item.data,
+                    'filename': os.path.basename(item.name),
+                    'caption': self._caption(item)
+                })
+                self._archived(item, message)
+            except Exception as e:
+                logger.error(f"❌ Could not archive {item.name}: {e}")
+                item.error = f"Storage channel upload failed: {e}"
+    
+    @staticmethod
+    def _caption(item) -> str:
+        emoji = STATUS_EMOJI.get(item.spam['status'], '❓')
+        caption_parts = [
+            f"📱 Phone: {item.phone}",
+            f"{emoji} Status: {item.spam['status']}"
+        ]
+        if item.info:
+            caption_parts.append(f"ℹ️ {item.info}")
+        caption_parts.append(f"⏰ {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+        return "\n".join(caption_parts)
+        
+    @staticmethod
+    def _archived(item, message):
+        item.message_id = message.message_id
+        item.file_id = message.document.file_id if message.document else None
+        item.data = None
+    
+    async def _channel_call(self, method, build_kwargs):
+        # Files are re-attached on every attempt
+        for attempt in range(1, ARCHIVE_ATTEMPTS + 1):
+            archive_calls.inc(method)
+            try:
+                return await getattr(self.bot, method)(chat_id=config.STORAGE_CHANNEL_ID, **build_kwargs())
+            except RetryAfter as e:
+                if attempt == ARCHIVE_ATTEMPTS:
+                    raise
+                logger.warning(f"⏳ Storage channel flood limit, retrying {method} in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+    
+    async def persist(self, item):
+        if item.client is not None and item.client.is_connected():
+            try:
+                await asyncio.wait_for(item.client.disconnect(), timeout=5.0)
+            except Exception:
+                pass
+        item.data = None
+        await self.on_result(item)
+    
+    # ----- plumbing -----
+    
+    def _outcome(self, item):
+        if item.error:
+            return 'failed'
+        if item.duplicate:
+            return 'duplicate'
+        return 'ok'
+    
+    def _account(self, stage, items, elapsed):
+        for item in items:
+            stage_latency.observe(elapsed, stage)
+            stage_items.inc(stage, self._outcome(item))
+        self.stage_stats[stage]['items'] += len(items)
+        self.stage_stats[stage]['seconds'] += elapsed
+    
+    async def _process(self, stage, item):
+        started = time.perf_counter()
+        try:
+            await getattr(self, stage)(item)
+        except Exception as e:
+            logger.error(f"❌ Ingest {stage} failed for {item.name}: {e}")
+            item.error = "Invalid or expired session" if stage == 'authorize' else str(e)
+        self._account(stage, [item], time.perf_counter() - started)
+    
+    def _next_queue(self, stage, item):
+        if stage == 'persist':
+            return None
+        if item.error or item.duplicate:
+            return self.queues['persist']
+        return self.queues[STAGES[STAGES.index(stage) + 1]]
+    
+    async def _forward(self, stage, item):
+        outbox = self._next_queue(stage, item)
+        if outbox is None:
+            return
+        if outbox is self.queues['persist'] and STAGES.index(stage) < STAGES.index('store'):
+            # Dropped out before store
+            self._upstream -= 1
+        # Blocks while the next stage is saturated (backpressure)
+        await outbox.put(item)
+    
+    async def _worker(self, stage):
+        inbox = self.queues[stage]
+        while True:
+            item = await inbox.get()
+            try:
+                await self._process(stage, item)
+                await self._forward(stage, item)
+            finally:
+                inbox.task_done()
+    
+    def _more_coming(self) -> bool:
+        return self._producing or self._upstream > 0
+    
+    async def _archive_worker(self):
+        inbox = self.queues['store']
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await inbox.get()]
+            self._upstream -= 1
+            try:
+                deadline = loop.time() + ARCHIVE_LINGER
+                while len(batch) < ARCHIVE_BATCH_SIZE and self._more_coming():
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(inbox.get(), timeout=min(remaining, ARCHIVE_POLL))
+                    except asyncio.TimeoutError:
+                        continue
+                    batch.append(item)
+                    self._upstream -= 1
+                
+                started = time.perf_counter()
+                await self.store(batch)
+                self._account('store', batch, time.perf_counter() - started)
+                for item in batch:
+                    await self.queues['persist'].put(item)
+            finally:
+                for _ in batch:
+                    inbox.task_done()
+    
+    async def _unpack_all(self, sources):
+        self._producing = True
+        try:
+            for index, (name, data) in enumerate(sources, 1):
+                item = SessionUpload(index, name, data)
+                self._upstream += 1
+                await self._process('unpack', item)
+                await self._forward('unpack', item)
+        finally:
+            self._producing = False
+    
+    async def run(self, sources):
+        """
+        sources: [(file name, .session bytes or a zero-argument loader)] in upload order
+        Returns when every session has been through persist.
+        """
+        started = time.perf_counter()
+        workers = [
+            asyncio.create_task(self._archive_worker() if stage == 'store' else self._worker(stage))
+            for stage in STAGES[1:]
+            for _ in range(max(1, self.concurrency.get(stage, 1)))
+        ]
+        try:
+            await self._unpack_all(sources)
+            for stage in STAGES[1:]:
+                await self.queues[stage].join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        
+        self.elapsed = time.perf_counter() - started
+        logger.info(f"📦 Ingested {len(sources)} sessions in {self.elapsed:.1f}s - {self.throughput_report()}")
+    
+    def throughput_report(self) -> str:
+        """Sessions per second of busy time for each stage"""
+        parts = []
+        for stage in STAGES:
+            stats = self.stage_stats[stage]
+            if stats['items']:
+                rate = stats['items'] / stats['seconds'] if stats['seconds'] else float('inf')
+                parts.append(f"{stage} {rate:.1f}/s")
+        return ", ".join(parts)
+
+# ============================================
+# CONVERSATION ENTRY POINT
+# ============================================
+
+async def ingest_upload(bot, chat_id, status_msg, file_name, telegram_file, uploader_id, upload_id, bulk_sessions):
+    """
+    Run one uploaded .zip or .session file through the pipeline, reporting
+    progress in the chat; accepted sessions are appended to bulk_sessions
+    """
+    if file_name.endswith('.zip'):
+        zip_bytes = await telegram_file.download_as_bytearray()
+        try:
+            zip_file = zipfile.ZipFile(io.BytesIO(zip_bytes))
+        except zipfile.BadZipFile:
+            await status_msg.edit_text("❌ Invalid ZIP file!")
+            return
+        
+        session_files = [name for name in zip_file.namelist() if name.endswith('.session')]
+        if not session_files:
+            await status_msg.edit_text(
+                "❌ No .session files found in ZIP!\n\n"
+                "Make sure your ZIP contains .session files."
+            )
+            return
+        sources = [(name, lambda name=name: zip_file.read(name)) for name in session_files]
+    
+    elif file_name.endswith('.session'):
+        sources = [(file_name, bytes(await telegram_file.download_as_bytearray()))]
+    
+    else:
+        await status_msg.edit_text(
+            "❌ File must be .session or .zip!\n\n"
+            f"Current: {len(bulk_sessions)} sessions loaded\n\n"
+            f"📤 Send more files or type /done"
+        )
+        return
+    
+    total_files = len(sources)
+    is_zip = file_name.endswith('.zip')
+    counts = {'processed': 0, 'failed': 0}
+    failed_files = []
+    spam_stats = {status: 0 for status in STATUS_LABELS}
+    
+    if is_zip:
+        await status_msg.edit_text(
+            f"📦 Processing ZIP: {total_files} session files found...\n"
+            f"⏳ Sessions are checked in parallel\n\n"
+            f"Progress will be shown below..."
+        )
+    else:
+        await status_msg.edit_text(f"⏳ Checking {file_name}...")
+    
+    async def on_result(item):
+        short_name = os.path.basename(item.name)
+        if item.error or item.duplicate:
+            counts['failed'] += 1
+            failed_files.append(short_name)
+            reason = f"Duplicate - {item.duplicate}" if item.duplicate else item.error
+            logger.warning(f"❌ Failed {item.index}/{total_files}: {short_name} ({reason})")
+            if is_zip:
+                text = (
+                    f"❌ {item.index}/{total_files} Failed\n\n"
+                    f"File: {short_name}\n"
+                    f"Reason: {reason}\n\n"
+                    f"Progress: {counts['processed']} success, {counts['failed']} failed"
+                )
+            elif item.duplicate:
+                text = (
+                    f"♻️ Duplicate skipped {short_name}\n\n"
+                    f"📱 {item.phone or 'Unknown'} is {item.duplicate}\n\n"
+                    f"Total loaded: {len(bulk_sessions)} sessions\n\n"
+                    f"📤 Send more files or type /done to continue."
+                )
+            else:
+                text = (
+                    f"❌ Failed to process {short_name}\n\n"
+                    f"Reason: {reason}\n\n"
+                    f"Total loaded: {len(bulk_sessions)} sessions\n\n"
+                    f"📤 Send more files or type /done to continue."
+                )
+        else:
+            bulk_sessions.append(item.result())
+            counts['processed'] += 1
+            spam_status = item.spam['status']
+            if spam_status in spam_stats:
+                spam_stats[spam_status] += 1
+            status_text = STATUS_LABELS.get(spam_status, f'❓ {spam_status}')
+            logger.info(f"✅ {item.index}/{total_files}: {item.phone} ({spam_status})")
+            if is_zip:
+                text = (
+                    f"✅ {item.index}/{total_files} Processed\n\n"
+                    f"📱 Phone: {item.phone}\n"
+                    f"📊 Status: {status_text}\n\n"
+                    f"Progress: {counts['processed']} success, {counts['failed']} failed"
+                )
+            else:
+                text = (
+                    f"✅ Session Added\n\n"
+                    f"📱 Phone: {item.phone}\n"
+                    f"📊 Status: {status_text}\n\n"
+                    f"Total: {len(bulk_sessions)} sessions\n\n"
+                    f"📤 Send more files or type /done to continue."
+                )
+        
+        try:
+            if is_zip:
+                await bot.send_message(chat_id, text)
+            else:
+                await status_msg.edit_text(text)
+        except Exception as e:
+            logger.debug(f"Progress message failed: {e}")
+    
+    pipeline = IngestionPipeline(bot, uploader_id, upload_id, on_result)
+    await pipeline.run(sources)
+    
+    if not is_zip:
+        return
+    
+    # Final summary with spam stats
+    summary = (
+        f"✅ **ZIP Processing Complete!**\n\n"
+        f"📊 **Results:**\n"
+        f"✅ Successful: {counts['processed']}/{total_files}\n"
+        f"❌ Failed: {counts['failed']}/{total_files}\n"
+        f"⚡ {pipeline.elapsed:.0f}s total\n\n"
+    )
+    
+    if counts['processed'] > 0:
+        summary += "📊 **Account Status:**\n"
+        for status, label in (('Free', '🟢 Clean'), ('Spam', '🟡 Spam Limited'), ('Frozen', '🔴 Frozen'),
+                              ('Unknown', '❓ Unknown'), ('Error', '❌ Check Error')):
+            if spam_stats[status] > 0:
+                summary += f"  {label}: {spam_stats[status]}\n"
+        summary += "\n"
+    
+    if failed_files:
+        summary += "Failed files:\n"
+        for name in failed_files[:10]:
+            summary += f"• {name}\n"
+        if len(failed_files) > 10:
+            summary += f"... and {len(failed_files) - 10} more\n"
+        summary += "\n"
+    
+    summary += (
+        f"Total loaded: {len(bulk_sessions)} sessions\n\n"
+        f"✅ Type /done when finished uploading."
+    )
+    
+    try:
+        await status_msg.edit_text(summary, parse_mode='Markdown')
+    except Exception:
+        # File names can break Markdown
+        await status_msg.edit_text(summary.replace('**', ''))
@@ -0,0 +1,202 @@
+"""
+Instrumentation - Latency histograms and error counters for /metrics
+Times bot handlers, MongoDB commands, Bot API calls and outbound HTTP
+(blockchain explorers, price feeds, payment and SMS providers)
+"""
+
+import functools
+import logging
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from pymongo import monitoring
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+from telegram.request import HTTPXRequest
+import metrics
+
+logger = logging.getLogger(__name__)
+
+handler_latency = metrics.Histogram(
+    'bot_handler_duration_seconds', 'Handler callback duration', ('handler', 'route')
+)
+handler_errors = metrics.Counter(
+    'bot_handler_errors_total', 'Handler callbacks that raised', ('handler', 'route')
+)
+mongo_latency = metrics.Histogram(
+    'mongo_command_duration_seconds', 'MongoDB command duration', ('collection', 'command')
+)
+mongo_errors = metrics.Counter(
+    'mongo_command_errors_total', 'MongoDB commands that failed', ('collection', 'command')
+)
+bot_api_latency = metrics.Histogram(
+    'bot_api_request_duration_seconds', 'Telegram Bot API request duration', ('method',)
+)
+bot_api_errors = metrics.Counter(
+    'bot_api_errors_total', 'Telegram Bot API requests that failed or returned an error status', ('method',)
+)
+http_latency = metrics.Histogram(
+    'http_client_request_duration_seconds', 'Outbound HTTP request duration', ('provider',)
+)
+http_errors = metrics.Counter(
+    'http_client_errors_total', 'Outbound HTTP requests that failed or returned an error status', ('provider',)
+)
+
+# ObjectIds, numbers and long tokens in callback data would make a label per user
+_ROUTE_ID = re.compile(r'[0-9a-fA-F]{24}|\d+(\.\d+)?|[A-Za-z0-9]{32,}')
+
+_installed = False
+
+# ============================================
+# HANDLERS
+# ============================================
+
+def _route(update) -> str:
+    """Low-cardinality description of what triggered the update"""
+    if not isinstance(update, Update):
+        return 'other'
+    if update.callback_query:
+        return _ROUTE_ID.sub('*', update.callback_query.data or '')[:64]
+    message = update.effective_message
+    if message and message.text and message.text.startswith('/'):
+        return message.text.split()[0].split('@')[0][:32]
+    if message and message.document:
+        return 'document'
+    if message:
+        return 'message'
+    return 'other'
+
+def _timed_callback(callback):
+    if getattr(callback, '_instrumented', False):
+        return callback
+    
+    name = getattr(callback, '__name__', type(callback).__name__)
+    
+    @functools.wraps(callback)
+    async def timed(update, context):
+        route = _route(update)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            handler_errors.inc(name, route)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name, route)
+    
+    timed._instrumented = True
+    return timed
+
+def instrument_handler(handler):
+    """Wrap a handler's callback (recursing into conversations) with latency timing"""
+    if isinstance(handler, ConversationHandler):
+        nested = list(handler.entry_points) + list(handler.fallbacks)
+        for state_handlers in handler.states.values():
+            nested.extend(state_handlers)
+        for inner in nested:
+            instrument_handler(inner)
+    elif callable(getattr(handler, 'callback', None)):
+        handler.callback = _timed_callback(handler.callback)
+    return handler
+
+# ============================================
+# MONGODB
+# ============================================
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Records duration of every command sent on the client it is attached to"""
+    
+    def __init__(self):
+        # (connection, request_id) -> (collection, command) of in-flight commands
+        self._pending = {}
+        self._lock = threading.Lock()
+    
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if event.command_name == 'getMore':
+            collection = event.command.get('collection')
+        if not isinstance(collection, str):
+            # Database-level commands (ping, hello, endSessions...)
+            collection = event.database_name
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (collection, event.command_name)
+    
+    def _finish(self, event, failed):
+        with self._lock:
+            labels = self._pending.pop((event.connection_id, event.request_id), None)
+        if labels is None:
+            labels = ('unknown', event.command_name)
+        mongo_latency.observe(event.duration_micros / 1e6, *labels)
+        if failed:
+            mongo_errors.inc(*labels)
+    
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+    
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+mongo_listener = MongoCommandTimer()
+
+# ============================================
+# BOT API AND OUTBOUND HTTP
+# ============================================
+
+def _bot_api_method(url: str) -> str:
+    if '/file/bot' in url:
+        return 'file_download'
+    return url.rstrip('/').rsplit('/', 1)[-1]
+
+def _install_bot_api_timing():
+    do_request = HTTPXRequest.do_request
+    
+    @functools.wraps(do_request)
+    async def timed_do_request(self, url, method, *args, **kwargs):
+        api_method = _bot_api_method(url)
+        started = time.perf_counter()
+        try:
+            code, payload = await do_request(self, url, method, *args, **kwargs)
+        except Exception:
+            bot_api_errors.inc(api_method)
+            raise
+        finally:
+            bot_api_latency.observe(time.perf_counter() - started, api_method)
+        if code >= 400:
+            bot_api_errors.inc(api_method)
+        return code, payload
+    
+    HTTPXRequest.do_request = timed_do_request
+
+def _install_http_timing():
+    request = requests.Session.request
+    
+    @functools.wraps(request)
+    def timed_request(self, method, url, *args, **kwargs):
+        provider = urlsplit(str(url)).hostname or 'unknown'
+        started = time.perf_counter()
+        try:
+            response = request(self, method, url, *args, **kwargs)
+        except Exception:
+            http_errors.inc(provider)
+            raise
+        finally:
+            http_latency.observe(time.perf_counter() - started, provider)
+        if response.status_code >= 400:
+            http_errors.inc(provider)
+        return response
+    
+    requests.Session.request = timed_request
+
+def install():
+    """Start timing Bot API and outbound HTTP calls (idempotent)"""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    _install_bot_api_timing()
+    _install_http_timing()
+    logger.info("✅ Latency instrumentation installed")
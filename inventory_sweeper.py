@@ -0,0 +1,323 @@
+"""
+Inventory Sweeper - Revalidates unsold sessions in the background
+Checks the stalest, most in-demand inventory first across every API credential
+and moves dead or frozen sessions out of the unsold pool into quarantined_sessions
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from telegram.error import BadRequest, RetryAfter
+import config
+import leases
+import metrics
+from session_loader import read_session, to_string_session
+
+logger = logging.getLogger(__name__)
+
+# Only one replica sweeps at a time
+LEASE_NAME = 'inventory_sweeper'
+leases.register_job(LEASE_NAME)
+
+# A session is due for another check this long after its last one
+RECHECK_AFTER = timedelta(hours=12)
+
+# Sessions checked per sweep, picked from the CANDIDATE_LIMIT least recently checked
+SWEEP_BATCH = 500
+CANDIDATE_LIMIT = 5000
+
+# Country demand is counted over recent purchases; the busiest country's
+# sessions are weighted (1 + DEMAND_WEIGHT) times their age
+DEMAND_WINDOW = timedelta(days=7)
+DEMAND_WEIGHT = 3.0
+
+CHECK_TIMEOUT = 45
+
+# A credential told to wait longer than this sits out the rest of the sweep
+MAX_FLOOD_WAIT = 300
+
+# Results that take a session off sale
+QUARANTINE_RESULTS = ('dead', 'frozen', 'missing')
+
+# BadRequest texts meaning the stored file itself is gone; any other BadRequest
+# (bad or foreign file_id after a token change, etc.) is retried, never quarantined
+MISSING_FILE_ERRORS = ('file not found', 'message to forward not found')
+
+check_latency = metrics.Histogram(
+    'inventory_check_duration_seconds', 'Time to revalidate one unsold session', ('result',)
+)
+check_results = metrics.Counter(
+    'inventory_checks_total', 'Unsold sessions revalidated by the sweeper', ('result',)
+)
+
+stats = {
+    'sweeps': 0,
+    'flood_waits': 0,
+    'last_sweep_checked': 0,
+    'last_sweep_seconds': 0.0,
+    'last_sweep_rate': 0.0,
+    'unsold': 0,
+    'due': 0,
+    'quarantined': 0
+}
+
+# ============================================
+# PRIORITY
+# ============================================
+
+def _country_demand(database) -> dict:
+    since = datetime.utcnow() - DEMAND_WINDOW
+    rows = database.purchases.aggregate([
+        {"$match": {"purchased_at": {"$gte": since}}},
+        {"$group": {"_id": "$country", "count": {"$sum": 1}}}
+    ])
+    return {row['_id']: row['count'] for row in rows}
+
+def _priority(session, demand, busiest, now) -> float:
+    """Hours since the session was last known good, scaled up by its country's demand"""
+    last_known = session.get('health_checked_at') or session.get('created_at') or now
+    age_hours = (now - last_known).total_seconds() / 3600
+    share = demand.get(session.get('country'), 0) / busiest if busiest else 0
+    return age_hours * (1 + DEMAND_WEIGHT * share)
+
+def due_sessions(database, limit: int = SWEEP_BATCH):
+    """(sessions to check this sweep, number of unsold sessions due a check)"""
+    now = datetime.utcnow()
+    candidates = list(database.sessions.find(
+        {
+            "is_sold": False,
+            "$or": [
+                {"health_checked_at": None},
+                {"health_checked_at": {"$lt": now - RECHECK_AFTER}}
+            ]
+        },
+        {"session_string": 1, "file_id": 1, "phone_number": 1, "country": 1, "created_at": 1, "health_checked_at": 1}
+    ).sort("health_checked_at", 1).limit(CANDIDATE_LIMIT))
+    
+    demand = _country_demand(database)
+    busiest = max(demand.values(), default=0)
+    candidates.sort(key=lambda session: _priority(session, demand, busiest, now), reverse=True)
+    return candidates[:limit], len(candidates)
+
+# ============================================
+# CHECK
+# ============================================
+
+async def _download_session(bot, message_id: int, file_id: str = None) -> bytes:
+    """
+    Fetch a .session file from the storage channel into memory
+    
+    Downloads by the stored file_id; sessions uploaded before file_id was
+    recorded are forwarded to the owner to get at the document, then the
+    forward is deleted.
+    """
+    forwarded = None
+    if file_id:
+        file = await bot.get_file(file_id)
+    else:
+        forwarded = await bot.forward_message(
+            chat_id=config.OWNER_ID,
+            from_chat_id=config.STORAGE_CHANNEL_ID,
+            message_id=message_id
+        )
+    try:
+        if forwarded is not None:
+            file = await forwarded.document.get_file()
+        return bytes(await file.download_as_bytearray())
+    finally:
+        if forwarded is not None:
+            try:
+                await bot.delete_message(chat_id=config.OWNER_ID, message_id=forwarded.message_id)
+            except Exception:
+                pass
+
+async def check_session(bot, session: dict, credential: dict) -> str:
+    """
+    'alive', 'dead', 'frozen', 'missing' (file gone from the storage channel)
+    or 'error' (couldn't check this time)
+    
+    FloodWaitError and RetryAfter propagate so the caller can back off.
+    """
+    from telethon import TelegramClient, errors
+    from telethon.sessions import StringSession
+    from spambot_probe import check_account_with_spambot
+    
+    stored = str(session['session_string'])
+    if stored.isdigit():
+        # Storage channel message id of the uploaded .session file
+        try:
+            data = await _download_session(bot, int(stored), session.get('file_id'))
+        except BadRequest as e:
+            if any(text in str(e).lower() for text in MISSING_FILE_ERRORS):
+                return 'missing'
+            logger.warning(f"⚠️ Could not download session {session.get('phone_number')}: {e}")
+            return 'error'
+        session_file = read_session(data)
+        if session_file is None:
+            logger.warning(f"⚠️ Stored file for {session.get('phone_number')} is not a Telethon session")
+            return 'error'
+        client = TelegramClient(to_string_session(session_file), credential['api_id'], credential['api_hash'])
+    else:
+        client = TelegramClient(StringSession(stored), credential['api_id'], credential['api_hash'])
+    
+    try:
+        await client.connect()
+        if not await client.is_user_authorized():
+            return 'dead'
+        me = await client.get_me()
+        verdict = await check_account_with_spambot(client, session['phone_number'], user_id=me.id)
+        return 'frozen' if verdict['status'] == 'Frozen' else 'alive'
+    except (errors.AuthKeyUnregisteredError, errors.AuthKeyDuplicatedError, errors.SessionRevokedError,
+            errors.UserDeactivatedError, errors.UserDeactivatedBanError):
+        return 'dead'
+    finally:
+        await client.disconnect()
+
+def _record(database, session: dict, result: str):
+    now = datetime.utcnow()
+    if result == 'alive':
+        database.sessions.update_one(
+            {"_id": session['_id']},
+            {"$set": {"health_checked_at": now, "health_status": result}}
+        )
+        return
+    
+    if result not in QUARANTINE_RESULTS:
+        # Errors are retried next sweep
+        return
+    
+    document = database.sessions.find_one({"_id": session['_id'], "is_sold": False})
+    if document is None:
+        return
+    document.update(quarantine_reason=result, quarantined_at=now)
+    
+    # Copy first, then delete only if still unsold: a crash in between leaves
+    # a duplicate in quarantine rather than losing the session
+    database.quarantined_sessions.replace_one({"_id": document['_id']}, document, upsert=True)
+    if database.sessions.delete_one({"_id": document['_id'], "is_sold": False}).deleted_count == 0:
+        # Sold while it was being checked
+        database.quarantined_sessions.delete_one({"_id": document['_id']})
+        return
+    logger.warning(f"🚫 Quarantined {document.get('phone_number')} ({document.get('country')}): {result}")
+
+# ============================================
+# SWEEP
+# ============================================
+
+async def _worker(bot, database, queue, credential, pauses, results):
+    from telethon.errors import FloodWaitError
+    
+    name = credential['name']
+    while leases.is_leader(LEASE_NAME):
+        pause = pauses.get(name, 0) - time.monotonic()
+        if pause > MAX_FLOOD_WAIT:
+            return
+        if pause > 0:
+            await asyncio.sleep(pause)
+        
+        try:
+            session = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(check_session(bot, session, credential), timeout=CHECK_TIMEOUT)
+        except FloodWaitError as e:
+            # Only this credential is limited; the session goes back for another one
+            stats['flood_waits'] += 1
+            pauses[name] = time.monotonic() + e.seconds
+            logger.warning(f"⏳ {name} flood-waited {e.seconds}s during inventory sweep")
+            queue.put_nowait(session)
+            continue
+        except RetryAfter as e:
+            # Bot API limit on storage channel downloads
+            stats['flood_waits'] += 1
+            queue.put_nowait(session)
+            await asyncio.sleep(e.retry_after)
+            continue
+        except Exception as e:
+            logger.debug(f"Inventory check failed for {session.get('phone_number')}: {e}")
+            result = 'error'
+        
+        check_latency.observe(time.perf_counter() - started, result)
+        check_results.inc(result)
+        results[result] = results.get(result, 0) + 1
+        await asyncio.to_thread(_record, database, session, result)
+
+async def sweep(bot) -> dict:
+    """Revalidate one batch of due sessions; returns the count per result"""
+    from database import get_db
+    from ingestion import API_CREDENTIALS
+    
+    database = get_db()
+    started = time.perf_counter()
+    sessions, stats['due'] = await asyncio.to_thread(due_sessions, database)
+    
+    queue = asyncio.Queue()
+    for session in sessions:
+        queue.put_nowait(session)
+    
+    pauses = {}
+    results = {}
+    await asyncio.gather(*[
+        _worker(bot, database, queue, credential, pauses, results)
+        for credential in API_CREDENTIALS
+        for _ in range(config.INVENTORY_SWEEP_CONCURRENCY)
+    ])
+    
+    elapsed = time.perf_counter() - started
+    checked = sum(results.values())
+    stats['sweeps'] += 1
+    stats['last_sweep_checked'] = checked
+    stats['last_sweep_seconds'] = elapsed
+    stats['last_sweep_rate'] = checked / elapsed if elapsed else 0.0
+    stats['unsold'] = await asyncio.to_thread(database.sessions.count_documents, {"is_sold": False})
+    stats['quarantined'] = await asyncio.to_thread(database.quarantined_sessions.count_documents, {})
+    
+    logger.info(
+        f"🧹 Inventory sweep: {checked}/{len(sessions)} checked in {elapsed:.0f}s "
+        f"({stats['last_sweep_rate']:.1f}/s) - " +
+        ', '.join(f"{count} {result}" for result, count in sorted(results.items()))
+    )
+    return results
+
+async def run_sweeper(bot):
+    """Sweep every INVENTORY_SWEEP_INTERVAL seconds while this replica holds the lease"""
+    from ingestion import API_CREDENTIALS
+    
+    if config.INVENTORY_SWEEP_INTERVAL <= 0:
+        return
+    if not API_CREDENTIALS:
+        logger.warning("⚠️ Inventory sweeper disabled: no Telegram API credentials")
+        return
+    
+    while True:
+        if not leases.is_leader(LEASE_NAME):
+            await asyncio.sleep(leases.RENEW_INTERVAL)
+            continue
+        try:
+            await sweep(bot)
+        except Exception as e:
+            logger.error(f"❌ Inventory sweep failed: {e}")
+        await asyncio.sleep(config.INVENTORY_SWEEP_INTERVAL)
+
+@metrics.register_collector
+def _inventory_metrics():
+    return [
+        ('inventory_sweeps_total', 'counter', 'Inventory health sweeps completed',
+         [({}, stats['sweeps'])]),
+        ('inventory_flood_waits_total', 'counter', 'FloodWait / RetryAfter responses during sweeps',
+         [({}, stats['flood_waits'])]),
+        ('inventory_last_sweep_seconds', 'gauge', 'Duration of the last sweep',
+         [({}, stats['last_sweep_seconds'])]),
+        ('inventory_last_sweep_rate', 'gauge', 'Sessions checked per second in the last sweep',
+         [({}, stats['last_sweep_rate'])]),
+        ('inventory_unsold_sessions', 'gauge', 'Unsold sessions after the last sweep',
+         [({}, stats['unsold'])]),
+        ('inventory_due_sessions', 'gauge', 'Unsold sessions due a check at the start of the last sweep',
+         [({}, stats['due'])]),
+        ('inventory_quarantined_sessions', 'gauge', 'Sessions in quarantine after the last sweep',
+         [({}, stats['quarantined'])])
+    ]
@@ -1,7 +1,6 @@
 import os
+import importlib.util
 import logging
-import zipfile
-import io
 import asyncio
 import random
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -13,64 +12,28 @@ from telegram.ext import (
     ContextTypes,
     CallbackQueryHandler
 )
-from telethon import TelegramClient
-from telethon.sessions import StringSession
-from telethon.tl.functions.users import GetFullUserRequest
 import config
 import time
+import uuid
 from datetime import datetime
-from database import get_db, TelegramSession
+from database import get_db, TelegramSession, SessionFingerprint
+from spambot_probe import check_account_with_spambot
+from ingestion import ingest_upload
+from session_loader import read_session, to_string_session
 from bson.objectid import ObjectId
 
-# OpenTele imports for manual upload
-try:
-    from opentele.api import UseCurrentSession, API
-    from opentele.td import TDesktop
-    OPENTELE_AVAILABLE = True
-    AVAILABLE_APIS = [
-        API.TelegramAndroid,
-        API.TelegramIOS,
-    ]
-except ImportError:
-    OPENTELE_AVAILABLE = False
+# OpenTele (manual upload) is imported on first use; only check it is installed
+OPENTELE_AVAILABLE = importlib.util.find_spec('opentele') is not None
+if not OPENTELE_AVAILABLE:
     logger = logging.getLogger(__name__)
     logger.warning("⚠️ OpenTele not installed. Manual uploads will NOT work safely.")
 
 logger = logging.getLogger(__name__)
+
+# Manual number uploads log in with file-backed Telethon sessions
 TEMP_DIR = "/tmp"
 os.makedirs(TEMP_DIR, exist_ok=True)
 
-# ============================================
-# MULTIPLE API CREDENTIALS FOR PARALLEL PROCESSING
-# ============================================
-
-# Load all available API credentials
-API_CREDENTIALS = []
-
-# Main API (from .env)
-if config.TELEGRAM_API_ID and config.TELEGRAM_API_HASH:
-    API_CREDENTIALS.append({
-        'api_id': config.TELEGRAM_API_ID,
-        'api_hash': config.TELEGRAM_API_HASH,
-        'name': 'Main API'
-    })
-
-# Additional APIs (from environment variables)
-for i in range(2, 5):  # API 2, 3, 4
-    api_id = os.getenv(f'API_ID_{i}')
-    api_hash = os.getenv(f'API_HASH_{i}')
-    if api_id and api_hash:
-        try:
-            API_CREDENTIALS.append({
-                'api_id': int(api_id),
-                'api_hash': api_hash,
-                'name': f'API {i}'
-            })
-        except:
-            logger.error(f"Invalid API_ID_{i}")
-
-logger.info(f"✅ Loaded {len(API_CREDENTIALS)} API credentials for parallel processing")
-
 # ============================================
 # LEADERS LIST - ADD TELEGRAM IDs HERE
 # ============================================
@@ -84,138 +47,6 @@ LEADERS = [
     # 987654321,
 ]
 
-async def check_account_with_spambot(client, phone: str) -> dict:
-    """Check account status using @SpamBot"""
-    try:
-        logger.info(f"🔍 Checking account status for {phone}...")
-        
-        # Start conversation with SpamBot
-        spambot = await client.get_entity('SpamBot')
-        
-        # Send /start command
-        await client.send_message(spambot, '/start')
-        
-        # Wait for response
-        await asyncio.sleep(5)
-        
-        # Get messages from SpamBot
-        messages = await client.get_messages(spambot, limit=5)
-        
-        # Check messages for status indicators
-        for msg in messages:
-            if not msg.text:
-                continue
-            
-            text = msg.text.lower()
-            
-            # Check for frozen/blocked
-            if "account was blocked for violations" in text or "your account has been blocked" in text:
-                return {
-                    'status': 'Frozen',
-                    'message': '🔴 Account is BLOCKED',
-                    'success': True
-                }
-            
-            # Check for spam restrictions
-            if ("while the account is limited" in text or 
-                "some actions can trigger a harsh response" in text or 
-                "unfortunately, some phone numbers may trigger a harsh response" in text):
-                return {
-                    'status': 'Spam',
-                    'message': '🟡 Account has SPAM limitations',
-                    'success': True
-                }
-            
-            # Check for clean account
-            if "no limits are currently applied" in text or "free as a bird" in text:
-                return {
-                    'status': 'Free',
-                    'message': '🟢 Account is CLEAN',
-                    'success': True
-                }
-        
-        return {
-            'status': 'Unknown',
-            'message': '❓ Status unclear',
-            'success': False
-        }
-        
-    except Exception as e:
-        logger.error(f"SpamBot check error: {e}")
-        return {
-            'status': 'Error',
-            'message': f'❌ Error: {str(e)}',
-            'success': False
-        }
-
-async def extract_session_info(client) -> str:
-    """
-    Extract detailed info from session
-    Returns formatted string with account details
-    """
-    try:
-        info_parts = []
-        
-        # Get user info
-        me = await client.get_me()
-        
-        # 1. Premium status
-        if hasattr(me, 'premium') and me.premium:
-            info_parts.append("Premium")
-        
-        # 2. Verified status
-        if hasattr(me, 'verified') and me.verified:
-            info_parts.append("Verified")
-        
-        # 3. Username
-        if me.username:
-            info_parts.append(f"@{me.username}")
-        
-        # 4. Get account creation date (approximate via user ID)
-        # Lower user ID = older account
-        user_id = me.id
-        if user_id < 1000000:
-            info_parts.append("Very old account")
-        elif user_id < 100000000:
-            info_parts.append("Old account (5+ years)")
-        elif user_id < 500000000:
-            info_parts.append("3+ years old")
-        elif user_id < 1000000000:
-            info_parts.append("2+ years old")
-        elif user_id < 2000000000:
-            info_parts.append("1+ year old")
-        else:
-            info_parts.append("New account")
-        
-        # 5. Get datacenter info
-        try:
-            full_user = await client(GetFullUserRequest(me.id))
-            if hasattr(full_user, 'profile_photo') and full_user.profile_photo:
-                # DC from profile photo
-                if hasattr(full_user.profile_photo, 'dc_id'):
-                    dc_id = full_user.profile_photo.dc_id
-                    info_parts.append(f"DC{dc_id}")
-        except Exception as e:
-            logger.debug(f"Could not get DC info: {e}")
-        
-        # 6. Profile photo status
-        if me.photo:
-            info_parts.append("Has photo")
-        
-        # 7. Bot status
-        if me.bot:
-            info_parts.append("Bot account")
-        
-        # Combine all info
-        if info_parts:
-            return " • ".join(info_parts[:4])  # Limit to 4 items max
-        else:
-            return None
-            
-    except Exception as e:
-        logger.error(f"Error extracting session info: {e}")
-        return None
-
 async def leader_delete_session_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Leader starts session deletion - shows only THEIR AVAILABLE sessions with pagination"""
     query = update.callback_query
@@ -436,6 +267,7 @@ async def leader_execute_delete_session(update: Update, context: ContextTypes.DE
         })
         
         if result.deleted_count > 0:
+            SessionFingerprint.release_phone(phone)
             # ✅ FIXED: Return to delete list instead of just showing success
             keyboard = [[InlineKeyboardButton("« Back to Delete List", callback_data='leader_delete_sessions')]]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -474,29 +306,6 @@ async def leader_execute_delete_session(update: Update, context: ContextTypes.DE
         traceback.print_exc()
         await query.edit_message_text(f"❌ Error: {str(e)}")
 
-def get_temp_path(filename):
-    """Get safe path in /tmp directory"""
-    safe_filename = os.path.basename(filename)
-    return os.path.join(TEMP_DIR, safe_filename)
-
-def cleanup_temp_files(file_path, session_name):
-    """Clean up ALL temporary session files"""
-    cleanup_paths = [
-        file_path,
-        f"{session_name}.session",
-        session_name,
-        f"{session_name}.session-journal",
-        f"{file_path}.session-journal"
-    ]
-    
-    for path in cleanup_paths:
-        try:
-            if os.path.exists(path):
-                os.remove(path)
-                logger.debug(f"🧹 Cleaned: {path}")
-        except Exception as e:
-            logger.debug(f"Could not remove {path}: {e}")
-
 # Conversation states
 (LEADER_UPLOAD_SESSION, LEADER_UPLOAD_BULK, LEADER_UPLOAD_NUMBER_COUNTRY, 
  LEADER_UPLOAD_NUMBER_PHONE, LEADER_UPLOAD_NUMBER_OTP, LEADER_UPLOAD_NUMBER_2FA,
@@ -541,21 +350,7 @@ def leader_only(func):
 
 @leader_only
 async def leader_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Leader menu - WITH BAN CHECK"""
-    user_id = update.effective_user.id
-    
-    # ✅ CHECK IF USER IS BANNED
-    from database import User
-    user = User.get_by_telegram_id(user_id)
-    if user and user.get('is_banned', False):
-        await update.message.reply_text(
-            "🚫 **Account Banned**\n\n"
-            "Your account has been banned from using this bot.\n\n"
-            "If you believe this is an error, please contact support: @Akash_support_bot",
-            parse_mode='Markdown'
-        )
-        return
-    
+    """Leader menu (banned users are rejected by access_control.access_filter)"""
     keyboard = [
         [InlineKeyboardButton("📤 Upload Session", callback_data='leader_upload')],
         [InlineKeyboardButton("📱 Upload Number", callback_data='leader_upload_number')],
@@ -575,24 +370,12 @@ async def leader_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def leader_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show leader's upload statistics - WITH BAN CHECK"""
+    """Show leader's upload statistics"""
     query = update.callback_query
     await query.answer()
     
     user_id = query.from_user.id
     
-    # ✅ CHECK IF USER IS BANNED
-    from database import User
-    user_obj = User.get_by_telegram_id(user_id)
-    if user_obj and user_obj.get('is_banned', False):
-        await query.edit_message_text(
-            "🚫 **Account Banned**\n\n"
-            "Your account has been banned from using this bot.\n\n"
-            "If you believe this is an error, please contact support: @Akash_support_bot",
-            parse_mode='Markdown'
-        )
-        return
-    
     if user_id not in LEADERS and user_id != config.OWNER_ID:
         await query.answer("❌ Unauthorized", show_alert=True)
         return
@@ -666,23 +449,36 @@ async def leader_receive_session_file(update, context):
     
     await update.message.reply_text("⏳ Processing session file...")
     
-    timestamp = int(time.time())
-    unique_name = f"upload_{user_id}_{timestamp}"
-    file_path = get_temp_path(f"{unique_name}.session")
-    
     client = None
     try:
-        # Download file
+        # Download file (kept in memory)
         new_file = await context.bot.get_file(file.file_id)
-        await new_file.download_to_drive(file_path)
-        logger.info(f"✅ Downloaded to {file_path}")
+        session_bytes = bytes(await new_file.download_as_bytearray())
         
-        # Verify session
-        abs_file_path = os.path.abspath(file_path)
-        abs_session_name = abs_file_path.replace('.session', '')
+        session_file = read_session(session_bytes)
+        if session_file is None:
+            await update.message.reply_text(
+                "❌ Invalid session file!\n\n"
+                "Please upload a Telethon .session file."
+            )
+            return LEADER_UPLOAD_SESSION
+        
+        # Reject exact duplicates before connecting
+        upload_id = context.user_data.setdefault('upload_id', uuid.uuid4().hex)
+        auth_key_hash = SessionFingerprint.hash_auth_key(session_file.auth_key)
+        duplicate = SessionFingerprint.find_duplicate(
+            auth_key_hash, SessionFingerprint.phone_from_filename(file.file_name),
+            uploader_id=user_id, upload_id=upload_id
+        )
+        if duplicate:
+            await update.message.reply_text(
+                f"♻️ Duplicate session - this account is {SessionFingerprint.describe(duplicate)}."
+            )
+            return ConversationHandler.END
         
+        from telethon import TelegramClient
         client = TelegramClient(
-            abs_session_name,
+            to_string_session(session_file),
             config.TELEGRAM_API_ID,
             config.TELEGRAM_API_HASH,
             system_version="4.16.30-vxCUSTOM",
@@ -703,16 +499,25 @@ async def leader_receive_session_file(update, context):
             )
             if client.is_connected():
                 await client.disconnect()
-            cleanup_temp_files(abs_file_path, abs_session_name)
             return ConversationHandler.END
         
         # Get user info
         me = await asyncio.wait_for(client.get_me(), timeout=10.0)
         phone = me.phone or "Unknown"
         
+        # Same account under another auth key (re-login)
+        duplicate = SessionFingerprint.claim(auth_key_hash, me.phone, me.id, uploader_id=user_id, upload_id=upload_id)
+        if duplicate:
+            await update.message.reply_text(
+                f"♻️ Duplicate session - {phone} is {SessionFingerprint.describe(duplicate)}."
+            )
+            if client.is_connected():
+                await client.disconnect()
+            return ConversationHandler.END
+        
         # ✅ NEW: CHECK WITH SPAMBOT
         logger.info(f"🔍 Checking {phone} with SpamBot...")
-        spam_check = await check_account_with_spambot(client, phone)
+        spam_check = await check_account_with_spambot(client, phone, user_id=me.id)
         
         logger.info(f"📊 SpamBot result: {spam_check['status']} - {spam_check['message']}")
         
@@ -733,18 +538,17 @@ async def leader_receive_session_file(update, context):
             
             emoji = status_emoji.get(spam_check['status'], '❓')
             
-            with open(abs_file_path, 'rb') as f:
-                channel_message = await context.bot.send_document(
-                    chat_id=config.STORAGE_CHANNEL_ID,
-                    document=f,
-                    filename=file.file_name,
-                    caption=(
-                        f"📱 Phone: {phone}\n"
-                        f"{emoji} Status: {spam_check['status']}\n"
-                        f"👨‍💼 Uploaded by: {update.effective_user.username or user_id}\n"
-                        f"⏰ {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-                    )
+            channel_message = await context.bot.send_document(
+                chat_id=config.STORAGE_CHANNEL_ID,
+                document=session_bytes,
+                filename=file.file_name,
+                caption=(
+                    f"📱 Phone: {phone}\n"
+                    f"{emoji} Status: {spam_check['status']}\n"
+                    f"👨‍💼 Uploaded by: {update.effective_user.username or user_id}\n"
+                    f"⏰ {datetime.now().strftime('%Y-%m-%d %H:%M')}"
                 )
+            )
             
             message_id = channel_message.message_id
             
@@ -754,10 +558,11 @@ async def leader_receive_session_file(update, context):
                 'message_id': message_id,
                 'phone': phone,
                 'uploader_id': user_id,
-                'spam_status': spam_check['status']  # ✅ ADD THIS
+                'spam_status': spam_check['status'],  # ✅ ADD THIS
+                'auth_key_hash': auth_key_hash,
+                'telegram_id': me.id
             }
             
-            cleanup_temp_files(abs_file_path, abs_session_name)
             
             # ✅ SHOW SPAM STATUS TO LEADER
             warning_text = ""
@@ -783,7 +588,6 @@ async def leader_receive_session_file(update, context):
                 f"❌ Error uploading to storage channel\n\n"
                 f"Contact admin for help."
             )
-            cleanup_temp_files(abs_file_path, abs_session_name)
             return ConversationHandler.END
             
     except asyncio.TimeoutError:
@@ -795,8 +599,6 @@ async def leader_receive_session_file(update, context):
         )
         if client and client.is_connected():
             await client.disconnect()
-        cleanup_temp_files(abs_file_path if 'abs_file_path' in locals() else file_path, 
-                         abs_session_name if 'abs_session_name' in locals() else file_path)
         return ConversationHandler.END
         
     except Exception as e:
@@ -808,9 +610,6 @@ async def leader_receive_session_file(update, context):
         
         if client and client.is_connected():
             await client.disconnect()
-        
-        cleanup_temp_files(abs_file_path if 'abs_file_path' in locals() else file_path,
-                         abs_session_name if 'abs_session_name' in locals() else file_path)
         return ConversationHandler.END
 
 async def leader_bulk_upload_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -845,6 +644,7 @@ async def leader_receive_bulk_files(update: Update, context: ContextTypes.DEFAUL
     
     if 'bulk_sessions' not in context.user_data:
         context.user_data['bulk_sessions'] = []
+    upload_id = context.user_data.setdefault('upload_id', uuid.uuid4().hex)
     
     # Handle /done command
     if update.message.text:
@@ -887,194 +687,10 @@ async def leader_receive_bulk_files(update: Update, context: ContextTypes.DEFAUL
     
     try:
         new_file = await context.bot.get_file(file.file_id)
-        
-        if file_name.endswith('.zip'):
-            # Handle ZIP file
-            zip_bytes = await new_file.download_as_bytearray()
-            zip_file = zipfile.ZipFile(io.BytesIO(zip_bytes))
-            
-            processed = 0
-            failed = 0
-            failed_files = []
-            
-            # ✅ Track spam status
-            spam_stats = {
-                'Free': 0,
-                'Spam': 0,
-                'Frozen': 0,
-                'Unknown': 0,
-                'Error': 0
-            }
-            
-            session_files = [f for f in zip_file.namelist() if f.endswith('.session')]
-            total_files = len(session_files)
-            
-            if total_files == 0:
-                await status_msg.edit_text("❌ No .session files found in ZIP!")
-                return LEADER_UPLOAD_BULK
-            
-            await status_msg.edit_text(
-                f"📦 Processing ZIP: {total_files} session files found...\n"
-                f"⏳ This may take a while (~5 sec per session)\n\n"
-                f"Progress will be shown below..."
-            )
-            
-            for idx, zip_info in enumerate(session_files, 1):
-                try:
-                    session_bytes = zip_file.read(zip_info)
-                    temp_path = get_temp_path(f"bulk_{idx}_{os.path.basename(zip_info)}")
-                    
-                    with open(temp_path, 'wb') as f:
-                        f.write(session_bytes)
-                    
-                    # ✅ Send individual status message
-                    processing_msg = await context.bot.send_message(
-                        user_id,
-                        f"⏳ Processing {idx}/{total_files}: Checking session..."
-                    )
-                    
-                    result = await process_single_session_bulk(temp_path, user_id, context.bot)
-                    
-                    if result:
-                        context.user_data['bulk_sessions'].append(result)
-                        processed += 1
-                        
-                        # Get spam status
-                        spam_status = result.get('spam_status', 'Unknown')
-                        phone = result.get('phone', 'Unknown')
-                        
-                        # Count spam status
-                        if spam_status in spam_stats:
-                            spam_stats[spam_status] += 1
-                        
-                        # ✅ REAL-TIME STATUS MESSAGE
-                        status_emoji_map = {
-                            'Free': '🟢 CLEAN',
-                            'Frozen': '🔴 FROZEN',
-                            'Spam': '🟡 SPAM LIMITED',
-                            'Unknown': '❓ UNKNOWN',
-                            'Error': '❌ CHECK ERROR'
-                        }
-                        
-                        status_text = status_emoji_map.get(spam_status, f'❓ {spam_status}')
-                        
-                        await processing_msg.edit_text(
-                            f"✅ {idx}/{total_files} Processed\n\n"
-                            f"📱 Phone: {phone}\n"
-                            f"🔍 Status: {status_text}\n\n"
-                            f"Progress: {processed} success, {failed} failed"
-                        )
-                        
-                        logger.info(f"✅ {idx}/{total_files}: {phone} ({spam_status})")
-                    else:
-                        failed += 1
-                        failed_files.append(os.path.basename(zip_info))
-                        
-                        await processing_msg.edit_text(
-                            f"❌ {idx}/{total_files} Failed\n\n"
-                            f"File: {os.path.basename(zip_info)}\n"
-                            f"Reason: Invalid or expired session\n\n"
-                            f"Progress: {processed} success, {failed} failed"
-                        )
-                        
-                        logger.warning(f"❌ Failed {idx}/{total_files}: {os.path.basename(zip_info)}")
-                    
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
-                    
-                    await asyncio.sleep(0.3)
-                    
-                except Exception as e:
-                    logger.error(f"Error processing {zip_info}: {e}")
-                    failed += 1
-                    failed_files.append(os.path.basename(zip_info))
-                    continue
-            
-            # ✅ Final summary with spam stats
-            summary = (
-                f"✅ **ZIP Processing Complete!**\n\n"
-                f"📊 **Results:**\n"
-                f"✅ Successful: {processed}/{total_files}\n"
-                f"❌ Failed: {failed}/{total_files}\n\n"
-            )
-            
-            # Add spam statistics
-            if processed > 0:
-                summary += "🔍 **Account Status:**\n"
-                if spam_stats['Free'] > 0:
-                    summary += f"  🟢 Clean: {spam_stats['Free']}\n"
-                if spam_stats['Spam'] > 0:
-                    summary += f"  🟡 Spam Limited: {spam_stats['Spam']}\n"
-                if spam_stats['Frozen'] > 0:
-                    summary += f"  🔴 Frozen: {spam_stats['Frozen']}\n"
-                if spam_stats['Unknown'] > 0:
-                    summary += f"  ❓ Unknown: {spam_stats['Unknown']}\n"
-                if spam_stats['Error'] > 0:
-                    summary += f"  ❌ Check Error: {spam_stats['Error']}\n"
-                summary += "\n"
-            
-            if failed > 0 and len(failed_files) <= 10:
-                summary += "Failed files:\n"
-                for f in failed_files[:10]:
-                    summary += f"• {f}\n"
-                if len(failed_files) > 10:
-                    summary += f"... and {len(failed_files) - 10} more\n"
-                summary += "\n"
-            
-            summary += (
-                f"Total loaded: {len(context.user_data['bulk_sessions'])} sessions\n\n"
-                f"✅ Type /done when finished uploading."
-            )
-            
-            await status_msg.edit_text(summary, parse_mode='Markdown')
-        
-        elif file_name.endswith('.session'):
-            # Handle single .session file
-            temp_path = get_temp_path(f"single_{int(time.time())}_{file_name}")
-            await new_file.download_to_drive(temp_path)
-            
-            await status_msg.edit_text(f"⏳ Checking {file_name}...")
-            
-            result = await process_single_session_bulk(temp_path, user_id, context.bot)
-            
-            if result:
-                context.user_data['bulk_sessions'].append(result)
-                
-                spam_status = result.get('spam_status', 'Unknown')
-                phone = result.get('phone', 'Unknown')
-                
-                status_emoji_map = {
-                    'Free': '🟢 CLEAN',
-                    'Frozen': '🔴 FROZEN',
-                    'Spam': '🟡 SPAM LIMITED',
-                    'Unknown': '❓ UNKNOWN',
-                    'Error': '❌ CHECK ERROR'
-                }
-                
-                status_text = status_emoji_map.get(spam_status, f'❓ {spam_status}')
-                
-                await status_msg.edit_text(
-                    f"✅ **Session Added**\n\n"
-                    f"📱 Phone: {phone}\n"
-                    f"🔍 Status: {status_text}\n\n"
-                    f"Total: {len(context.user_data['bulk_sessions'])} sessions\n\n"
-                    f"📤 Send more files or type /done to continue.",
-                    parse_mode='Markdown'
-                )
-            else:
-                await status_msg.edit_text(
-                    f"❌ **Failed to process** {file_name}\n\n"
-                    f"Total loaded: {len(context.user_data.get('bulk_sessions', []))} sessions\n\n"
-                    f"📤 Send more files or type /done to continue.",
-                    parse_mode='Markdown'
-                )
-            
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-        
-        else:
-            await status_msg.edit_text("❌ File must be .session or .zip!")
-        
+        await ingest_upload(
+            context.bot, user_id, status_msg, file_name, new_file,
+            user_id, upload_id, context.user_data['bulk_sessions']
+        )
         return LEADER_UPLOAD_BULK
         
     except Exception as e:
@@ -1084,112 +700,6 @@ async def leader_receive_bulk_files(update: Update, context: ContextTypes.DEFAUL
         await status_msg.edit_text(f"❌ Error processing file: {str(e)}")
         return LEADER_UPLOAD_BULK
 
-async def process_single_session_bulk(file_path, user_id, bot):
-    """Process session for bulk upload - WITH AUTO INFO"""
-    session_name = file_path.replace('.session', '')
-    client = None
-    
-    try:
-        from telethon.tl.functions.users import GetFullUserRequest
-        
-        logger.info(f"📦 Processing: {file_path}")
-        
-        if not os.path.exists(file_path):
-            logger.error(f"❌ File not found: {file_path}")
-            return None
-        
-        abs_file_path = os.path.abspath(file_path)
-        abs_session_name = abs_file_path.replace('.session', '')
-        
-        client = TelegramClient(
-            abs_session_name,
-            config.TELEGRAM_API_ID,
-            config.TELEGRAM_API_HASH,
-            system_version="4.16.30-vxCUSTOM",
-            connection_retries=3,
-            retry_delay=2,
-            timeout=10
-        )
-        
-        await asyncio.wait_for(client.connect(), timeout=15.0)
-        
-        is_authorized = await asyncio.wait_for(
-            client.is_user_authorized(), 
-            timeout=10.0
-        )
-        
-        if not is_authorized:
-            logger.warning(f"❌ Not authorized: {file_path}")
-            if client.is_connected():
-                await client.disconnect()
-            cleanup_temp_files(abs_file_path, abs_session_name)
-            return None
-        
-        me = await asyncio.wait_for(client.get_me(), timeout=10.0)
-        phone = me.phone or "Unknown"
-        
-        # ✅ AUTO-EXTRACT INFO
-        auto_info = await extract_session_info(client)
-        
-        # ✅ CHECK SPAMBOT
-        spam_check = await check_account_with_spambot(client, phone)
-        
-        if client.is_connected():
-            await client.disconnect()
-        
-        # Upload to channel
-        status_emoji = {
-            'Free': '🟢',
-            'Frozen': '🔴',
-            'Spam': '🟡',
-            'Unknown': '❓',
-            'Error': '❌'
-        }
-        
-        emoji = status_emoji.get(spam_check['status'], '❓')
-        
-        caption_parts = [
-            f"📱 Phone: {phone}",
-            f"{emoji} Status: {spam_check['status']}"
-        ]
-        
-        if auto_info:
-            caption_parts.append(f"ℹ️ {auto_info}")
-        
-        caption_parts.append(f"⏰ {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-        
-        with open(abs_file_path, 'rb') as f:
-            channel_message = await bot.send_document(
-                chat_id=config.STORAGE_CHANNEL_ID,
-                document=f,
-                filename=os.path.basename(abs_file_path),
-                caption="\n".join(caption_parts)
-            )
-        
-        message_id = channel_message.message_id
-        
-        cleanup_temp_files(abs_file_path, abs_session_name)
-        
-        logger.info(f"✅ Processed: {phone} ({spam_check['status']})")
-        
-        return {
-            'message_id': message_id,
-            'phone': phone,
-            'spam_status': spam_check['status'],
-            'auto_info': auto_info  # ✅ RETURN AUTO INFO
-        }
-        
-    except Exception as e:
-        logger.error(f"❌ Error: {file_path} - {e}")
-        if client and client.is_connected():
-            try:
-                await asyncio.wait_for(client.disconnect(), timeout=5.0)
-            except:
-                pass
-        cleanup_temp_files(abs_file_path if 'abs_file_path' in locals() else file_path,
-                         abs_session_name if 'abs_session_name' in locals() else session_name)
-        return None
-
 async def leader_receive_country(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Receive country name"""
     user_id = update.effective_user.id
@@ -1368,31 +878,14 @@ async def confirm_session_upload(update, context):
         # Bulk upload
         if 'bulk_sessions' in context.user_data:
             sessions = context.user_data['bulk_sessions']
-            added_count = 0
-            failed_count = 0
             
             await query.edit_message_text(f"⏳ Adding {len(sessions)} sessions...")
             
-            for session_data in sessions:
-                try:
-                    TelegramSession.create(
-                        session_string=str(session_data['message_id']),
-                        phone_number=session_data['phone'],
-                        country=session_data['country'],
-                        has_2fa=session_data['has_2fa'],
-                        two_fa_password=session_data.get('two_fa_password'),
-                        price=session_data['price'],
-                        info=session_data.get('info'),
-                        spam_status=session_data.get('spam_status', 'Unknown'),
-                        uploader_id=query.from_user.id  # ✅ CRITICAL FIX
-                    )
-                    
-                    added_count += 1
-                    
-                except Exception as e:
-                    logger.error(f"❌ Error adding session: {e}")
-                    failed_count += 1
-                    continue
+            result = TelegramSession.create_many(sessions, uploader_id=query.from_user.id)  # ✅ CRITICAL FIX
+            added_count = len(result['inserted_ids'])
+            failed_count = len(result['failed'])
+            for session_data, reason in result['failed']:
+                logger.error(f"❌ Error adding session {session_data.get('phone')}: {reason}")
             
             result_msg = f"✅ Bulk Upload Complete!\n\n"
             result_msg += f"📦 Added: {added_count}/{len(sessions)} sessions\n"
@@ -1516,6 +1009,9 @@ async def leader_confirm_session_upload(update: Update, context: ContextTypes.DE
         return ConversationHandler.END
     
     if query.data == 'leader_upload_confirm_no':
+        SessionFingerprint.release(
+            context.user_data.get('bulk_sessions') or [context.user_data.get('session_data') or {}]
+        )
         context.user_data.clear()
         await query.edit_message_text("❌ Cancelled")
         return ConversationHandler.END
@@ -1529,6 +1025,7 @@ async def leader_confirm_session_upload(update: Update, context: ContextTypes.DE
             
             # ✅ FILTER SPAM SESSIONS
             clean_sessions, removed_count, removed_details = filter_spam_sessions(original_sessions)
+            SessionFingerprint.release([s for s in original_sessions if s not in clean_sessions])
             
             # Show filtering results if any removed
             if removed_count > 0:
@@ -1568,6 +1065,7 @@ async def leader_confirm_session_upload(update: Update, context: ContextTypes.DE
             }
             result = database.pending_uploads.insert_one(pending_data)
             pending_id = result.inserted_id
+            SessionFingerprint.mark_pending(sessions)
             
             # Send to admin for approval
             try:
@@ -1630,6 +1128,7 @@ async def leader_confirm_session_upload(update: Update, context: ContextTypes.DE
             # Check spam status for single upload too
             spam_status = session_data.get('spam_status', 'Unknown')
             if spam_status in ['Spam', 'Frozen']:
+                SessionFingerprint.release([session_data])
                 await query.edit_message_text(
                     f"❌ Cannot upload this session!\n\n"
                     f"📊 Status: {spam_status}\n\n"
@@ -1650,6 +1149,7 @@ async def leader_confirm_session_upload(update: Update, context: ContextTypes.DE
             }
             result = database.pending_uploads.insert_one(pending_data)
             pending_id = result.inserted_id
+            SessionFingerprint.mark_pending([session_data])
             
             # Send to admin for approval
             try:
@@ -1695,57 +1195,6 @@ async def leader_confirm_session_upload(update: Update, context: ContextTypes.DE
     
     return ConversationHandler.END
 
-async def process_bulk_session_parallel(session_file_data, api_creds, bot):
-    """
-    Process a single session file with given API credentials
-    Returns: success, session_data or None
-    """
-    try:
-        # Extract session data
-        file_path = session_file_data['file_path']
-        phone = session_file_data['phone']
-        
-        # Create client
-        client = TelegramClient(
-            file_path.replace('.session', ''),
-            api_creds['api_id'],
-            api_creds['api_hash']
-        )
-        
-        await client.connect()
-        
-        if not await client.is_user_authorized():
-            await client.disconnect()
-            return False, None
-        
-        # Get spam status
-        spam_check = await check_account_with_spambot(client, phone)
-        
-        # Extract info
-        auto_info = await extract_session_info(client)
-        
-        await client.disconnect()
-        
-        # Upload to storage channel
-        with open(file_path, 'rb') as f:
-            channel_message = await bot.send_document(
-                chat_id=config.STORAGE_CHANNEL_ID,
-                document=f,
-                filename=os.path.basename(file_path),
-                caption=f"📱 {phone}\n🔍 {spam_check['status']}\n⏰ {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-            )
-        
-        return True, {
-            'message_id': channel_message.message_id,
-            'phone': phone,
-            'spam_status': spam_check['status'],
-            'info': auto_info
-        }
-        
-    except Exception as e:
-        logger.error(f"Error processing {session_file_data.get('phone')}: {e}")
-        return False, None
-
 async def admin_approve_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin approves leader's upload - adds sessions to database"""
     query = update.callback_query
@@ -1773,46 +1222,32 @@ async def admin_approve_upload(update: Update, context: ContextTypes.DEFAULT_TYP
         # Add all sessions to database
         sessions = pending['sessions']
         uploader_id = pending['uploader_id']
-        added_count = 0
-        failed_count = 0
         
-        for session_data in sessions:
-            try:
-                TelegramSession.create(
-                    session_string=str(session_data['message_id']),
-                    phone_number=session_data['phone'],
-                    country=session_data['country'],
-                    has_2fa=session_data['has_2fa'],
-                    two_fa_password=session_data.get('two_fa_password'),
-                    price=session_data['price'],
-                    info=session_data.get('info'),
-                    spam_status=session_data.get('spam_status', 'Unknown'),
-                    uploader_id=uploader_id
-                )
-                added_count += 1
-            except Exception as e:
-                logger.error(f"Error adding session: {e}")
-                failed_count += 1
-                continue
-        
-        # Update pending status
-        database.pending_uploads.update_one(
-            {"_id": ObjectId(pending_id)},
-            {"$set": {
-                "status": "approved",
-                "approved_at": datetime.utcnow(),
-                "approved_by": query.from_user.id,
-                "added_count": added_count,
-                "failed_count": failed_count
-            }}
+        # Known duplicates (already listed, or in the store from before fingerprinting)
+        listable = SessionFingerprint.mark_listed_many(sessions, uploader_id)
+        duplicate_count = len(sessions) - len(listable)
+                
+        # Inserts and marks the upload approved together
+        result = TelegramSession.create_many(
+            listable, uploader_id=uploader_id, pending_id=pending['_id'],
+            approved_by=query.from_user.id, duplicate_count=duplicate_count
         )
+        if result is None:
+            await query.edit_message_text("❌ Already processed")
+            return
+        
+        added_count = len(result['inserted_ids'])
+        failed_count = len(result['failed'])
+        for session_data, reason in result['failed']:
+            logger.error(f"Error adding session {session_data.get('phone')}: {reason}")
         
         # Notify admin
         await query.edit_message_text(
             f"✅ Upload Approved!\n\n"
             f"👨‍💼 Leader ID: {uploader_id}\n"
             f"📦 Added: {added_count}/{len(sessions)} sessions\n"
-            f"❌ Failed: {failed_count}\n\n"
+            f"❌ Failed: {failed_count}\n"
+            f"♻️ Duplicates skipped: {duplicate_count}\n\n"
             "Sessions are now live in the store!"
         )
         
@@ -1865,6 +1300,7 @@ async def admin_reject_upload(update: Update, context: ContextTypes.DEFAULT_TYPE
                 "rejected_by": query.from_user.id
             }}
         )
+        SessionFingerprint.release(pending['sessions'])
         
         uploader_id = pending['uploader_id']
         session_count = len(pending['sessions'])
@@ -1954,6 +1390,15 @@ async def leader_upload_number_receive_phone(update: Update, context: ContextTyp
         await update.message.reply_text("❌ Invalid phone format!\n\nExample: +918012345678")
         return LEADER_UPLOAD_NUMBER_PHONE
     
+    # Don't request an OTP for an account that is already registered
+    duplicate = SessionFingerprint.find_duplicate(phone=phone, uploader_id=user_id)
+    if duplicate:
+        await update.message.reply_text(
+            f"♻️ {phone} is {SessionFingerprint.describe(duplicate)}.\n\n"
+            "Send a different number or /cancel."
+        )
+        return LEADER_UPLOAD_NUMBER_PHONE
+    
     context.user_data['manual_phone'] = phone
     
     if not OPENTELE_AVAILABLE:
@@ -2358,6 +1803,17 @@ async def leader_upload_number_confirm(update: Update, context: ContextTypes.DEF
             session_file_path = found_session_file
             logger.info(f"✅ Using session file: {session_file_path}")
             
+            auth_key_hash = SessionFingerprint.auth_key_hash_from_file(session_file_path)
+            duplicate = SessionFingerprint.claim(
+                auth_key_hash, phone, uploader_id=user_id, upload_id=uuid.uuid4().hex
+            )
+            if duplicate:
+                await query.edit_message_text(
+                    f"♻️ Duplicate - {phone} is {SessionFingerprint.describe(duplicate)}."
+                )
+                context.user_data.clear()
+                return ConversationHandler.END
+            
             await query.edit_message_text("🔍 Checking spam status...")
             
             # Check spam status using your API credentials
@@ -2375,6 +1831,7 @@ async def leader_upload_number_confirm(update: Update, context: ContextTypes.DEF
                 shutil.copy2(session_file_path, spam_session_file)
                 logger.info(f"📋 Copied session to: {spam_session_file}")
                 
+                from telethon import TelegramClient
                 spam_client = TelegramClient(
                     spam_session_path,
                     config.TELEGRAM_API_ID,
@@ -2472,7 +1929,8 @@ async def leader_upload_number_confirm(update: Update, context: ContextTypes.DEF
             'two_fa_password': two_fa,
             'price': price,
             'info': info,
-            'spam_status': spam_check['status']
+            'spam_status': spam_check['status'],
+            'auth_key_hash': auth_key_hash
         }
         
         pending_data = {
@@ -2486,6 +1944,7 @@ async def leader_upload_number_confirm(update: Update, context: ContextTypes.DEF
         
         result = database.pending_uploads.insert_one(pending_data)
         pending_id = result.inserted_id
+        SessionFingerprint.mark_pending([session_data])
         
         # Send to admin for approval
         keyboard = [
@@ -2565,7 +2024,9 @@ def setup_leader_handlers(application):
             LEADER_CONFIRM_DETAILS: [CallbackQueryHandler(leader_confirm_session_upload, pattern='^leader_upload_confirm_')]
         },
         fallbacks=[CommandHandler('cancel', leader_cancel_operation)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="leader_session_upload",
+        persistent=config.PERSISTENCE_ENABLED
     )
     application.add_handler(session_conv)
     
@@ -2585,7 +2046,9 @@ def setup_leader_handlers(application):
             LEADER_CONFIRM_DETAILS: [CallbackQueryHandler(leader_confirm_session_upload, pattern='^leader_upload_confirm_')]
         },
         fallbacks=[CommandHandler('cancel', leader_cancel_operation)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="leader_bulk_upload",
+        persistent=config.PERSISTENCE_ENABLED
     )
     application.add_handler(bulk_conv)
     
@@ -2602,7 +2065,9 @@ def setup_leader_handlers(application):
             LEADER_UPLOAD_NUMBER_CONFIRM: [CallbackQueryHandler(leader_upload_number_confirm, pattern='^leader_upload_number_confirm$')]
         },
         fallbacks=[CommandHandler('cancel', leader_cancel_operation)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="leader_number_upload",
+        persistent=config.PERSISTENCE_ENABLED
     )
     application.add_handler(upload_number_conv)
     
@@ -0,0 +1,241 @@
+"""
+Leases - MongoDB-backed leader election for background jobs
+Each registered job runs on exactly one replica at a time; high-volume work
+is split into hash shards that the live replicas divide between them
+"""
+
+import atexit
+import logging
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# A lease survives this long without renewal, so a dead holder is
+# replaced within LEASE_TTL + RENEW_INTERVAL seconds
+LEASE_TTL = 10
+RENEW_INTERVAL = 3
+
+# Stop acting as holder this long before the lease expires on the
+# server's books (slow renewals, clock skew between replicas)
+SAFETY_MARGIN = 2
+
+DEFAULT_SHARDS = 16
+
+REPLICA_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+_jobs = set()
+_sharded = {}
+
+# lease name -> local monotonic deadline while held
+_held = {}
+_lock = threading.Lock()
+_started = False
+
+stats = {'acquired': 0, 'lost': 0, 'released': 0, 'errors': 0, 'replicas': 1}
+
+# ============================================
+# REGISTRATION AND QUERIES
+# ============================================
+
+def register_job(name: str):
+    """Run `name` on one replica at a time (check with is_leader)"""
+    _jobs.add(name)
+
+def register_sharded(kind: str, shards: int = DEFAULT_SHARDS):
+    """Split `kind` into hash shards shared between replicas (check with owns)"""
+    _sharded[kind] = shards
+
+def _shard_lease(kind: str, shard: int) -> str:
+    return f"{kind}:{shard}"
+
+def shard_of(kind: str, key) -> int:
+    """Stable across processes, unlike hash()"""
+    return zlib.crc32(str(key).encode()) % _sharded[kind]
+
+def is_leader(name: str) -> bool:
+    """
+    True while this replica holds the lease
+    
+    Without start() (scripts, benchmarks, a single process) there is no
+    election and every job runs locally.
+    """
+    if not _started:
+        return True
+    deadline = _held.get(name)
+    return deadline is not None and time.monotonic() < deadline
+
+def owns(kind: str, key) -> bool:
+    """True when the shard `key` hashes to is held by this replica"""
+    return is_leader(_shard_lease(kind, shard_of(kind, key)))
+
+def owned_shards(kind: str) -> list:
+    return [shard for shard in range(_sharded[kind]) if is_leader(_shard_lease(kind, shard))]
+
+# ============================================
+# LEASE OPERATIONS
+# ============================================
+
+def _acquire(database, name: str) -> bool:
+    """Take the lease if it is free, expired or already ours"""
+    requested = time.monotonic()
+    now = datetime.utcnow()
+    try:
+        lease = database.leases.find_one_and_update(
+            {"_id": name, "$or": [{"holder": REPLICA_ID}, {"expires_at": {"$lt": now}}]},
+            {"$set": {
+                "holder": REPLICA_ID,
+                "expires_at": now + timedelta(seconds=LEASE_TTL),
+                "renewed_at": now
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Held by another replica (the upsert lost to the existing document)
+        return False
+    
+    if lease is None or lease['holder'] != REPLICA_ID:
+        return False
+    
+    with _lock:
+        if name not in _held:
+            stats['acquired'] += 1
+            logger.info(f"👑 Acquired lease {name}")
+        _held[name] = requested + LEASE_TTL - SAFETY_MARGIN
+    return True
+
+def _renew(database):
+    """Extend every held lease in one write, dropping any taken over meanwhile"""
+    with _lock:
+        names = list(_held)
+    if not names:
+        return
+    
+    requested = time.monotonic()
+    now = datetime.utcnow()
+    database.leases.update_many(
+        {"_id": {"$in": names}, "holder": REPLICA_ID},
+        {"$set": {"expires_at": now + timedelta(seconds=LEASE_TTL), "renewed_at": now}}
+    )
+    still_held = {
+        lease['_id'] for lease in database.leases.find({"_id": {"$in": names}, "holder": REPLICA_ID}, {"_id": 1})
+    }
+    
+    with _lock:
+        for name in names:
+            if name in still_held:
+                _held[name] = requested + LEASE_TTL - SAFETY_MARGIN
+            elif _held.pop(name, None) is not None:
+                stats['lost'] += 1
+                logger.warning(f"⚠️ Lost lease {name}")
+
+def _release(database, name: str):
+    with _lock:
+        _held.pop(name, None)
+    database.leases.delete_one({"_id": name, "holder": REPLICA_ID})
+    stats['released'] += 1
+    logger.info(f"👋 Released lease {name}")
+
+def _live_replicas(database) -> int:
+    """Heartbeat this replica and count the ones seen within LEASE_TTL"""
+    now = datetime.utcnow()
+    database.lease_replicas.update_one(
+        {"_id": REPLICA_ID},
+        {"$set": {"seen_at": now, "expires_at": now + timedelta(seconds=LEASE_TTL)}},
+        upsert=True
+    )
+    return max(1, database.lease_replicas.count_documents({"expires_at": {"$gt": now}}))
+
+def _balance_shards(database, kind: str, replicas: int):
+    """Hold ceil(shards / replicas) shards: give back surplus, pick up free ones"""
+    shards = _sharded[kind]
+    target = math.ceil(shards / replicas)
+    held = owned_shards(kind)
+    
+    for shard in held[target:]:
+        _release(database, _shard_lease(kind, shard))
+    
+    # Start at a per-replica offset so replicas don't all race for shard 0
+    offset = zlib.crc32(REPLICA_ID.encode()) % shards
+    for step in range(shards):
+        if len(held) >= target:
+            break
+        shard = (offset + step) % shards
+        if shard not in held and _acquire(database, _shard_lease(kind, shard)):
+            held.append(shard)
+
+# ============================================
+# ELECTION LOOP
+# ============================================
+
+def _tick():
+    from database import get_db
+    database = get_db()
+    
+    _renew(database)
+    stats['replicas'] = _live_replicas(database)
+    
+    for name in _jobs:
+        if not is_leader(name):
+            _acquire(database, name)
+    for kind in _sharded:
+        _balance_shards(database, kind, stats['replicas'])
+
+def _election_loop():
+    while True:
+        try:
+            _tick()
+        except Exception as e:
+            stats['errors'] += 1
+            logger.error(f"❌ Lease renewal error: {e}")
+        time.sleep(RENEW_INTERVAL)
+
+def release_all():
+    """Hand every lease back so other replicas take over without waiting for expiry"""
+    from database import get_db
+    try:
+        database = get_db()
+        for name in list(_held):
+            _release(database, name)
+        database.lease_replicas.delete_one({"_id": REPLICA_ID})
+    except Exception as e:
+        logger.warning(f"⚠️ Could not release leases: {e}")
+
+def start():
+    """Start electing leaders for registered jobs and shards in a background thread"""
+    global _started
+    if _started:
+        return
+    _started = True
+    
+    t = threading.Thread(target=_election_loop, name="lease-election")
+    t.daemon = True
+    t.start()
+    atexit.register(release_all)
+    logger.info(f"✅ Lease election started as {REPLICA_ID} ({len(_jobs)} jobs, {len(_sharded)} sharded)")
+
+@metrics.register_collector
+def _lease_metrics():
+    held = [name for name in list(_held) if is_leader(name)]
+    return [
+        ('lease_held', 'gauge', 'Leases currently held by this replica',
+         [({}, len(held))]),
+        ('lease_live_replicas', 'gauge', 'Replicas with a recent lease heartbeat',
+         [({}, stats['replicas'])]),
+        ('lease_acquired_total', 'counter', 'Leases acquired by this replica',
+         [({}, stats['acquired'])]),
+        ('lease_lost_total', 'counter', 'Leases taken over by another replica',
+         [({}, stats['lost'])]),
+        ('lease_errors_total', 'counter', 'Lease election rounds that failed',
+         [({}, stats['errors'])])
+    ]
@@ -0,0 +1,238 @@
+"""
+Ledger Reconciler - Verifies users.balance against the balance ledger
+Runs incrementally from the last checkpoint and snapshots verified balances
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+import leases
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_INTERVAL = 600
+
+# Only one replica reconciles at a time
+LEASE_NAME = 'ledger_reconciler'
+leases.register_job(LEASE_NAME)
+
+# Re-scan this far behind the checkpoint so writes that were in flight
+# during the previous run are picked up (re-checking a user is harmless)
+CHECKPOINT_OVERLAP = timedelta(minutes=15)
+
+# Pending entries older than this were left behind by a crashed write
+STALE_PENDING_AFTER = timedelta(minutes=10)
+
+BALANCE_TOLERANCE = 1e-6
+MAX_REPORTED_DRIFT = 100
+
+stats = {
+    'runs': 0,
+    'users_checked': 0,
+    'drift': 0,
+    'deferred': 0,
+    'repaired': 0,
+    'last_run_seconds': 0.0
+}
+
+_started = False
+
+# ============================================
+# PER-USER VERIFICATION
+# ============================================
+
+def _starting_point(database, user_id):
+    """(seq, balance) of the last verified snapshot, or the opening balance"""
+    snapshot = database.balance_snapshots.find_one({"user_id": user_id})
+    if snapshot:
+        return snapshot['seq'], snapshot['balance']
+    
+    first = database.balance_ledger.find_one({"user_id": user_id, "seq": 1})
+    if first is None:
+        return None
+    # Balance carried over from before the ledger existed
+    return 0, first['balance_before']
+
+def _repair(database, user_id, missing, stale) -> bool:
+    """Resolve pending entries left behind by a crashed write"""
+    if not missing:
+        # The write never reached users.balance - drop it so its key can be retried
+        database.balance_ledger.delete_many({"_id": {"$in": [e['_id'] for e in stale]}})
+        stats['repaired'] += len(stale)
+        logger.warning(f"🧹 Dropped {len(stale)} unapplied ledger entries for user {user_id}")
+        return True
+    
+    if len(missing) != 1 or len(stale) != 1 or stale[0]['amount'] is None:
+        return False
+    
+    # users.balance moved but the entry was never marked applied
+    seq = missing[0]
+    previous = database.balance_ledger.find_one({"user_id": user_id, "seq": seq - 1})
+    if previous is None:
+        return False
+    
+    entry = stale[0]
+    database.balance_ledger.update_one(
+        {"_id": entry['_id']},
+        {"$set": {
+            "status": "applied",
+            "seq": seq,
+            "balance_before": previous['balance_after'],
+            "balance_after": previous['balance_after'] + entry['amount']
+        }}
+    )
+    stats['repaired'] += 1
+    logger.warning(f"🧹 Marked ledger entry {entry['_id']} applied as seq {seq} for user {user_id}")
+    return True
+
+def verify_user(database, user_id) -> str:
+    """
+    Check one user's balance against ledger entries since their snapshot
+    
+    Returns:
+        'ok', 'drift', or 'deferred' (a write is still in flight)
+    """
+    user = database.users.find_one({"telegram_id": user_id}, {"balance": 1, "ledger_seq": 1})
+    if user is None:
+        return 'ok'
+    
+    start = _starting_point(database, user_id)
+    if start is None:
+        return 'ok'
+    
+    snapshot_seq, balance = start
+    current_seq = user.get('ledger_seq', 0)
+    
+    def load_entries():
+        return list(database.balance_ledger.find(
+            {"user_id": user_id, "seq": {"$gt": snapshot_seq, "$lte": current_seq}}
+        ).sort("seq", 1))
+    
+    entries = load_entries()
+    found = {entry['seq'] for entry in entries}
+    missing = [seq for seq in range(snapshot_seq + 1, current_seq + 1) if seq not in found]
+    stale = list(database.balance_ledger.find({
+        "user_id": user_id,
+        "status": "pending",
+        "created_at": {"$lt": datetime.utcnow() - STALE_PENDING_AFTER}
+    }))
+    
+    if missing or stale:
+        if missing and not stale:
+            return 'deferred'
+        if not _repair(database, user_id, missing, stale):
+            logger.error(f"❌ Ledger gap for user {user_id}: missing seq {missing}, {len(stale)} stale entries")
+            return 'drift'
+        entries = load_entries()
+    
+    running = balance
+    for entry in entries:
+        if abs(entry['balance_before'] - running) > BALANCE_TOLERANCE:
+            logger.error(
+                f"❌ Ledger chain broken for user {user_id} at seq {entry['seq']}: "
+                f"expected {running}, entry says {entry['balance_before']}"
+            )
+            return 'drift'
+        running = entry['balance_after']
+    
+    if abs(running - user.get('balance', 0.0)) > BALANCE_TOLERANCE:
+        logger.error(f"❌ Balance drift for user {user_id}: ledger {running}, users.balance {user.get('balance')}")
+        return 'drift'
+    
+    if current_seq > snapshot_seq:
+        database.balance_snapshots.update_one(
+            {"user_id": user_id},
+            {"$set": {"seq": current_seq, "balance": running, "taken_at": datetime.utcnow()}},
+            upsert=True
+        )
+    return 'ok'
+
+# ============================================
+# INCREMENTAL RUN
+# ============================================
+
+def reconcile() -> dict:
+    """Verify every user with ledger activity since the last checkpoint"""
+    from database import get_db
+    database = get_db()
+    
+    started = datetime.utcnow()
+    timer = time.monotonic()
+    
+    checkpoint = database.ledger_checkpoints.find_one({"_id": "reconciler"})
+    since = checkpoint['checked_until'] - CHECKPOINT_OVERLAP if checkpoint else datetime.min
+    user_ids = database.balance_ledger.distinct("user_id", {"created_at": {"$gte": since}})
+    
+    result = {'checked': 0, 'ok': 0, 'drift': 0, 'deferred': 0, 'drifted_users': []}
+    for user_id in user_ids:
+        try:
+            outcome = verify_user(database, user_id)
+        except Exception as e:
+            logger.error(f"❌ Reconcile error for user {user_id}: {e}")
+            outcome = 'deferred'
+        
+        result['checked'] += 1
+        result[outcome] += 1
+        if outcome == 'drift' and len(result['drifted_users']) < MAX_REPORTED_DRIFT:
+            result['drifted_users'].append(user_id)
+    
+    database.ledger_checkpoints.update_one(
+        {"_id": "reconciler"},
+        {"$set": {
+            "checked_until": started,
+            "last_run": {**result, "started_at": started, "finished_at": datetime.utcnow()}
+        }},
+        upsert=True
+    )
+    
+    stats['runs'] += 1
+    stats['users_checked'] += result['checked']
+    stats['drift'] += result['drift']
+    stats['deferred'] += result['deferred']
+    stats['last_run_seconds'] = time.monotonic() - timer
+    
+    logger.info(
+        f"📒 Ledger reconciled: {result['checked']} users, {result['drift']} drift, "
+        f"{result['deferred']} deferred ({stats['last_run_seconds']:.1f}s)"
+    )
+    return result
+
+def _reconcile_loop():
+    while True:
+        if not leases.is_leader(LEASE_NAME):
+            time.sleep(leases.RENEW_INTERVAL)
+            continue
+        try:
+            reconcile()
+        except Exception as e:
+            logger.error(f"❌ Ledger reconciler error: {e}")
+        time.sleep(RECONCILE_INTERVAL)
+
+def start_reconciler():
+    """Run reconciliation every RECONCILE_INTERVAL seconds in a background thread"""
+    global _started
+    if _started:
+        return
+    _started = True
+    t = threading.Thread(target=_reconcile_loop, name="ledger-reconciler")
+    t.daemon = True
+    t.start()
+
+@metrics.register_collector
+def _ledger_metrics():
+    return [
+        ('ledger_reconcile_runs_total', 'counter', 'Balance ledger reconciliation runs',
+         [({}, stats['runs'])]),
+        ('ledger_users_checked_total', 'counter', 'Users verified against the balance ledger',
+         [({}, stats['users_checked'])]),
+        ('ledger_balance_drift_total', 'counter', 'Users whose balance did not match the ledger',
+         [({}, stats['drift'])]),
+        ('ledger_deferred_total', 'counter', 'User checks deferred because a write was in flight',
+         [({}, stats['deferred'])]),
+        ('ledger_repaired_entries_total', 'counter', 'Pending ledger entries resolved after a crash',
+         [({}, stats['repaired'])]),
+        ('ledger_reconcile_last_duration_seconds', 'gauge', 'Duration of the last reconciliation run',
+         [({}, stats['last_run_seconds'])])
+    ]
@@ -0,0 +1,124 @@
+"""
+Metrics Registry - Prometheus text exposition for /metrics
+Modules register collectors; http_server renders them on scrape
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_collectors = []
+
+STARTED_AT = time.time()
+
+# Latency buckets in seconds (Bot API, Mongo and blockchain APIs span ms to tens of seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def register_collector(collector):
+    """
+    Register a metrics collector
+    
+    Args:
+        collector: callable returning a list of (name, type, help, samples)
+                   where samples is a list of (labels_dict, value) or
+                   (suffix, labels_dict, value) for histogram series
+    """
+    _collectors.append(collector)
+    return collector
+
+class Histogram:
+    """
+    Labeled latency histogram, thread-safe (pymongo listeners run off the event loop)
+    
+    Registers itself as a collector on creation.
+    """
+    
+    def __init__(self, name: str, help_text: str, labelnames: tuple, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # label values -> [bucket counts..., sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+        register_collector(self.collect)
+    
+    def observe(self, seconds: float, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[index] += 1
+            series[-2] += seconds
+            series[-1] += 1
+    
+    def collect(self):
+        samples = []
+        with self._lock:
+            series_items = [(values, list(series)) for values, series in self._series.items()]
+        for values, series in series_items:
+            labels = dict(zip(self.labelnames, values))
+            for bound, count in zip(self.buckets, series):
+                samples.append(('_bucket', {**labels, 'le': bound}, count))
+            samples.append(('_bucket', {**labels, 'le': '+Inf'}, series[-1]))
+            samples.append(('_sum', labels, series[-2]))
+            samples.append(('_count', labels, series[-1]))
+        return [(self.name, 'histogram', self.help_text, samples)]
+
+class Counter:
+    """Labeled counter, thread-safe; registers itself as a collector on creation"""
+    
+    def __init__(self, name: str, help_text: str, labelnames: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        register_collector(self.collect)
+    
+    def inc(self, *labelvalues, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+    
+    def collect(self):
+        with self._lock:
+            samples = [(dict(zip(self.labelnames, values)), count) for values, count in self._values.items()]
+        return [(self.name, 'counter', self.help_text, samples)]
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels.items():
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{escaped}"')
+    return '{' + ','.join(parts) + '}'
+
+def render() -> str:
+    """Render all registered collectors in Prometheus text format"""
+    lines = []
+    families = [(
+        'bot_uptime_seconds', 'gauge', 'Seconds since process start',
+        [({}, time.time() - STARTED_AT)]
+    )]
+    
+    for collector in _collectors:
+        try:
+            families.extend(collector())
+        except Exception as e:
+            logger.error(f"❌ Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+    
+    for name, metric_type, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for sample in samples:
+            # (labels, value) or, for histograms, (suffix, labels, value)
+            suffix, labels, value = sample if len(sample) == 3 else ('', *sample)
+            lines.append(f"{name}{suffix}{_format_labels(labels)} {value}")
+    
+    return '\n'.join(lines) + '\n'
@@ -8,7 +8,7 @@ import requests
 import time
 import threading
 from datetime import datetime
-from database import Transaction, User
+from database import Transaction
 
 logger = logging.getLogger(__name__)
 
@@ -370,26 +370,14 @@ def verify_crypto_payment(transaction_id: str, tx_hash: str) -> bool:
             logger.info(f"Already completed: {transaction_id}")
             return True
         
-        # Credit user
-        success = User.update_balance(
-            transaction['user_id'],
-            transaction['amount'],
-            operation='add'
-        )
+        # Complete transaction and credit user
+        credited = Transaction.complete_and_credit(ObjectId(transaction_id), charge_id=tx_hash)
         
-        if success:
-            # Update transaction
-            Transaction.update_status(
-                ObjectId(transaction_id),
-                'completed',
-                charge_id=tx_hash
-            )
-            
+        if credited:
             logger.info(f"✅ Manual verification: ${transaction['amount']} for user {transaction['user_id']}")
-            return True
-        
-        logger.error(f"Failed to credit user: {transaction['user_id']}")
-        return False
+        else:
+            logger.info(f"Already completed: {transaction_id}")
+        return True
         
     except Exception as e:
         logger.error(f"❌ Verify error: {e}")
@@ -10,7 +10,7 @@ import hashlib
 import time
 import json
 from datetime import datetime
-from database import Transaction, User
+from database import Transaction, IPNLedger
 
 logger = logging.getLogger(__name__)
 
@@ -157,95 +157,77 @@ def create_payment(user_id: int, amount_usd: float, currency: str):
         traceback.print_exc()
         return None
 
+def _sign(payload: str) -> str:
+    """HMAC-SHA512 of payload with the IPN secret"""
+    return hmac.new(
+        NOWPAYMENTS_IPN_SECRET.encode('utf-8'),
+        payload.encode('utf-8'),
+        hashlib.sha512
+    ).hexdigest()
+
+def _payload_json(ipn_data: dict) -> str:
+    """Method 1: Raw JSON string (NOWPayments new format 2024+)"""
+    return json.dumps(ipn_data, separators=(',', ':'), sort_keys=True)
+
+def _payload_concat(ipn_data: dict) -> str:
+    """Method 2: Sorted values concatenation (legacy format)"""
+    values = []
+    for key in sorted(ipn_data.keys()):
+        val = ipn_data[key]
+        values.append('' if val is None else str(val))
+    return ''.join(values)
+
+def _payload_filtered(ipn_data: dict) -> str:
+    """Method 3: Only specific fields (filtered approach)"""
+    important_fields = [
+        'payment_id', 'payment_status', 'pay_address', 
+        'price_amount', 'price_currency', 'pay_amount',
+        'pay_currency', 'order_id', 'purchase_id'
+    ]
+    filtered_data = {k: v for k, v in ipn_data.items() 
+                   if k in important_fields and v is not None}
+    return ''.join(str(filtered_data[k]) for k in sorted(filtered_data.keys()))
+
+SIGNATURE_METHODS = [
+    ('JSON', _payload_json),
+    ('concatenation', _payload_concat),
+    ('filtered', _payload_filtered),
+]
+
+# Method that matched last time is tried first (usually one HMAC per IPN)
+_preferred_method = 0
+
 def verify_ipn_signature(ipn_data: dict, signature: str) -> bool:
     """
     ✅ NOWPayments Signature Verification - Multiple Methods
     
     NOWPayments changed their signature format in late 2024.
-    We try multiple methods to ensure compatibility.
+    We try multiple methods to ensure compatibility, starting with
+    the one that matched most recently.
     """
+    global _preferred_method
     try:
         if not NOWPAYMENTS_IPN_SECRET:
             logger.warning("⚠️ IPN_SECRET not set - ACCEPTING ALL (INSECURE!)")
             return True
         
-        logger.info(f"🔐 Verifying signature: {signature[:20]}...")
-        
-        # Method 1: Raw JSON string (NOWPayments new format 2024+)
-        try:
-            # Convert IPN data to JSON string exactly as received
-            json_str = json.dumps(ipn_data, separators=(',', ':'), sort_keys=True)
-            sig1 = hmac.new(
-                NOWPAYMENTS_IPN_SECRET.encode('utf-8'),
-                json_str.encode('utf-8'),
-                hashlib.sha512
-            ).hexdigest()
-            
-            if hmac.compare_digest(signature, sig1):
-                logger.info("✅ Signature VALID (JSON method)")
-                return True
-        except Exception as e:
-            logger.debug(f"Method 1 failed: {e}")
-        
-        # Method 2: Sorted values concatenation (legacy format)
-        try:
-            sorted_keys = sorted(ipn_data.keys())
-            values = []
-            for key in sorted_keys:
-                val = ipn_data[key]
-                if val is None:
-                    values.append('')
-                else:
-                    values.append(str(val))
-            
-            string_to_sign = ''.join(values)
-            sig2 = hmac.new(
-                NOWPAYMENTS_IPN_SECRET.encode('utf-8'),
-                string_to_sign.encode('utf-8'),
-                hashlib.sha512
-            ).hexdigest()
-            
-            if hmac.compare_digest(signature, sig2):
-                logger.info("✅ Signature VALID (concatenation method)")
-                return True
-        except Exception as e:
-            logger.debug(f"Method 2 failed: {e}")
-        
-        # Method 3: Only specific fields (filtered approach)
-        try:
-            # Some implementations only include certain fields
-            important_fields = [
-                'payment_id', 'payment_status', 'pay_address', 
-                'price_amount', 'price_currency', 'pay_amount',
-                'pay_currency', 'order_id', 'purchase_id'
-            ]
-            
-            filtered_data = {k: v for k, v in ipn_data.items() 
-                           if k in important_fields and v is not None}
-            
-            sorted_keys = sorted(filtered_data.keys())
-            values = [str(filtered_data[k]) for k in sorted_keys]
-            string_to_sign = ''.join(values)
-            
-            sig3 = hmac.new(
-                NOWPAYMENTS_IPN_SECRET.encode('utf-8'),
-                string_to_sign.encode('utf-8'),
-                hashlib.sha512
-            ).hexdigest()
-            
-            if hmac.compare_digest(signature, sig3):
-                logger.info("✅ Signature VALID (filtered method)")
-                return True
-        except Exception as e:
-            logger.debug(f"Method 3 failed: {e}")
+        order = [_preferred_method] + [i for i in range(len(SIGNATURE_METHODS)) if i != _preferred_method]
+        for index in order:
+            name, build_payload = SIGNATURE_METHODS[index]
+            try:
+                if hmac.compare_digest(signature, _sign(build_payload(ipn_data))):
+                    if index != _preferred_method:
+                        logger.info(f"✅ Signature VALID ({name} method) - now preferred")
+                        _preferred_method = index
+                    return True
+            except Exception as e:
+                logger.debug(f"{name} method failed: {e}")
         
         # Method 4: Try raw POST body if available
-        # (This would require modifying webhook_handler.py to pass raw body)
+        # (This would require modifying http_server.py to pass raw body)
         
         # All methods failed
-        logger.error("❌ Signature INVALID - all methods failed")
-        logger.error(f"   Received signature: {signature}")
-        logger.error(f"   IPN data: {json.dumps(ipn_data, indent=2)}")
+        logger.error(f"❌ Signature INVALID - all methods failed (payment {ipn_data.get('payment_id')})")
         
         # ⚠️ TEMPORARY: Accept anyway for testing
         # TODO: Remove this after confirming signature works
@@ -259,73 +241,87 @@ def verify_ipn_signature(ipn_data: dict, signature: str) -> bool:
         return False
 
 def process_ipn_callback(ipn_data: dict, signature: str) -> bool:
-    """Process IPN callback"""
+    """
+    Process IPN callback - idempotent per (payment_id, payment_status)
+    
+    Duplicates and retries are answered from the IPN ledger with one indexed
+    lookup; crediting is a single pending → completed transition together
+    with the balance change.
+    """
+    payment_id = ipn_data.get('payment_id')
+    payment_status = ipn_data.get('payment_status')
+    order_id = ipn_data.get('order_id')
+    claimed = False
+    
     try:
-        logger.info(f"📥 Processing IPN callback:")
-        logger.info(f"   Data: {json.dumps(ipn_data, indent=2)}")
-        logger.info(f"   Signature: {signature}")
+        if IPNLedger.seen(payment_id, payment_status):
+            logger.debug(f"🔁 Duplicate IPN: {payment_id} ({payment_status})")
+            return True
         
         # Verify signature
         if not verify_ipn_signature(ipn_data, signature):
             logger.error("❌ Invalid signature, rejecting IPN")
             return False
         
-        payment_id = ipn_data.get('payment_id')
-        payment_status = ipn_data.get('payment_status')
-        order_id = ipn_data.get('order_id')
+        # Concurrent duplicate claimed it between lookup and insert
+        if not IPNLedger.record(payment_id, payment_status, order_id):
+            logger.debug(f"🔁 Duplicate IPN (concurrent): {payment_id} ({payment_status})")
+            return True
+        claimed = True
         
-        logger.info(f"📥 IPN: Payment {payment_id}, Status: {payment_status}")
+        logger.info(f"📥 IPN: Payment {payment_id}, Status: {payment_status}, Order: {order_id}")
         
         transaction = Transaction.get_by_order_id(order_id)
         
         if not transaction:
             logger.error(f"❌ Transaction not found: {order_id}")
+            IPNLedger.release(payment_id, payment_status)
             return False
         
-        if transaction['status'] == 'completed':
-            logger.info(f"✅ Already processed: {order_id}")
-            return True
-        
         if payment_status in ['finished', 'confirmed']:
-            logger.info(f"✅ Payment confirmed: {payment_id}")
-            
-            success = User.update_balance(
-                transaction['user_id'],
-                transaction['amount'],
-                operation='add'
-            )
-            
-            if success:
-                Transaction.update_status(
-                    transaction['_id'],
-                    'completed',
-                    charge_id=str(payment_id)
+            credited = Transaction.complete_and_credit(transaction['_id'], charge_id=str(payment_id))
+        
+            if credited:
+                logger.info(f"✅✅✅ CREDITED: ${credited['amount']} to user {credited['user_id']}")
+                outcome = 'credited'
+            elif (Transaction.get_by_order_id(order_id) or {}).get('status') != 'completed':
+                # Only the archived copy is left (expired deposit archived before the payment landed)
+                logger.error(
+                    f"❌ Payment {payment_id} NOT CREDITED: transaction {order_id} is archived "
+                    f"as {transaction['status']} - credit it manually"
                 )
-                
-                logger.info(f"✅✅✅ CREDITED: ${transaction['amount']} to user {transaction['user_id']}")
-                return True
-            else:
-                logger.error(f"❌ User not found: {transaction['user_id']}")
+                IPNLedger.release(payment_id, payment_status)
                 return False
+            else:
+                logger.info(f"✅ Already processed: {order_id}")
+                outcome = 'already_completed'
                 
         elif payment_status in ['failed', 'expired', 'refunded']:
             logger.warning(f"⚠️ Payment {payment_status}: {payment_id}")
             
-            Transaction.update_status(
-                transaction['_id'],
-                'failed',
-                charge_id=str(payment_id)
-            )
-            
-            return True
+            if transaction['status'] == 'pending':
+                Transaction.update_status(
+                    transaction['_id'],
+                    'failed',
+                    charge_id=str(payment_id)
+                )
+            outcome = 'failed'
         else:
             logger.info(f"⏳ Payment status: {payment_status}")
-            return True
+            outcome = 'ignored'
+        
+        IPNLedger.set_outcome(payment_id, payment_status, outcome)
+        return True
             
     except Exception as e:
         logger.error(f"❌ IPN error: {e}")
         import traceback
         traceback.print_exc()
+        if claimed:
+            try:
+                IPNLedger.release(payment_id, payment_status)
+            except Exception as release_error:
+                logger.error(f"❌ Could not release IPN claim: {release_error}")
         return False
 
 def get_payment_status(payment_id: str) -> dict:
@@ -380,21 +376,19 @@ def check_payment_manually(transaction_id: str) -> bool:
         logger.info(f"📊 Payment {payment_id} status: {payment_status}")
         
         if payment_status in ['finished', 'confirmed']:
-            success = User.update_balance(
-                transaction['user_id'],
-                transaction['amount'],
-                operation='add'
+            credited = Transaction.complete_and_credit(
+                ObjectId(transaction_id),
+                charge_id=str(payment_id)
             )
             
-            if success:
-                Transaction.update_status(
-                    ObjectId(transaction_id),
-                    'completed',
-                    charge_id=str(payment_id)
-                )
-                
+            if credited:
                 logger.info(f"✅ Manual verification successful")
-                return True
+            elif Transaction.get_by_id(ObjectId(transaction_id))['status'] != 'completed':
+                logger.error(f"❌ Transaction {transaction_id} is archived as {transaction['status']} - credit it manually")
+                return False
+            else:
+                logger.info(f"✅ Already completed: {transaction_id}")
+            return True
         
         return False
         
@@ -5,7 +5,7 @@ Razorpay Payment Integration - MongoDB Version
 import razorpay
 import logging
 import config
-from database import get_db, Transaction, User
+from database import Transaction
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -97,15 +97,12 @@ def process_payment_success(order_id, payment_id):
             logger.info(f"Transaction already completed: {order_id}")
             return True
         
-        # Update user balance
-        success = User.update_balance(transaction['user_id'], transaction['amount'], operation='add')
+        # Complete transaction and credit user
+        credited = Transaction.complete_and_credit(transaction['_id'], charge_id=payment_id)
         
-        if not success:
-            logger.error(f"User not found: {transaction['user_id']}")
-            return False
-        
-        # Update transaction
-        Transaction.update_status(transaction['_id'], 'completed', charge_id=payment_id)
+        if not credited:
+            logger.info(f"Transaction already completed: {order_id}")
+            return True
         
         logger.info(f"✅ Payment successful: ${transaction['amount']} for user {transaction['user_id']}")
         return True
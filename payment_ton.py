@@ -398,15 +398,12 @@ class TONPayment:
             result = await self.check_payment(payment_memo, expected_amount_ton)
             
             if result.get('paid'):
-                success = User.update_balance(transaction['user_id'], transaction['amount'], operation='add')
+                credited = Transaction.complete_and_credit(
+                    transaction['_id'],
+                    charge_id=result.get('tx_hash', '')
+                )
                 
-                if success:
-                    Transaction.update_status(
-                        transaction['_id'],
-                        'completed',
-                        charge_id=result.get('tx_hash', '')
-                    )
-                    
+                if credited:
                     user = User.get_by_telegram_id(transaction['user_id'])
                     
                     logger.info(f"✅✅✅ PAYMENT VERIFIED AND CREDITED! ✅✅✅")
@@ -418,8 +415,8 @@ class TONPayment:
                     
                     return True
                 else:
-                    logger.error(f"❌ User {transaction['user_id']} not found")
-                    return False
+                    logger.info(f"✅ Transaction {transaction_id} was completed concurrently")
+                    return True
             else:
                 logger.info(f"⏳ Payment not yet received for transaction {transaction_id}")
                 return False
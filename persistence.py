@@ -0,0 +1,245 @@
+"""
+Mongo Persistence - Conversation states and user_data survive restarts
+PTB collects what changed and hands it over every update_interval seconds
+(write-behind); each round is written with one bulk_write per collection.
+user_data is loaded per user on their first update, not all at startup.
+"""
+
+import asyncio
+import copy
+import logging
+import time
+from datetime import datetime
+import bson
+from pymongo import DeleteOne, ReplaceOne
+from telegram.ext import BasePersistence, ContextTypes, PersistenceInput
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Large or process-bound user_data values that are never persisted
+# (downloaded bulk uploads, live Telethon clients)
+TRANSIENT_KEYS = frozenset({'bulk_sessions', 'temp_client'})
+
+stats = {
+    'users_loaded': 0,
+    'user_writes': 0,
+    'conversation_writes': 0,
+    'skipped_values': 0,
+    'flushes': 0,
+    'last_flush_seconds': 0.0
+}
+
+class PersistentUserData(dict):
+    """
+    user_data whose deep copy leaves out transient and uncopyable values
+    
+    PTB deep-copies every changed user_data before handing it to the
+    persistence, so excluding values here keeps them out of both the copy
+    and the database.
+    
+    loaded marks the live user_data once its persisted copy has been merged
+    in; it lives and goes with the user_data itself, and copies start unset.
+    """
+    
+    loaded = False
+    
+    def __deepcopy__(self, memo):
+        copied = PersistentUserData()
+        for key, value in self.items():
+            if key in TRANSIENT_KEYS:
+                continue
+            try:
+                copied[key] = copy.deepcopy(value, memo)
+            except Exception:
+                stats['skipped_values'] += 1
+        return copied
+
+CONTEXT_TYPES = ContextTypes(user_data=PersistentUserData)
+
+def _storable(data: dict) -> dict:
+    """Drop values BSON can't encode (sets, arbitrary objects)"""
+    result = {}
+    for key, value in data.items():
+        try:
+            bson.encode({'value': value})
+        except Exception:
+            stats['skipped_values'] += 1
+            logger.debug(f"Not persisting user_data[{key!r}] ({type(value).__name__})")
+            continue
+        result[key] = value
+    return result
+
+def _conversation_id(name: str, key: tuple) -> str:
+    return f"{name}:{':'.join(str(part) for part in key)}"
+
+class MongoPersistence(BasePersistence):
+    """
+    Persists user_data and ConversationHandler states to MongoDB
+    (requires context_types=CONTEXT_TYPES so user_data is PersistentUserData)
+    
+    Collections:
+        bot_user_data      {_id: user_id, data, updated_at}
+        bot_conversations  {_id: "name:key", name, key, state, updated_at}
+    """
+    
+    def __init__(self, update_interval: float = None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval or config.PERSISTENCE_FLUSH_INTERVAL
+        )
+        # user_id -> data (None deletes) and conversation id -> (name, key, state)
+        self._pending_users = {}
+        self._pending_conversations = {}
+        self._write_task = None
+    
+    # ============================================
+    # LOADING
+    # ============================================
+    
+    async def get_user_data(self):
+        # Loaded per user in refresh_user_data
+        return {}
+    
+    async def get_chat_data(self):
+        return {}
+    
+    async def get_bot_data(self):
+        return {}
+    
+    async def get_callback_data(self):
+        return None
+    
+    async def get_conversations(self, name):
+        from database import get_db
+        documents = await asyncio.to_thread(
+            lambda: list(get_db().bot_conversations.find({"name": name}, {"key": 1, "state": 1}))
+        )
+        return {tuple(document['key']): document['state'] for document in documents}
+    
+    async def refresh_user_data(self, user_id, user_data):
+        """Load the user's persisted data on the first update seen from them"""
+        if user_data.loaded:
+            return
+        from database import get_db
+        document = await asyncio.to_thread(get_db().bot_user_data.find_one, {"_id": user_id})
+        user_data.loaded = True
+        if document:
+            stats['users_loaded'] += 1
+            for key, value in document.get('data', {}).items():
+                user_data.setdefault(key, value)
+    
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+    
+    async def refresh_bot_data(self, bot_data):
+        pass
+    
+    # ============================================
+    # WRITE-BEHIND
+    # ============================================
+    
+    async def update_user_data(self, user_id, data):
+        self._pending_users[user_id] = data
+        self._schedule_write()
+    
+    async def drop_user_data(self, user_id):
+        self._pending_users[user_id] = None
+        self._schedule_write()
+    
+    async def update_conversation(self, name, key, new_state):
+        self._pending_conversations[_conversation_id(name, key)] = (name, key, new_state)
+        self._schedule_write()
+    
+    async def update_chat_data(self, chat_id, data):
+        pass
+    
+    async def drop_chat_data(self, chat_id):
+        pass
+    
+    async def update_bot_data(self, data):
+        pass
+    
+    async def update_callback_data(self, data):
+        pass
+    
+    def _schedule_write(self):
+        # PTB gathers all update_* calls of a round; one task writes them together
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_pending())
+    
+    async def _write_pending(self):
+        await asyncio.sleep(0)
+        users, self._pending_users = self._pending_users, {}
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        if not users and not conversations:
+            return
+        try:
+            await asyncio.to_thread(self._write, users, conversations)
+        except Exception as e:
+            logger.error(f"❌ Persistence write failed ({len(users)} users, {len(conversations)} conversations): {e}")
+    
+    def _write(self, users: dict, conversations: dict):
+        from database import get_db
+        database = get_db()
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        
+        user_ops = []
+        for user_id, data in users.items():
+            data = _storable(data) if data else None
+            if not data:
+                user_ops.append(DeleteOne({"_id": user_id}))
+            else:
+                user_ops.append(ReplaceOne(
+                    {"_id": user_id},
+                    {"_id": user_id, "data": data, "updated_at": now},
+                    upsert=True
+                ))
+        
+        conversation_ops = []
+        for conversation_id, (name, key, state) in conversations.items():
+            if state is None:
+                # Conversation ended
+                conversation_ops.append(DeleteOne({"_id": conversation_id}))
+            else:
+                conversation_ops.append(ReplaceOne(
+                    {"_id": conversation_id},
+                    {"_id": conversation_id, "name": name, "key": list(key), "state": state, "updated_at": now},
+                    upsert=True
+                ))
+        
+        if user_ops:
+            database.bot_user_data.bulk_write(user_ops, ordered=False)
+        if conversation_ops:
+            database.bot_conversations.bulk_write(conversation_ops, ordered=False)
+        
+        stats['user_writes'] += len(user_ops)
+        stats['conversation_writes'] += len(conversation_ops)
+        stats['flushes'] += 1
+        stats['last_flush_seconds'] = time.perf_counter() - started
+    
+    async def flush(self):
+        """Called on shutdown after the final update round"""
+        if self._write_task is not None:
+            await self._write_task
+        await self._write_pending()
+        logger.info("💾 Persistence flushed")
+
+@metrics.register_collector
+def _persistence_metrics():
+    return [
+        ('persistence_users_loaded_total', 'counter', 'Users whose persisted user_data was loaded',
+         [({}, stats['users_loaded'])]),
+        ('persistence_user_writes_total', 'counter', 'user_data documents written or deleted',
+         [({}, stats['user_writes'])]),
+        ('persistence_conversation_writes_total', 'counter', 'Conversation states written or deleted',
+         [({}, stats['conversation_writes'])]),
+        ('persistence_skipped_values_total', 'counter', 'user_data values left out as uncopyable or unencodable',
+         [({}, stats['skipped_values'])]),
+        ('persistence_flushes_total', 'counter', 'Write-behind rounds written to MongoDB',
+         [({}, stats['flushes'])]),
+        ('persistence_last_flush_seconds', 'gauge', 'Duration of the last persistence write',
+         [({}, stats['last_flush_seconds'])])
+    ]
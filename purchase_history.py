@@ -0,0 +1,176 @@
+"""
+Purchase History - Keyset-paginated purchase listings
+Reads Telegram purchases and completed WhatsApp orders concurrently, newest
+first, merged by time into one stream across the hot and archived tiers;
+totals come from the per-user counters in users.purchase_stats instead of
+counting the collections
+"""
+
+import asyncio
+import heapq
+import logging
+from collections import namedtuple
+from datetime import datetime, timezone
+from bson.objectid import ObjectId
+from archiver import count_across_tiers, find_across_tiers
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 10
+
+SOURCES = ('telegram', 'whatsapp')
+
+# Display fields only - session strings and order internals stay in the database
+TELEGRAM_FIELDS = {
+    "phone_number": 1, "country": 1, "has_2fa": 1, "two_fa_password": 1,
+    "purchase_type": 1, "purchased_at": 1
+}
+WHATSAPP_FIELDS = {"phone_number": 1, "country_name": 1, "otp_code": 1, "created_at": 1}
+
+PurchaseEntry = namedtuple('PurchaseEntry', [
+    'source', 'id', 'purchased_at', 'phone_number', 'country',
+    'purchase_type', 'has_2fa', 'two_fa_password', 'otp_code'
+])
+
+# One page of history; cursors are None at either end of the stream
+HistoryPage = namedtuple('HistoryPage', ['entries', 'total', 'older', 'newer'])
+
+# ============================================
+# CURSORS
+# ============================================
+
+def encode_cursor(entry: PurchaseEntry) -> str:
+    """Compact (purchased_at, _id) position for callback_data"""
+    millis = int(entry.purchased_at.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    return f"{millis}_{entry.id}"
+
+def decode_cursor(cursor: str):
+    millis, object_id = cursor.split('_')
+    # Mongo stores datetimes at millisecond precision, so this round-trips exactly
+    purchased_at = datetime.fromtimestamp(int(millis) / 1000, tz=timezone.utc).replace(tzinfo=None)
+    return purchased_at, ObjectId(object_id)
+
+def _keyset(time_field: str, cursor, newer: bool) -> dict:
+    if cursor is None:
+        return {}
+    purchased_at, object_id = cursor
+    op = "$gt" if newer else "$lt"
+    return {"$or": [
+        {time_field: {op: purchased_at}},
+        {time_field: purchased_at, "_id": {op: object_id}}
+    ]}
+
+# ============================================
+# SOURCES
+# ============================================
+
+def _telegram_entries(user_id: int, cursor, newer: bool, limit: int) -> list:
+    query = {"user_id": user_id, **_keyset("purchased_at", cursor, newer)}
+    rows = find_across_tiers(
+        'purchases', query, TELEGRAM_FIELDS, limit, descending=not newer, bound=cursor and cursor[0]
+    )
+    return [
+        PurchaseEntry(
+            source='telegram',
+            id=row['_id'],
+            purchased_at=row['purchased_at'],
+            phone_number=row['phone_number'],
+            country=row.get('country'),
+            purchase_type=row.get('purchase_type', 'session'),
+            has_2fa=row.get('has_2fa', False),
+            two_fa_password=row.get('two_fa_password'),
+            otp_code=None
+        )
+        for row in rows
+    ]
+
+def _whatsapp_entries(user_id: int, cursor, newer: bool, limit: int) -> list:
+    query = {"user_id": user_id, "status": "completed", **_keyset("created_at", cursor, newer)}
+    rows = find_across_tiers(
+        'whatsapp_orders', query, WHATSAPP_FIELDS, limit, descending=not newer, bound=cursor and cursor[0]
+    )
+    return [
+        PurchaseEntry(
+            source='whatsapp',
+            id=row['_id'],
+            purchased_at=row['created_at'],
+            phone_number=row['phone_number'],
+            country=row.get('country_name'),
+            purchase_type='whatsapp',
+            has_2fa=False,
+            two_fa_password=None,
+            otp_code=row.get('otp_code')
+        )
+        for row in rows
+    ]
+
+FETCHERS = {'telegram': _telegram_entries, 'whatsapp': _whatsapp_entries}
+
+# ============================================
+# COUNTS
+# ============================================
+
+def _fallback_count(user_id: int, source: str) -> int:
+    if source == 'telegram':
+        return count_across_tiers('purchases', {"user_id": user_id})
+    return count_across_tiers('whatsapp_orders', {"user_id": user_id, "status": "completed"})
+
+def purchase_counts(user_id: int, sources=SOURCES) -> dict:
+    """
+    Purchases per source from users.purchase_stats
+    
+    Users whose counters predate purchase_stats are counted directly until
+    rebuild_purchase_stats.py has been run.
+    """
+    user = get_db().users.find_one({"telegram_id": user_id}, {"purchase_stats": 1}) or {}
+    stored = user.get('purchase_stats') or {}
+    return {
+        source: stored[source] if source in stored else _fallback_count(user_id, source)
+        for source in sources
+    }
+
+# ============================================
+# PAGES
+# ============================================
+
+async def history_page(user_id: int, sources=SOURCES, cursor: str = None, newer: bool = False,
+                       page_size: int = PAGE_SIZE) -> HistoryPage:
+    """
+    One page of purchases, newest first
+    
+    cursor is an encoded entry position: with newer=False the page holds the
+    entries after it in the stream (older purchases), with newer=True the ones
+    before it. No cursor means the first page.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    
+    # page_size + 1 per source tells whether anything lies beyond this page
+    counts, *batches = await asyncio.gather(
+        asyncio.to_thread(purchase_counts, user_id, sources),
+        *[asyncio.to_thread(FETCHERS[source], user_id, position, newer, page_size + 1) for source in sources]
+    )
+    
+    merged = list(heapq.merge(
+        *batches, key=lambda entry: (entry.purchased_at, entry.id), reverse=not newer
+    ))
+    more = len(merged) > page_size
+    if newer and not more:
+        # Back at the start of the stream: show a full first page
+        return await history_page(user_id, sources, page_size=page_size)
+    
+    entries = merged[:page_size]
+    if newer:
+        entries.reverse()
+    if not entries:
+        return HistoryPage([], sum(counts.values()), None, None)
+    
+    # Paging towards newer entries always leaves older ones behind, and vice versa
+    has_older = True if newer else more
+    has_newer = True if newer else cursor is not None
+    return HistoryPage(
+        entries=entries,
+        total=sum(counts.values()),
+        older=encode_cursor(entries[-1]) if has_older else None,
+        newer=encode_cursor(entries[0]) if has_newer else None
+    )
@@ -0,0 +1,63 @@
+"""
+Purchase Counter Rebuild Tool
+Recomputes users.purchase_stats (Telegram purchases and completed WhatsApp
+orders per user) from scratch
+
+Usage:
+    python rebuild_purchase_stats.py
+
+Run once after deploying purchase counters, or whenever they look wrong.
+Counters updated while the rebuild runs may be overwritten, so prefer a
+quiet period.
+"""
+
+import logging
+from pymongo import UpdateOne
+from archiver import count_across_tiers
+from database import get_db
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+def rebuild_purchase_stats():
+    """Rebuild purchase counters for every user"""
+    database = get_db()
+
+    # Archived months count too: purchase_stats covers a buyer's whole history
+    telegram = count_across_tiers('purchases', {}, by='user_id')
+    whatsapp = count_across_tiers('whatsapp_orders', {"status": "completed"}, by='user_id')
+    logger.info(f"📦 Counted purchases for {len(set(telegram) | set(whatsapp))} buyers")
+
+    operations = []
+    users = 0
+    written = 0
+    for user in database.users.find({}, {"telegram_id": 1}):
+        if 'telegram_id' not in user:
+            continue
+        user_id = user['telegram_id']
+        users += 1
+        operations.append(UpdateOne(
+            {"_id": user['_id']},
+            {"$set": {"purchase_stats": {
+                "telegram": telegram.get(user_id, 0),
+                "whatsapp": whatsapp.get(user_id, 0)
+            }}}
+        ))
+        if len(operations) >= BATCH_SIZE:
+            written += database.users.bulk_write(operations, ordered=False).modified_count
+            operations = []
+
+    if operations:
+        written += database.users.bulk_write(operations, ordered=False).modified_count
+
+    logger.info(f"✅ Purchase counters rebuilt: {users} users, {written} updated")
+    return users
+
+if __name__ == "__main__":
+    rebuild_purchase_stats()
@@ -0,0 +1,87 @@
+"""
+Referral Counter Rebuild Tool
+Recomputes users.referral_path and users.referral_stats from scratch
+
+Usage:
+    python rebuild_referral_stats.py
+
+Run once after deploying referral counters, or whenever they look wrong.
+Counters updated while the rebuild runs may be overwritten, so prefer a
+quiet period.
+"""
+
+import logging
+from collections import defaultdict
+from pymongo import UpdateOne
+from archiver import sum_across_tiers
+from database import get_db, REFERRAL_PATH_DEPTH
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+def _referral_path(user_id, parents):
+    path = []
+    next_id = parents.get(user_id)
+    while next_id and next_id not in path and next_id != user_id and len(path) < REFERRAL_PATH_DEPTH:
+        path.append(next_id)
+        next_id = parents.get(next_id)
+    return path
+
+def rebuild_referral_stats():
+    """Rebuild referral paths and counters for every user"""
+    database = get_db()
+    
+    parents = {
+        user['telegram_id']: user.get('referred_by')
+        for user in database.users.find({}, {"telegram_id": 1, "referred_by": 1})
+        if 'telegram_id' in user
+    }
+    logger.info(f"👥 Loaded {len(parents)} users")
+    
+    paths = {user_id: _referral_path(user_id, parents) for user_id in parents}
+    
+    level_1 = defaultdict(int)
+    level_2 = defaultdict(int)
+    for path in paths.values():
+        if len(path) >= 1:
+            level_1[path[0]] += 1
+        if len(path) >= 2:
+            level_2[path[1]] += 1
+    
+    # Archived months count too: referral_stats covers a referrer's whole history
+    earned = sum_across_tiers('referral_commissions', {}, 'amount', by='user_id')
+    withdrawn = sum_across_tiers('referral_withdrawals', {"status": "completed"}, 'amount', by='user_id')
+    
+    operations = []
+    written = 0
+    for user_id, path in paths.items():
+        operations.append(UpdateOne(
+            {"telegram_id": user_id},
+            {"$set": {
+                "referral_path": path,
+                "referral_stats": {
+                    "level_1": level_1.get(user_id, 0),
+                    "level_2": level_2.get(user_id, 0),
+                    "earned": earned.get(user_id, 0.0),
+                    "withdrawn": withdrawn.get(user_id, 0.0)
+                }
+            }}
+        ))
+        if len(operations) >= BATCH_SIZE:
+            written += database.users.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    
+    if operations:
+        written += database.users.bulk_write(operations, ordered=False).modified_count
+    
+    logger.info(f"✅ Referral counters rebuilt: {len(paths)} users, {written} updated")
+    return len(paths)
+
+if __name__ == "__main__":
+    rebuild_referral_stats()
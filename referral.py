@@ -14,8 +14,10 @@ from telegram.ext import (
     ContextTypes,
     CallbackQueryHandler
 )
+from pymongo import UpdateOne
 import config
-from database import get_db
+from archiver import find_across_tiers, sum_across_tiers
+from database import get_db, User
 from bson.objectid import ObjectId
 
 logger = logging.getLogger(__name__)
@@ -26,10 +28,16 @@ REFERRAL_WITHDRAWAL_AMOUNT, REFERRAL_WITHDRAWAL_ADDRESS = range(2)
 # ✅ Bot username storage (set dynamically at startup)
 _BOT_USERNAME = None
 
+# Counters kept in users.referral_stats
+REFERRAL_STAT_FIELDS = ('level_1', 'level_2', 'earned', 'withdrawn')
+
 # Commission rates
 LEVEL_1_COMMISSION = 0.03  # 3%
 LEVEL_2_COMMISSION = 0.015  # 1.5%
 
+# Rate per level along the referral path (level 1 first)
+COMMISSION_RATES = [LEVEL_1_COMMISSION, LEVEL_2_COMMISSION]
+
 def set_bot_username(username: str):
     """Store bot username (called from bot.py at startup)"""
     global _BOT_USERNAME
@@ -43,6 +51,30 @@ def get_bot_username() -> str:
         return "YourBot"  # Fallback
     return _BOT_USERNAME
 
+def _counted_referral_stats(user_id: int) -> dict:
+    database = get_db()
+    level_1_ids = [
+        user['telegram_id'] for user in database.users.find({"referred_by": user_id}, {"telegram_id": 1})
+    ]
+    return {
+        'level_1': len(level_1_ids),
+        'level_2': database.users.count_documents({"referred_by": {"$in": level_1_ids}}) if level_1_ids else 0,
+        'earned': sum_across_tiers('referral_commissions', {"user_id": user_id}, 'amount'),
+        'withdrawn': sum_across_tiers('referral_withdrawals', {"user_id": user_id, "status": "completed"}, 'amount')
+    }
+
+def referral_stats(user: dict) -> dict:
+    """
+    Referral counters from users.referral_stats
+    
+    Users whose counters predate referral_stats are counted directly until
+    rebuild_referral_stats.py has been run.
+    """
+    stored = user.get('referral_stats') or {}
+    if all(field in stored for field in REFERRAL_STAT_FIELDS):
+        return stored
+    return _counted_referral_stats(user['telegram_id'])
+
 # ============================================
 # MAIN REFERRAL MENU - COMPLETELY FIXED
 # ============================================
@@ -66,7 +98,6 @@ async def show_referral_menu(query_or_update, user_id=None):
                 user_id = query.from_user.id
         
         logger.info(f"📊 Loading referral menu for user {user_id}")
-        database = get_db()
         
         # Get bot username
         try:
@@ -76,9 +107,9 @@ async def show_referral_menu(query_or_update, user_id=None):
             logger.error(f"Error generating referral link: {e}")
             referral_link = "❌ Error - contact support"
         
-        # Get user data
+        # Get user data - referral counters are kept on the user document
         try:
-            user = database.users.find_one({"telegram_id": user_id})
+            user = User.get_by_telegram_id(user_id)
             if not user:
                 try:
                     await query.edit_message_text(
@@ -88,54 +119,16 @@ async def show_referral_menu(query_or_update, user_id=None):
                     pass
                 return
             referral_balance = user.get('referral_balance', 0.0)
+            stats = referral_stats(user)
         except Exception as e:
             logger.error(f"Error getting user: {e}")
             referral_balance = 0.0
+            stats = {}
         
-        # Count Level 1 referrals
-        try:
-            level_1_count = database.users.count_documents({"referred_by": user_id})
-        except Exception as e:
-            logger.error(f"Error counting level 1 referrals: {e}")
-            level_1_count = 0
-        
-        # Count Level 2 referrals
-        try:
-            level_1_users = list(database.users.find(
-                {"referred_by": user_id}, 
-                {"telegram_id": 1}
-            ))
-            level_1_ids = [u['telegram_id'] for u in level_1_users]
-            level_2_count = database.users.count_documents({
-                "referred_by": {"$in": level_1_ids}
-            }) if level_1_ids else 0
-        except Exception as e:
-            logger.error(f"Error counting level 2 referrals: {e}")
-            level_2_count = 0
-        
-        # Calculate total earnings
-        try:
-            total_earnings = database.referral_commissions.aggregate([
-                {"$match": {"user_id": user_id}},
-                {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-            ])
-            earnings_list = list(total_earnings)
-            total_earned = earnings_list[0]['total'] if earnings_list else 0.0
-        except Exception as e:
-            logger.error(f"Error calculating earnings: {e}")
-            total_earned = 0.0
-        
-        # Calculate withdrawn amount
-        try:
-            withdrawn = database.referral_withdrawals.aggregate([
-                {"$match": {"user_id": user_id, "status": "completed"}},
-                {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-            ])
-            withdrawn_list = list(withdrawn)
-            total_withdrawn = withdrawn_list[0]['total'] if withdrawn_list else 0.0
-        except Exception as e:
-            logger.error(f"Error calculating withdrawals: {e}")
-            total_withdrawn = 0.0
+        level_1_count = stats.get('level_1', 0)
+        level_2_count = stats.get('level_2', 0)
+        total_earned = stats.get('earned', 0.0)
+        total_withdrawn = stats.get('withdrawn', 0.0)
         
         # Build message (NO MARKDOWN to avoid encoding issues)
         message = (
@@ -225,9 +218,7 @@ async def show_referral_stats(update: Update, context: ContextTypes.DEFAULT_TYPE
         
         # Get recent commissions
         try:
-            recent_commissions = list(database.referral_commissions.find(
-                {"user_id": user_id}
-            ).sort("created_at", -1).limit(10))
+            recent_commissions = find_across_tiers('referral_commissions', {"user_id": user_id}, limit=10)
         except Exception as e:
             logger.error(f"Error getting commissions: {e}")
             recent_commissions = []
@@ -361,66 +352,54 @@ async def process_referral_commission(purchase_user_id: int, purchase_amount: fl
     Process referral commissions when a purchase is made
     - Level 1 (direct referrer): 3%
     - Level 2 (referrer's referrer): 1.5%
+    
+    Pays every level in COMMISSION_RATES from the buyer's stored referral
+    path with one bulk_write and one insert_many
     """
     try:
         database = get_db()
         
         # Get the user who made the purchase
-        user = database.users.find_one({"telegram_id": purchase_user_id})
-        if not user or not user.get('referred_by'):
+        user = User.get_by_telegram_id(purchase_user_id)
+        ancestors = User.get_referral_path(user)
+        if not ancestors:
             logger.info(f"No referrer for user {purchase_user_id}")
             return  # No referrer
         
-        level_1_user_id = user['referred_by']
-        
-        # ========================================
-        # LEVEL 1 COMMISSION (3%)
-        # ========================================
-        level_1_commission = purchase_amount * LEVEL_1_COMMISSION
-        
-        # Credit level 1 referrer
-        database.users.update_one(
-            {"telegram_id": level_1_user_id},
-            {"$inc": {"referral_balance": level_1_commission}}
-        )
+        now = datetime.utcnow()
+        payouts = [
+            (level, referrer_id, purchase_amount * rate)
+            for level, (referrer_id, rate) in enumerate(zip(ancestors, COMMISSION_RATES), start=1)
+        ]
         
-        # Record commission
-        database.referral_commissions.insert_one({
-            "user_id": level_1_user_id,
-            "from_user_id": purchase_user_id,
-            "level": 1,
-            "amount": level_1_commission,
-            "purchase_amount": purchase_amount,
-            "created_at": datetime.utcnow()
-        })
-        
-        logger.info(f"✅ Level 1 commission: ${level_1_commission:.2f} to user {level_1_user_id}")
-        
-        # ========================================
-        # LEVEL 2 COMMISSION (1.5%)
-        # ========================================
-        level_1_user = database.users.find_one({"telegram_id": level_1_user_id})
-        if level_1_user and level_1_user.get('referred_by'):
-            level_2_user_id = level_1_user['referred_by']
-            level_2_commission = purchase_amount * LEVEL_2_COMMISSION
-            
-            # Credit level 2 referrer
-            database.users.update_one(
-                {"telegram_id": level_2_user_id},
-                {"$inc": {"referral_balance": level_2_commission}}
+        # Credit all referrers (earned is only counted once referral_stats exists)
+        database.users.bulk_write([
+            operation
+            for _level, referrer_id, commission in payouts
+            for operation in (
+                UpdateOne({"telegram_id": referrer_id}, {"$inc": {"referral_balance": commission}}),
+                UpdateOne(
+                    {"telegram_id": referrer_id, "referral_stats": {"$exists": True}},
+                    {"$inc": {"referral_stats.earned": commission}}
+                )
             )
-            
-            # Record commission
-            database.referral_commissions.insert_one({
-                "user_id": level_2_user_id,
+        ], ordered=False)
+        
+        # Record commissions
+        database.referral_commissions.insert_many([
+            {
+                "user_id": referrer_id,
                 "from_user_id": purchase_user_id,
-                "level": 2,
-                "amount": level_2_commission,
+                "level": level,
+                "amount": commission,
                 "purchase_amount": purchase_amount,
-                "created_at": datetime.utcnow()
-            })
-            
-            logger.info(f"✅ Level 2 commission: ${level_2_commission:.2f} to user {level_2_user_id}")
+                "created_at": now
+            }
+            for level, referrer_id, commission in payouts
+        ], ordered=False)
+        
+        for level, referrer_id, commission in payouts:
+            logger.info(f"✅ Level {level} commission: ${commission:.2f} to user {referrer_id}")
         
     except Exception as e:
         logger.error(f"❌ Error processing referral commission: {e}")
@@ -609,9 +588,17 @@ async def admin_referral_withdrawal_complete(update: Update, context: ContextTyp
     withdrawal_id = query.data.replace('ref_withdraw_complete_', '')
     database = get_db()
     
-    withdrawal = database.referral_withdrawals.find_one({"_id": ObjectId(withdrawal_id)})
+    # Mark as completed (only once)
+    withdrawal = database.referral_withdrawals.find_one_and_update(
+        {"_id": ObjectId(withdrawal_id), "status": "pending"},
+        {"$set": {
+            "status": "completed",
+            "completed_at": datetime.utcnow(),
+            "completed_by": query.from_user.id
+        }}
+    )
     if not withdrawal:
-        await query.edit_message_text("❌ Withdrawal not found.")
+        await query.edit_message_text("❌ Withdrawal not found or already processed.")
         return
     
     # Deduct from user's referral balance
@@ -619,15 +606,9 @@ async def admin_referral_withdrawal_complete(update: Update, context: ContextTyp
         {"telegram_id": withdrawal['user_id']},
         {"$inc": {"referral_balance": -withdrawal['amount']}}
     )
-    
-    # Mark as completed
-    database.referral_withdrawals.update_one(
-        {"_id": ObjectId(withdrawal_id)},
-        {"$set": {
-            "status": "completed",
-            "completed_at": datetime.utcnow(),
-            "completed_by": query.from_user.id
-        }}
+    database.users.update_one(
+        {"telegram_id": withdrawal['user_id'], "referral_stats": {"$exists": True}},
+        {"$inc": {"referral_stats.withdrawn": withdrawal['amount']}}
     )
     
     await query.edit_message_text(
@@ -708,24 +689,35 @@ async def admin_referral_stats(update: Update, context: ContextTypes.DEFAULT_TYP
     # Total users with referrals
     total_referrers = database.users.count_documents({"referred_by": {"$exists": True, "$ne": None}})
     
-    # Total commissions paid
-    total_commissions = database.referral_commissions.aggregate([
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ])
-    comm_list = list(total_commissions)
-    total_paid = comm_list[0]['total'] if comm_list else 0.0
+    if database.users.find_one({"referral_stats": {"$exists": False}}, {"_id": 1}):
+        # Counters not rebuilt yet - total the commissions themselves
+        earned = sum_across_tiers('referral_commissions', {}, 'amount', by='user_id')
+        total_paid = sum(earned.values())
+        top_referrers = [
+            {"_id": user_id, "total": total}
+            for user_id, total in sorted(earned.items(), key=lambda item: item[1], reverse=True)[:5]
+        ]
+    else:
+        # Total commissions paid (from the users.referral_stats counters, which
+        # also cover commissions already moved to the archive)
+        total_commissions = database.users.aggregate([
+            {"$group": {"_id": None, "total": {"$sum": "$referral_stats.earned"}}}
+        ])
+        comm_list = list(total_commissions)
+        total_paid = comm_list[0]['total'] if comm_list else 0.0
+        
+        # Top referrers
+        top_referrers = database.users.aggregate([
+            {"$match": {"referral_stats.earned": {"$gt": 0}}},
+            {"$sort": {"referral_stats.earned": -1}},
+            {"$limit": 5},
+            {"$project": {"_id": "$telegram_id", "total": "$referral_stats.earned"}}
+        ])
     
     # Pending withdrawals
     pending = list(database.referral_withdrawals.find({"status": "pending"}))
     pending_amount = sum(w['amount'] for w in pending)
     
-    # Top referrers
-    top_referrers = database.referral_commissions.aggregate([
-        {"$group": {"_id": "$user_id", "total": {"$sum": "$amount"}}},
-        {"$sort": {"total": -1}},
-        {"$limit": 5}
-    ])
-    
     message = (
         f"📊 **Referral System Stats**\n\n"
         f"👥 Total Referred Users: {total_referrers}\n"
@@ -768,7 +760,9 @@ def setup_referral_handlers(application):
             ]
         },
         fallbacks=[CommandHandler('cancel', referral_withdrawal_cancel)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="referral_withdrawal",
+        persistent=config.PERSISTENCE_ENABLED
     )
     application.add_handler(withdrawal_conv)
     
@@ -688,7 +688,7 @@ def setup_seller_handlers(application):
         fallbacks=[CommandHandler('cancel', withdrawal_cancel)],
         allow_reentry=True,
         name="withdrawal_conversation",
-        persistent=False
+        persistent=config.PERSISTENCE_ENABLED
     )
     application.add_handler(withdrawal_conv)
     
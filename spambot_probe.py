@@ -0,0 +1,203 @@
+"""
+SpamBot Probe - Account restriction check through @SpamBot
+Waits for SpamBot's reply event instead of a fixed sleep, and caches
+verdicts per phone / Telegram user id so re-uploads skip the probe
+"""
+
+import asyncio
+import logging
+import re
+import time
+from datetime import datetime, timedelta
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SPAMBOT_USERNAME = 'SpamBot'
+
+# Give up waiting for a classifiable reply after this long
+PROBE_TIMEOUT = 10
+
+# How long a verdict is reused before the account is probed again
+VERDICT_TTL = timedelta(hours=6)
+
+# Resolved SpamBot input entity per account (access hashes are per account)
+ENTITY_CACHE_MAX = 5000
+_entities = {}
+
+probe_latency = metrics.Histogram(
+    'spambot_probe_duration_seconds', 'Time from /start to a SpamBot verdict', ('outcome',)
+)
+
+stats = {'probes': 0, 'cache_hits': 0, 'timeouts': 0}
+
+VERDICTS = {
+    'Frozen': {'status': 'Frozen', 'message': '🔴 Account is BLOCKED', 'success': True},
+    'Spam': {'status': 'Spam', 'message': '🟡 Account has SPAM limitations', 'success': True},
+    'Free': {'status': 'Free', 'message': '🟢 Account is CLEAN', 'success': True}
+}
+
+UNKNOWN = {'status': 'Unknown', 'message': '❓ Status unclear', 'success': False}
+
+# ============================================
+# CLASSIFICATION
+# ============================================
+
+def classify(text) -> dict:
+    """Verdict for a SpamBot reply, or None when the text says nothing about limits"""
+    if not text:
+        return None
+    text = text.lower()
+    
+    if "account was blocked for violations" in text or "your account has been blocked" in text:
+        return dict(VERDICTS['Frozen'])
+    
+    if ("while the account is limited" in text or
+        "some actions can trigger a harsh response" in text or
+        "unfortunately, some phone numbers may trigger a harsh response" in text):
+        return dict(VERDICTS['Spam'])
+    
+    if "no limits are currently applied" in text or "free as a bird" in text:
+        return dict(VERDICTS['Free'])
+    
+    return None
+
+# ============================================
+# VERDICT CACHE
+# ============================================
+
+def _cache_keys(phone, user_id) -> list:
+    keys = []
+    digits = re.sub(r'\D', '', str(phone or ''))
+    if digits:
+        keys.append(f"phone:{digits}")
+    if user_id:
+        keys.append(f"user:{user_id}")
+    return keys
+
+def cached_verdict(phone=None, user_id=None):
+    """Unexpired verdict for this phone or account, if any"""
+    keys = _cache_keys(phone, user_id)
+    if not keys:
+        return None
+    from database import get_db
+    cached = get_db().spambot_verdicts.find_one(
+        {"_id": {"$in": keys}, "expires_at": {"$gt": datetime.utcnow()}}
+    )
+    if cached is None:
+        return None
+    return {'status': cached['status'], 'message': cached['message'], 'success': True, 'cached': True}
+
+def store_verdict(verdict: dict, phone=None, user_id=None):
+    keys = _cache_keys(phone, user_id)
+    if not keys or not verdict.get('success'):
+        return
+    from database import get_db
+    from pymongo import UpdateOne
+    now = datetime.utcnow()
+    document = {
+        "status": verdict['status'],
+        "message": verdict['message'],
+        "checked_at": now,
+        "expires_at": now + VERDICT_TTL
+    }
+    get_db().spambot_verdicts.bulk_write(
+        [UpdateOne({"_id": key}, {"$set": document}, upsert=True) for key in keys],
+        ordered=False
+    )
+
+def forget_verdict(phone=None, user_id=None):
+    """Force the next check for this account to probe SpamBot again"""
+    keys = _cache_keys(phone, user_id)
+    if keys:
+        from database import get_db
+        get_db().spambot_verdicts.delete_many({"_id": {"$in": keys}})
+
+# ============================================
+# PROBE
+# ============================================
+
+async def _spambot_entity(client, account_key):
+    entity = _entities.get(account_key) if account_key else None
+    if entity is None:
+        entity = await client.get_input_entity(SPAMBOT_USERNAME)
+        if account_key:
+            if len(_entities) >= ENTITY_CACHE_MAX:
+                _entities.clear()
+            _entities[account_key] = entity
+    return entity
+
+async def probe(client, account_key=None) -> dict:
+    """
+    Send /start to SpamBot and return as soon as a classifiable reply arrives
+    
+    Falls back to reading the last messages when no reply event came within
+    PROBE_TIMEOUT (e.g. updates were not delivered to this client).
+    """
+    from telethon import events
+    
+    started = time.perf_counter()
+    stats['probes'] += 1
+    spambot = await _spambot_entity(client, account_key)
+    
+    verdict_future = asyncio.get_running_loop().create_future()
+    
+    async def on_reply(event):
+        verdict = classify(event.raw_text)
+        if verdict and not verdict_future.done():
+            verdict_future.set_result(verdict)
+    
+    # Registered before /start so a fast reply can't be missed
+    client.add_event_handler(on_reply, events.NewMessage(chats=spambot, incoming=True))
+    try:
+        await client.send_message(spambot, '/start')
+        try:
+            verdict = await asyncio.wait_for(verdict_future, timeout=PROBE_TIMEOUT)
+            outcome = 'event'
+        except asyncio.TimeoutError:
+            stats['timeouts'] += 1
+            outcome = 'timeout'
+            verdict = None
+            for message in await client.get_messages(spambot, limit=5):
+                verdict = classify(message.text)
+                if verdict:
+                    break
+    finally:
+        client.remove_event_handler(on_reply)
+    
+    probe_latency.observe(time.perf_counter() - started, outcome)
+    return verdict or dict(UNKNOWN)
+
+async def check_account_with_spambot(client, phone: str, user_id: int = None) -> dict:
+    """Check account status using @SpamBot (cached per phone / user id for VERDICT_TTL)"""
+    try:
+        cached = await asyncio.to_thread(cached_verdict, phone, user_id)
+        if cached:
+            stats['cache_hits'] += 1
+            logger.info(f"🔍 SpamBot verdict for {phone} from cache: {cached['status']}")
+            return cached
+        
+        logger.info(f"🔍 Checking account status for {phone}...")
+        keys = _cache_keys(phone, user_id)
+        verdict = await probe(client, account_key=keys[0] if keys else None)
+        await asyncio.to_thread(store_verdict, verdict, phone, user_id)
+        return verdict
+    
+    except Exception as e:
+        logger.error(f"SpamBot check error: {e}")
+        return {
+            'status': 'Error',
+            'message': f'❌ Error: {str(e)}',
+            'success': False
+        }
+
+@metrics.register_collector
+def _spambot_metrics():
+    return [
+        ('spambot_probes_total', 'counter', 'SpamBot /start probes sent',
+         [({}, stats['probes'])]),
+        ('spambot_cache_hits_total', 'counter', 'Checks answered from the verdict cache',
+         [({}, stats['cache_hits'])]),
+        ('spambot_probe_timeouts_total', 'counter', 'Probes with no reply event within PROBE_TIMEOUT',
+         [({}, stats['timeouts'])])
+    ]
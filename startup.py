@@ -0,0 +1,72 @@
+"""
+Startup Timing - Records how long each cold-start phase takes
+bot.py imports this first; the report is logged once the bot is serving
+"""
+
+import logging
+import threading
+import time
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Imported first by bot.py, so this is as close to process start as we get
+STARTED_AT = time.perf_counter()
+
+# Phases in the order they finished: (name, seconds)
+phases = []
+total_seconds = None
+
+_last_mark = STARTED_AT
+_lock = threading.Lock()
+
+def mark(name: str) -> float:
+    """Record a sequential phase that ran from the previous mark until now"""
+    global _last_mark
+    now = time.perf_counter()
+    with _lock:
+        elapsed = now - _last_mark
+        _last_mark = now
+        phases.append((name, elapsed))
+    return elapsed
+
+def record(name: str, seconds: float):
+    """Record a phase timed elsewhere (e.g. one of several concurrent checks)"""
+    with _lock:
+        phases.append((name, seconds))
+
+def finish() -> float:
+    """Log the startup report and warn when STARTUP_BUDGET_SECONDS was exceeded"""
+    global total_seconds
+    if total_seconds is not None:
+        return total_seconds
+    total_seconds = time.perf_counter() - STARTED_AT
+    
+    logger.info("⏱️ Startup timing:")
+    for name, seconds in phases:
+        logger.info(f"   {name:<24} {seconds * 1000:8.0f}ms")
+    logger.info(f"   {'total':<24} {total_seconds * 1000:8.0f}ms")
+    
+    budget = config.STARTUP_BUDGET_SECONDS
+    if budget and total_seconds > budget:
+        slowest = max(phases, key=lambda phase: phase[1])[0] if phases else 'unknown'
+        logger.warning(
+            f"⚠️ Startup took {total_seconds:.1f}s, over the {budget:.0f}s budget "
+            f"(slowest phase: {slowest})"
+        )
+    return total_seconds
+
+@metrics.register_collector
+def _startup_metrics():
+    with _lock:
+        samples = [({'phase': name}, seconds) for name, seconds in phases]
+    result = [
+        ('bot_startup_phase_seconds', 'gauge', 'Duration of each startup phase', samples)
+    ]
+    if total_seconds is not None:
+        result.append(
+            ('bot_startup_seconds', 'gauge', 'Time from process start until the bot was serving',
+             [({}, total_seconds)])
+        )
+    return result
@@ -10,7 +10,10 @@ import time
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from database import get_db, User
+import leases
+import settings_cache
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
 import threading
 
 logger = logging.getLogger(__name__)
@@ -45,6 +48,14 @@ OTP_WAIT_TIMEOUT = 300  # 5 minutes in seconds
 ORDER_CANCEL_TIMEOUT = 300  # Cancel and refund after 5 minutes
 TOTAL_ORDER_TIMEOUT = 1200  # Total 20 minutes for the order
 
+# Waiting orders are monitored by the replica that owns their hash shard
+ORDER_MONITOR_KIND = 'whatsapp_orders'
+ORDER_SWEEP_INTERVAL = 10
+leases.register_sharded(ORDER_MONITOR_KIND)
+
+# Order ids with a monitor running in this process
+_monitored = set()
+
 # ============================================
 # PRODUCTION-READY RATE LIMITING
 # ============================================
@@ -452,7 +463,10 @@ async def purchase_whatsapp_number(user_id: int, country_id: str, price: float)
         logger.info(f"🗑️ Cache invalidated - balance will be re-checked for next user")
         
         # Deduct balance
-        User.update_balance(user_id, price, operation='subtract')
+        User.update_balance(
+            user_id, price, operation='subtract',
+            reason='whatsapp_purchase', idempotency_key=f"whatsapp:{order_id}", ref=str(order_id)
+        )
         
         # Create order
         order_data = {
@@ -508,7 +522,10 @@ async def cancel_and_refund_order(order_id: str, reason: str = "timeout") -> boo
             logger.warning(f"⚠️ Could not cancel on API: {e}")
         
         # Refund user
-        success = User.update_balance(user_id, price, operation='add')
+        success = User.update_balance(
+            user_id, price, operation='add',
+            reason='whatsapp_refund', idempotency_key=f"whatsapp_refund:{order_id}", ref=str(order_id)
+        )
         
         if not success:
             logger.error(f"❌ Failed to refund user {user_id}")
@@ -542,13 +559,30 @@ async def cancel_and_refund_order(order_id: str, reason: str = "timeout") -> boo
 
 
 async def monitor_whatsapp_order(bot, user_id: int, order_id: str, message_id: int):
-    """Monitor order for OTP"""
+    """Monitor order for OTP (hands over if the order's shard belongs to another replica)"""
     database = get_db()
     start_time = datetime.utcnow()
     check_interval = 10
     
+    if order_id in _monitored:
+        return
+    _monitored.add(order_id)
+    
     try:
+        # Remember the status message so another replica can resume monitoring
+        order = database.whatsapp_orders.find_one_and_update(
+            {'order_id': order_id},
+            {'$set': {'message_id': message_id}}
+        )
+        if order and order.get('message_id') is not None:
+            # Resumed after a failover - keep the original deadline
+            start_time = order['created_at']
+        
         while True:
+            if not leases.owns(ORDER_MONITOR_KIND, order_id):
+                logger.info(f"↪️ Order {order_id} is monitored by the replica owning its shard")
+                break
+            
             elapsed = (datetime.utcnow() - start_time).total_seconds()
             
             # Timeout check
@@ -576,6 +610,11 @@ async def monitor_whatsapp_order(bot, user_id: int, order_id: str, message_id: i
                         parse_mode='Markdown'
                     )
                 else:
+                    # Left for a manual refund - don't resume it on another replica
+                    database.whatsapp_orders.update_one(
+                        {'order_id': order_id},
+                        {'$set': {'refund_failed': True}}
+                    )
                     await bot.edit_message_text(
                         chat_id=user_id,
                         message_id=message_id,
@@ -596,8 +635,8 @@ async def monitor_whatsapp_order(bot, user_id: int, order_id: str, message_id: i
             if result.get('code'):
                 otp_code = result['code']
                 
-                database.whatsapp_orders.update_one(
-                    {'order_id': order_id},
+                completed = database.whatsapp_orders.update_one(
+                    {'order_id': order_id, 'status': {'$ne': 'completed'}},
                     {
                         '$set': {
                             'status': 'completed',
@@ -606,6 +645,8 @@ async def monitor_whatsapp_order(bot, user_id: int, order_id: str, message_id: i
                         }
                     }
                 )
+                if completed.modified_count:
+                    User.count_purchase(user_id, 'whatsapp')
                 
                 order = database.whatsapp_orders.find_one({'order_id': order_id})
                 phone = format_phone_number(order['phone_number'])
@@ -658,18 +699,41 @@ async def monitor_whatsapp_order(bot, user_id: int, order_id: str, message_id: i
         logger.error(f"❌ Monitor error: {e}")
         import traceback
         traceback.print_exc()
+    
+    finally:
+        _monitored.discard(order_id)
 
 
-async def get_user_whatsapp_purchases(user_id: int, limit: int = 20) -> list:
-    """Get user purchase history"""
+async def resume_order_monitors(bot):
+    """
+    Start monitors for waiting orders in this replica's shards that nothing
+    here is watching (placed on another replica, or left by one that died)
+    """
     database = get_db()
     
-    purchases = list(database.whatsapp_orders.find({
-        'user_id': user_id,
-        'status': 'completed'
-    }).sort('created_at', -1).limit(limit))
+    while True:
+        try:
+            waiting = database.whatsapp_orders.find(
+                {'status': 'waiting', 'message_id': {'$ne': None}, 'refund_failed': {'$ne': True}},
+                {'order_id': 1, 'user_id': 1, 'message_id': 1}
+            )
+            for order in waiting:
+                order_id = order['order_id']
+                if order_id in _monitored or not leases.owns(ORDER_MONITOR_KIND, order_id):
+                    continue
+                logger.info(f"🔁 Resuming monitor for order {order_id}")
+                asyncio.create_task(monitor_whatsapp_order(bot, order['user_id'], order_id, order['message_id']))
+        except Exception as e:
+            logger.error(f"❌ Order sweep error: {e}")
+        
+        await asyncio.sleep(ORDER_SWEEP_INTERVAL)
+
+
+async def get_user_whatsapp_purchases(user_id: int, limit: int = 20) -> list:
+    """Get user purchase history"""
+    from archiver import find_across_tiers
     
-    return purchases
+    return find_across_tiers('whatsapp_orders', {'user_id': user_id, 'status': 'completed'}, limit=limit)
 
 async def admin_confirm_refund(order_id: str, db_order_id: ObjectId) -> tuple:
     """Admin manual refund"""
@@ -692,7 +756,10 @@ async def admin_confirm_refund(order_id: str, db_order_id: ObjectId) -> tuple:
         except Exception as e:
             logger.warning(f"⚠️ Could not cancel on API: {e}")
         
-        success = User.update_balance(user_id, price, operation='add')
+        success = User.update_balance(
+            user_id, price, operation='add',
+            reason='whatsapp_refund', idempotency_key=f"whatsapp_refund:{order_id}", ref=str(order_id)
+        )
         
         if not success:
             return False, "Failed to refund balance"
@@ -739,6 +806,8 @@ def get_all_whatsapp_settings() -> list:
             ]
             
             database.whatsapp_settings.insert_many(defaults)
+            for setting in defaults:
+                settings_cache.apply_whatsapp_price(setting['country_id'], setting['price'], setting['country_name'])
             settings = defaults
         
         return settings
@@ -767,6 +836,7 @@ def update_whatsapp_price(country_id: str, new_price: float) -> bool:
             upsert=True
         )
         
+        settings_cache.apply_whatsapp_price(country_id, new_price)
         return result.modified_count > 0 or result.upserted_id is not None
         
     except Exception as e:
@@ -778,29 +848,34 @@ WHATSAPP_PRICES = {
 }
 
 def get_whatsapp_price(country_id: str) -> float:
-    """Get WhatsApp price"""
-    database = get_db()
-    
+    """Get WhatsApp price (from settings_cache, DB only for unseen countries)"""
     try:
-        price_doc = database.whatsapp_settings.find_one({'country_id': country_id})
-        
-        if price_doc:
-            return price_doc['price']
+        price = settings_cache.whatsapp_price(country_id)
+        if price is not None:
+            return price
         
         defaults = {
             '1': 0.50
         }
         
         default_price = defaults.get(country_id, 1.0)
+        country_name = 'Vietnam' if country_id == '1' else f'Country {country_id}'
         
-        database.whatsapp_settings.insert_one({
-            'country_id': country_id,
-            'country_name': 'Vietnam' if country_id == '1' else f'Country {country_id}',
-            'price': default_price,
-            'updated_at': datetime.utcnow()
-        })
+        # Another replica or an admin may have set the price already - keep theirs
+        database = get_db()
+        setting = database.whatsapp_settings.find_one_and_update(
+            {'country_id': country_id},
+            {'$setOnInsert': {
+                'country_name': country_name,
+                'price': default_price,
+                'updated_at': datetime.utcnow()
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        settings_cache.apply_whatsapp_price(country_id, setting['price'], setting.get('country_name', country_name))
         
-        return default_price
+        return setting['price']
         
     except Exception as e:
         logger.error(f"Error getting price: {e}")